@@ -0,0 +1,302 @@
+"""
+Per-user admission control for GPU submissions.
+
+Instead of handing every click to `sbatch`, `submit_job` asks `admit`
+whether the submitting user (the `HTTP_UID` recorded in meta.json) still
+has a free slot. A user may have at most `AF3_MAX_JOBS_PER_USER` jobs in
+Slurm at once (pending or running), and the app as a whole at most
+`AF3_MAX_JOBS_TOTAL` (0 = no global cap). Jobs over the limit are kept in
+a local queue (meta status "queued") and `release` submits them, oldest
+first and round-robin between users, as slots free up. A background
+thread started by `start_releaser` calls it periodically.
+
+A job counts as in flight while its Slurm ID is listed by `squeue`. When
+`squeue` cannot be run, jobs count until their results archive or final
+progress state appears. QOS/association limit rejections from `sbatch`
+leave the job queued for a later retry rather than failing it.
+
+Decisions are made under an exclusive lock file in the jobs directory,
+so concurrent callbacks, workers and releaser threads never admit the
+same slot twice. The lock is held only to scan the job directories and
+reserve a slot (meta status "submitting"). `squeue` runs before it is
+taken and `sbatch` after it is released, so one slow scheduler call
+never holds up other users' submissions.
+
+An sbatch call that times out leaves it unknown whether Slurm queued the
+job. Such a job keeps its reservation, and before it is ever submitted
+again `squeue` is asked for a job of the same name (Slurm jobs are named
+after their job directory), so it never runs twice.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from subprocess import CalledProcessError, TimeoutExpired, run
+
+import helpers
+from events import record
+from helpers import read_job_meta, write_job_meta, write_and_submit_script
+
+MAX_JOBS_PER_USER = int(os.environ.get("AF3_MAX_JOBS_PER_USER", 4))
+MAX_JOBS_TOTAL = int(os.environ.get("AF3_MAX_JOBS_TOTAL", 0))
+
+# Seconds between background release passes (0 disables the thread).
+RELEASE_INTERVAL = float(os.environ.get("AF3_ADMISSION_INTERVAL", 30))
+
+# `squeue` next to the configured `sbatch` (e.g. the bin/ shims), unless set.
+SQUEUE = os.environ.get(
+    "AF3_SQUEUE",
+    os.path.join(os.path.dirname(helpers.SBATCH), "squeue") if os.path.dirname(helpers.SBATCH) else "squeue",
+)
+
+# sbatch errors meaning "not now" rather than "never"
+RETRY_MARKERS = ("QOSMax", "AssocMax", "accounting/QOS policy")
+
+LOCK_NAME = ".admission.lock"
+
+# A reservation whose sbatch call never finished (e.g. the worker died, or
+# sbatch timed out after helpers.SBATCH_TIMEOUT) returns to the queue after
+# this many seconds.
+RESERVATION_TIMEOUT = 600
+
+log = logging.getLogger(__name__)
+
+
+def active_slurm_ids() -> set[str] | None:
+    """IDs of this account's pending or running Slurm jobs, or None if squeue failed."""
+    try:
+        result = run(
+            [SQUEUE, "--me", "--noheader", "--format=%i"],
+            capture_output=True, text=True, check=True, timeout=30,
+        )
+    except (OSError, CalledProcessError, TimeoutExpired):
+        return None
+    return {line.strip().split("_")[0] for line in result.stdout.splitlines() if line.strip()}
+
+
+def slurm_ids_by_name(name: str) -> list[str] | None:
+    """IDs of this account's pending or running Slurm jobs called `name`, or None if squeue failed."""
+    try:
+        result = run(
+            [SQUEUE, "--me", "--noheader", f"--name={name}", "--format=%i"],
+            capture_output=True, text=True, check=True, timeout=30,
+        )
+    except (OSError, CalledProcessError, TimeoutExpired):
+        return None
+    return [line.strip().split("_")[0] for line in result.stdout.splitlines() if line.strip()]
+
+
+def in_flight(job_dir: Path, meta: dict, active: set[str] | None, as_of: float | None = None) -> bool:
+    """
+    Whether a job occupies one of its user's slots: it is being submitted,
+    or it was submitted and is still listed by squeue. `as_of` is when
+    `active` was listed; jobs submitted since then count as well.
+    """
+    if meta.get("status") == "submitting":
+        return True
+    if meta.get("status") != "submitted":
+        return False
+    if active is not None:
+        if as_of is not None and meta.get("sbatch_at", 0) >= as_of:
+            return True
+        return str(meta.get("slurm_job_id")) in active
+    # squeue unavailable: count the job until it has visibly finished
+    finished = (meta.get("progress") or {}).get("stage") in ("completed", "failed")
+    return not (finished or (job_dir / f"{job_dir.name}.zip").exists())
+
+
+@contextmanager
+def _locked(base: Path):
+    base.mkdir(parents=True, exist_ok=True)
+    with open(base / LOCK_NAME, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _stale(meta: dict) -> bool:
+    return meta.get("status") == "submitting" and \
+        time.time() - meta.get("reserved_at", 0) > RESERVATION_TIMEOUT
+
+
+def _snapshot(base: Path, active: set[str] | None, as_of: float | None = None) -> tuple[Counter, list[tuple[Path, dict]]]:
+    """In-flight job count per user, and queued jobs oldest first."""
+    counts, queued = Counter(), []
+    for d in base.iterdir():
+        if not d.is_dir() or d.name.startswith("."):
+            continue
+        meta = read_job_meta(d)
+        if meta.get("status") == "queued" or _stale(meta):
+            queued.append((d, meta))
+        elif in_flight(d, meta, active, as_of):
+            counts[meta.get("uid")] += 1
+    queued.sort(key=lambda item: (item[1].get("queued_at", 0), item[0].name))
+    return counts, queued
+
+
+def _has_room(counts: Counter, uid) -> bool:
+    if counts[uid] >= MAX_JOBS_PER_USER:
+        return False
+    return not MAX_JOBS_TOTAL or sum(counts.values()) < MAX_JOBS_TOTAL
+
+
+def _reserve(job_dir: Path) -> None:
+    """Hold a slot for a job while its sbatch call runs (under the lock)."""
+    write_job_meta(job_dir, status="submitting", reserved_at=time.time())
+
+
+def _submit(job_dir: Path, meta: dict) -> dict:
+    """
+    Run sbatch for a job (outside the lock) and record the outcome in
+    meta.json. Rejections caused by QOS/association limits are returned
+    with `retry` set and put the job back in the queue. A job whose
+    earlier sbatch call may have gone through (`meta` still says
+    "submitting") is looked up in squeue first; if that is not possible,
+    or sbatch times out, it stays "submitting" until a later attempt.
+    """
+    if meta.get("status") == "submitting":
+        ids = slurm_ids_by_name(job_dir.name)
+        if ids is None:
+            return {"status": "submitting", "error": "squeue unavailable; not resubmitting a job Slurm may hold"}
+        if ids:
+            return _submitted(job_dir, meta, ids[0])
+    try:
+        job_id = write_and_submit_script(
+            job_dir, meta["email"],
+            num_gpus=meta.get("num_gpus"),
+            stage_local=meta.get("stage_local", False),
+        )
+    except CalledProcessError as e:
+        err = (e.stderr or "").strip() or (e.stdout or "").strip()
+        if any(marker in err for marker in RETRY_MARKERS):
+            write_job_meta(job_dir, status="queued", queued_at=meta.get("queued_at") or time.time())
+            return {"status": "queued", "error": err, "retry": True}
+        return _fail(job_dir, meta, err)
+    except TimeoutExpired:
+        # the job may be queued all the same: never submit it blindly again
+        ids = slurm_ids_by_name(job_dir.name)
+        if ids:
+            return _submitted(job_dir, meta, ids[0])
+        log.warning("sbatch for %s timed out; checking squeue again later", job_dir.name)
+        return {"status": "submitting", "error": f"sbatch did not answer within {helpers.SBATCH_TIMEOUT} s"}
+    except (OSError, ValueError) as e:  # sbatch missing or not executable, bad job name
+        return _fail(job_dir, meta, f"Could not run sbatch: {e}")
+    return _submitted(job_dir, meta, job_id)
+
+
+def _submitted(job_dir: Path, meta: dict, job_id: str) -> dict:
+    write_job_meta(job_dir, status="submitted", slurm_job_id=job_id, sbatch_at=time.time())
+    record(job_dir.parent, "sbatch", job_dir.name, uid=meta.get("uid"), slurm_job_id=job_id)
+    return {"status": "submitted", "slurm_job_id": job_id}
+
+
+def _fail(job_dir: Path, meta: dict, err: str) -> dict:
+    write_job_meta(job_dir, status="submit_failed", error=err)
+    record(job_dir.parent, "submit_failed", job_dir.name, uid=meta.get("uid"), error=err[:200])
+    return {"status": "submit_failed", "error": err}
+
+
+def _queue(job_dir: Path, meta: dict, queued: list, counts: Counter, error: str | None = None) -> dict:
+    write_job_meta(job_dir, status="queued", queued_at=time.time())
+    uid = meta.get("uid")
+    record(job_dir.parent, "queued", job_dir.name, uid=uid, in_flight=counts[uid])
+    position = 1 + sum(1 for _, m in queued if m.get("uid") == uid)
+    return {"status": "queued", "position": position, "in_flight": counts[uid], "error": error}
+
+
+def admit(base: Path, job_dir: Path) -> dict:
+    """
+    Submit a freshly created job now if its user has a free slot and no
+    older queued jobs, otherwise queue it. Returns the outcome: `status`
+    ("submitted", "queued", "submitting" or "submit_failed") plus
+    `slurm_job_id`, or the queue `position` and the user's jobs
+    `in_flight`, or an `error`. "submitting" means sbatch timed out and
+    the release pass settles the job later.
+    """
+    as_of, active = time.time(), active_slurm_ids()
+    with _locked(base):
+        meta = read_job_meta(job_dir)
+        uid = meta.get("uid")
+        counts, queued = _snapshot(base, active, as_of)
+        waiting = any(m.get("uid") == uid for _, m in queued)
+        if waiting or not _has_room(counts, uid):
+            return _queue(job_dir, meta, queued, counts)
+        _reserve(job_dir)
+    result = _submit(job_dir, meta)
+    if result.get("retry"):
+        # the scheduler is full for now: keep the job locally instead
+        return _queue(job_dir, meta, queued, counts, error=result["error"])
+    return result
+
+
+def _has_queued(base: Path) -> bool:
+    return any(
+        meta.get("status") == "queued" or _stale(meta)
+        for meta in (read_job_meta(d) for d in base.iterdir() if d.is_dir() and not d.name.startswith("."))
+    )
+
+
+def release(base: Path) -> list[str]:
+    """
+    Submit queued jobs while their users have free slots, taking the oldest
+    job of the user with the fewest jobs in flight each time. Returns the
+    names of the job directories submitted.
+    """
+    # cheap check first, so an idle queue never runs squeue
+    if not base.exists() or not _has_queued(base):
+        return []
+    as_of, active = time.time(), active_slurm_ids()
+    picked = []
+    with _locked(base):
+        counts, queued = _snapshot(base, active, as_of)
+        per_user: dict = {}
+        for job_dir, meta in queued:
+            per_user.setdefault(meta.get("uid"), []).append((job_dir, meta))
+
+        while per_user:
+            candidates = [uid for uid in per_user if _has_room(counts, uid)]
+            if not candidates:
+                break
+            uid = min(candidates, key=lambda u: (counts[u], per_user[u][0][1].get("queued_at", 0)))
+            job_dir, meta = per_user[uid].pop(0)
+            if not per_user[uid]:
+                del per_user[uid]
+            _reserve(job_dir)
+            counts[uid] += 1
+            picked.append((job_dir, meta))
+
+    released = []
+    for i, (job_dir, meta) in enumerate(picked):
+        result = _submit(job_dir, meta)
+        if result.get("retry"):
+            # scheduler limits reached: give the other reservations back
+            for rest, rest_meta in picked[i + 1:]:
+                write_job_meta(rest, status="queued", queued_at=rest_meta.get("queued_at") or time.time())
+            break
+        if result["status"] == "submitted":
+            released.append(job_dir.name)
+    return released
+
+
+def start_releaser(base: Path, interval: float = RELEASE_INTERVAL) -> threading.Thread | None:
+    """Release queued jobs from `base` every `interval` seconds in a daemon thread."""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                release(base.resolve())
+            except Exception:  # keep the releaser alive across transient errors
+                log.exception("release of queued jobs failed")
+
+    thread = threading.Thread(target=loop, name="af3-admission", daemon=True)
+    thread.start()
+    return thread
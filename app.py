@@ -1,8 +1,16 @@
+import fcntl
+import os
+from pathlib import Path
+
 import dash
 import dash_bootstrap_components as dbc
 
 from layout import serve_layout
 from callbacks import register_callbacks
+from admission import start_releaser
+from ccd_index import start_build
+from progress import start_tracker
+from helpers import JOBS_DIR
 
 
 def create_app(title="AlphaFold 3 Submission"):
@@ -21,8 +29,47 @@ def create_app(title="AlphaFold 3 Submission"):
 
     return app
 
+
+# Held by the one process that runs the background threads.
+BACKGROUND_LOCK = ".background.lock"
+_background_lock = None
+
+
+def start_background_tasks(base: Path = JOBS_DIR) -> bool:
+    """
+    Start the releaser, the CCD index build and the progress tracker, once
+    per jobs directory: only the process holding BACKGROUND_LOCK runs them,
+    so several workers never compete for the same work. The lock is kept
+    until the process exits, when another one may take over.
+    """
+    global _background_lock
+    if _background_lock is not None:
+        return False
+    base.mkdir(parents=True, exist_ok=True)
+    fh = open(base / BACKGROUND_LOCK, "w")
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        fh.close()
+        return False
+    _background_lock = fh
+
+    # submit jobs held back by the per-user limit as slots free up
+    start_releaser(base)
+    # build the CCD index from AF3_CCD_SOURCE if it does not exist yet
+    start_build()
+    # follow unfinished jobs so lifecycle events are recorded unattended
+    start_tracker(base)
+    return True
+
+
 app = create_app()
 
+# WSGI servers import this module in every worker: AF3_BACKGROUND=1 has
+# the first of them run the background threads
+if os.environ.get("AF3_BACKGROUND") == "1":
+    start_background_tasks()
+
 app.clientside_callback(
     """
     function(isDark, urls) {
@@ -37,4 +84,8 @@ app.clientside_callback(
 
 
 if __name__ == "__main__":
+    # the debug reloader's watcher process serves nothing: only the
+    # serving child (restarted on code changes) runs the threads
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_tasks()
     app.run(debug=True, port=8050)
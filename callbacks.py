@@ -1,20 +1,61 @@
 from datetime import datetime
 from pathlib import Path
 import json
+import re
 import uuid
-from subprocess import CalledProcessError
 
-from dash import dcc, ctx, Input, Output, State, MATCH, ALL, Dash, no_update
+from dash import dcc, html, ctx, Input, Output, State, MATCH, ALL, Dash, Patch, no_update
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 
-from layout import serve_history_table
+from layout import serve_history_table, serve_msa_uploads, serve_analytics, TAB_STYLE
+from submission import content_hash, MAX_SEEDS
+from ccd_index import get_index
+from admission import admit, MAX_JOBS_PER_USER
+from precomputed import (
+    save_upload, import_data_json, prune_uploads, attach, job_files,
+    needs_data_pipeline
+)
+from events import record, summary, is_admin
+from progress import annotate_entries, count_tokens, job_progress, TERMINAL_STAGES
 from helpers import (
-    build_submission, create_job_dir, 
-    write_json_input, write_and_submit_script,
-    list_job_entries
+    build_submission, create_job_dir, new_run_id,
+    claim_idempotency_key, release_idempotency_key, prune_idempotency_keys,
+    valid_job_name, read_job_meta,
+    list_job_entries, plan_gpu_tasks, max_seeds_per_job,
+    find_slurm_log, initial_log_offset, read_log_chunk, JOBS_DIR,
+    LOG_VIEW_MAX_CHARS, LOG_VIEW_MAX_CHUNKS,
 )
 
+def _dom_id(component_id: dict) -> str:
+    """The DOM id Dash renders for a pattern-matching id (sorted, compact JSON)."""
+    return json.dumps(component_id, sort_keys=True, separators=(",", ":"))
+
+
+def ccd_suggestions(value: str | None, ions_only: bool = False, limit: int = 20):
+    """
+    Datalist options completing the last comma-separated CCD code in
+    `value`, and whether the input is already invalid: an earlier code is
+    unknown, or no code starts with the one being typed. Nothing is
+    suggested or flagged when no CCD index is available.
+    """
+    index = get_index()
+    if index is None or not value:
+        return [], False
+    # codes are upper-cased on submission (build_submission), so check them that way
+    *done, current = [c.strip().upper() for c in value.split(",")]
+    invalid = any(c and c not in index for c in done)
+    if not current:
+        return [], invalid
+    head = ", ".join(done + [""]) if done else ""
+    options = [
+        html.Option(value=head + comp["code"], label=f"{comp['code']}: {comp['name']}")
+        for comp in index.search(current, limit=limit, ions_only=ions_only)
+    ]
+    invalid = invalid or not (options or index.search(current, limit=1))
+    return options, invalid
+
+
 def register_callbacks(app: Dash):
     @app.callback(
         Output("entity-list", "children"),
@@ -55,25 +96,127 @@ def register_callbacks(app: Dash):
         if entity_type in ["protein", "rna", "dna"]:
             return [
                 dbc.Textarea(id={"type": "sequence", "index": uid}, placeholder=">FASTA sequence", className="mb-2"),
+                serve_msa_uploads(uid, entity_type),
                 dbc.Input(id={"type": "bonded-ids", "index": uid}, placeholder="Bonded Atom Pairs (comma-separated)"),
             ]
         if entity_type == "ligand":
             return [
                 dbc.Input(id={"type": "ligand-smiles", "index": uid}, placeholder="SMILES string", className="mb-2"),
-                dbc.Input(id={"type": "ligand-ccd", "index": uid}, placeholder="CCD codes (comma-separated)"),
+                dbc.Input(
+                    id={"type": "ligand-ccd", "index": uid},
+                    placeholder="CCD codes (comma-separated)",
+                    list=_dom_id({"type": "ccd-options", "index": uid}),
+                    autoComplete="off",
+                ),
+                html.Datalist(id={"type": "ccd-options", "index": uid}),
                 dbc.Input(id={"type": "bonded-ids", "index": uid}, placeholder="Bonded Atom Pairs (comma-separated)"),
             ]
         if entity_type == "ion":
             return [
-                dbc.Input(id={"type": "ion-name", "index": uid}, placeholder="Ion name", className="mb-2"),
+                dbc.Input(
+                    id={"type": "ion-name", "index": uid},
+                    placeholder="Ion name (CCD code, e.g. MG)",
+                    className="mb-2",
+                    list=_dom_id({"type": "ion-options", "index": uid}),
+                    autoComplete="off",
+                ),
+                html.Datalist(id={"type": "ion-options", "index": uid}),
                 dbc.Input(id={"type": "bonded-ids", "index": uid}, placeholder="Bonded Atom Pairs (comma-separated)"),
             ]
         return []
 
+    @app.callback(
+        Output({"type": "ccd-options", "index": MATCH}, "children"),
+        Output({"type": "ligand-ccd", "index": MATCH}, "invalid"),
+        Input({"type": "ligand-ccd", "index": MATCH}, "value"),
+        prevent_initial_call=True,
+    )
+    def suggest_ccd(value):
+        return ccd_suggestions(value)
+
+    @app.callback(
+        Output({"type": "ion-options", "index": MATCH}, "children"),
+        Output({"type": "ion-name", "index": MATCH}, "invalid"),
+        Input({"type": "ion-name", "index": MATCH}, "value"),
+        prevent_initial_call=True,
+    )
+    def suggest_ion(value):
+        return ccd_suggestions(value, ions_only=True)
+
+    @app.callback(
+        Output({"type": "msa-store", "index": MATCH}, "data"),
+        Output({"type": "msa-summary", "index": MATCH}, "children"),
+        Output({"type": "unpaired-upload", "index": MATCH}, "contents"),
+        Output({"type": "paired-upload", "index": MATCH}, "contents"),
+        Output({"type": "template-upload", "index": MATCH}, "contents"),
+        Input({"type": "unpaired-upload", "index": MATCH}, "contents"),
+        Input({"type": "paired-upload", "index": MATCH}, "contents"),
+        Input({"type": "template-upload", "index": MATCH}, "contents"),
+        State({"type": "unpaired-upload", "index": MATCH}, "filename"),
+        State({"type": "paired-upload", "index": MATCH}, "filename"),
+        State({"type": "template-upload", "index": MATCH}, "filename"),
+        State({"type": "msa-store", "index": MATCH}, "data"),
+        prevent_initial_call=True,
+    )
+    def store_msa_upload(unpaired, paired, templates, unpaired_name, paired_name, template_names, refs):
+        """
+        Write uploaded MSAs/templates to disk right away and keep only their
+        references; clearing the Upload contents keeps the file data out of
+        every later request.
+        """
+        kind = ctx.triggered_id["type"].rsplit("-", 1)[0]
+        base = JOBS_DIR.resolve()
+        refs = dict(refs or {})
+        try:
+            if kind == "template" and templates:
+                refs["templates"] = [
+                    save_upload(base, name, data) for name, data in zip(template_names, templates)
+                ]
+            elif kind == "unpaired" and unpaired:
+                refs["unpaired"] = save_upload(base, unpaired_name, unpaired)
+            elif kind == "paired" and paired:
+                refs["paired"] = save_upload(base, paired_name, paired)
+            else:
+                raise PreventUpdate
+        except ValueError as e:
+            return no_update, f"Upload failed: {e}", None, None, None
+        prune_uploads(base)
+
+        summary = []
+        if refs.get("unpaired"):
+            summary.append(f"unpaired: {refs['unpaired'].split('/', 1)[1]}")
+        if refs.get("paired"):
+            summary.append(f"paired: {refs['paired'].split('/', 1)[1]}")
+        if refs.get("templates"):
+            summary.append(f"{len(refs['templates'])} template(s)")
+        return refs, "; ".join(summary), None, None, None
+
+    @app.callback(
+        Output("store-data-json", "data"),
+        Output("data-json-status", "children"),
+        Output("data-json-upload", "contents"),
+        Input("data-json-upload", "contents"),
+        State("data-json-upload", "filename"),
+        prevent_initial_call=True,
+    )
+    def store_data_json(contents, filename):
+        if not contents:
+            raise PreventUpdate
+        try:
+            token, n_chains = import_data_json(JOBS_DIR.resolve(), contents)
+        except ValueError as e:
+            return None, f"{filename}: {e}", None
+        return (
+            {"token": token},
+            f"{filename}: MSAs for {n_chains} chain(s), used for chains with the same sequence",
+            None,
+        )
+
     @app.callback(
         Output("json-preview-content", "children"),
         Output("json-collapse", "is_open"),
         Output("store-submission", "data"),
+        Output("store-submit-key", "data"),
         Input("generate-json-button", "n_clicks"),
         State("job-name", "value"),
         State({"type": "entity-card", "index": ALL}, "id"),
@@ -84,6 +227,9 @@ def register_callbacks(app: Dash):
         State({"type": "ligand-ccd", "index": ALL}, "value"),
         State({"type": "ion-name", "index": ALL}, "value"),
         State({"type": "bonded-ids", "index": ALL}, "value"),
+        State("num-seeds", "value"),
+        State({"type": "msa-store", "index": ALL}, "data"),
+        State("store-data-json", "data"),
         prevent_initial_call=True,
     )
     def generate_json(
@@ -96,28 +242,41 @@ def register_callbacks(app: Dash):
         smiles,
         ccds,
         ions,
-        bonded
+        bonded,
+        num_seeds,
+        msas,
+        data_json,
     ):
         if not job_name:
-            return "Error: Job name is required.", True, None
+            return "Error: Job name is required.", True, None, None
 
         submission = build_submission(
             job_name,
             card_ids, types, copies,
             seqs, smiles, ccds,
-            ions, bonded
+            ions, bonded,
+            num_seeds=num_seeds,
+            msas=msas,
         )
+        # uploaded MSAs/templates are referenced by path, never inlined
+        error = attach(submission, JOBS_DIR.resolve(), (data_json or {}).get("token")) \
+            or submission.validate(ccd=get_index(), max_seeds=min(MAX_SEEDS, max_seeds_per_job()))
+        if error:
+            return f"Error: {error}", True, None, None
 
-        submission_dict = submission.to_json()
-        json_str = json.dumps(submission_dict, indent=2)
-        return json_str, True, submission_dict
+        # serialise once; preview, download and input.json reuse these bytes
+        payload, _ = submission.serialize()
+        json_str = payload.decode("utf-8")
+        stored = {"json": json_str}
+        # a fresh key per generated input lets submit_job drop repeated clicks
+        return json_str, True, stored, uuid.uuid4().hex
 
     @app.callback(
         Output("download-json-button", "style"),
         Input("store-submission", "data"),
     )
-    def toggle_download_button(submission_dict):
-        if submission_dict:
+    def toggle_download_button(stored):
+        if stored:
             return {"display": "inline-block"}
         return {"display": "none"}
 
@@ -125,12 +284,14 @@ def register_callbacks(app: Dash):
         Output("download-json", "data"),
         Input("download-json-button", "n_clicks"),
         State("job-name", "value"),
-        State("json-preview-content", "children"),
+        State("store-submission", "data"),
         prevent_initial_call=True,
     )
-    def download_json(n, job_name, json_str):
-        safe_name = job_name.strip() or "af3_input"
-        return dcc.send_string(json_str, filename=f"{safe_name}.json")
+    def download_json(n, job_name, stored):
+        if not stored:
+            raise PreventUpdate
+        safe_name = (job_name or "").strip() or "af3_input"
+        return dcc.send_string(stored["json"], filename=f"{safe_name}.json")
 
     @app.callback(
         Output("job-status", "children"),
@@ -139,31 +300,117 @@ def register_callbacks(app: Dash):
         State("job-name", "value"),
         State("email", "value"),
         State("store-submission", "data"),
+        State("store-submit-key", "data"),
+        State("uid-store", "data"),
+        State("stage-local", "value"),
         prevent_initial_call=True,
     )
-    def submit_job(n_clicks, job_name, email, submission_dict):
+    def submit_job(n_clicks, job_name, email, stored, submit_key, user_uid, stage_local):
         if not job_name:
             return "Error: Job name is required.", True
+        if not valid_job_name(job_name):
+            return "Error: Job name may only contain letters, digits, '.', '_' and '-', and must start with a letter or digit.", True
         if not email:
             return "Error: Email is required.", True
-        if not submission_dict:
+        if not stored:
             return "Error: Generate JSON first.", True
 
-        # create a timestamped job directory under ./jobs
-        ts = datetime.now().strftime("%Y%m%dT%H%M%S")
-        base = Path("jobs").resolve()
-        job_dir = create_job_dir(base, job_name, ts)
+        # the store is client-side: its content is hashed here, not trusted
+        try:
+            payload = stored["json"].encode("utf-8")
+            fold_input = json.loads(payload)
+            if not isinstance(fold_input, dict):
+                raise ValueError("not a JSON object")
+        except (KeyError, TypeError, AttributeError, ValueError):
+            return "Error: The generated input is invalid. Generate JSON again.", True
+        if len(fold_input.get("modelSeeds") or [1]) > max_seeds_per_job():
+            return f"Error: at most {max_seeds_per_job()} seeds per job. Generate JSON again.", True
 
-        # write the AF3 input JSON
-        json_path = write_json_input(job_dir, submission_dict)
+        # every submission gets its own run ID: <timestamp>-<random suffix>
+        run_id = new_run_id()
+        base = JOBS_DIR.resolve()
+        dir_name = f"{job_name}_{run_id}"
 
-        # write, submit the SLURM script, and capture the job ID
+        # check the uploaded MSAs/templates before the submission is claimed
         try:
-            job_id = write_and_submit_script(job_dir, email)
-            msg = f"Job submitted (ID {job_id} TS {ts}). Notifications → {email}."
-        except CalledProcessError as e:
-            err = e.stderr.strip() or e.stdout.strip()
-            msg = f"Submission failed: {err}"
+            msa_files = job_files(base, fold_input)
+        except ValueError as e:
+            return f"Error: {e}", True
+        missing = [name for name, path in msa_files.items() if not path.is_file()]
+        if missing:
+            return f"Error: uploaded file {missing[0]} is no longer available. Upload it again.", True
+
+        # repeated clicks on the same generated input map to one job
+        prune_idempotency_keys(base)
+        claimed = isinstance(submit_key, str) and re.fullmatch(r"[0-9a-f]{32}", submit_key)
+        if claimed:
+            previous = claim_idempotency_key(base, submit_key, dir_name)
+            if previous:
+                slurm_id = read_job_meta(base / previous).get("slurm_job_id", "pending")
+                return (
+                    f"This input was already submitted (ID {slurm_id} TS {previous.rsplit('_', 1)[-1]}). "
+                    "Generate the JSON again to submit another run."
+                ), True
+
+        # stage the inputs and metadata, then move the job directory into place
+        meta = {
+            "name": job_name,
+            "run_id": run_id,
+            "email": email,
+            "uid": user_uid,
+            "submitted_at": datetime.now().isoformat(timespec="seconds"),
+            "idempotency_key": submit_key,
+            "input_sha256": content_hash(payload),
+            "tokens": count_tokens(fold_input),
+            "num_seeds": len(fold_input.get("modelSeeds") or [1]),
+            "num_gpus": plan_gpu_tasks(len(fold_input.get("modelSeeds") or [1])),
+            "stage_local": bool(stage_local),
+            "status": "created",
+        }
+        try:
+            job_dir = create_job_dir(base, job_name, run_id, files={
+                "input.json": payload,
+                "meta.json": json.dumps(meta, indent=2),
+                **msa_files,
+            })
+        except (OSError, ValueError) as e:
+            # no job exists: let the next click try again
+            if claimed:
+                release_idempotency_key(base, submit_key)
+            return f"Error: could not create the job directory: {e}", True
+
+        record(
+            base, "submit", job_dir.name,
+            uid=user_uid,
+            tokens=meta["tokens"],
+            num_seeds=meta["num_seeds"],
+            num_gpus=meta["num_gpus"],
+            stage_local=meta["stage_local"],
+            data_pipeline=needs_data_pipeline(fold_input),
+            input_bytes=len(payload),
+        )
+
+        # submit now if this user has a free slot, otherwise queue locally
+        result = admit(base, job_dir)
+        if result["status"] == "submitted":
+            msg = f"Job submitted (ID {result['slurm_job_id']} TS {run_id}). Notifications → {email}."
+        elif result["status"] == "queued":
+            msg = (
+                f"Job queued (TS {run_id}): you have {result['in_flight']} jobs on the cluster "
+                f"(limit {MAX_JOBS_PER_USER}). It is submitted automatically when a slot frees up "
+                f"(position {result['position']} in your queue)."
+            )
+        elif result["status"] == "submitting":
+            # Slurm may hold the job: keep the key so it is not submitted twice
+            msg = (
+                f"Slurm did not confirm the submission in time (TS {run_id}). The app checks "
+                "whether the job was queued and submits it otherwise; see the Job History."
+            )
+        else:
+            # nothing reached Slurm: the same input may be submitted again
+            if claimed:
+                release_idempotency_key(base, submit_key)
+            msg = f"Submission failed: {result['error']}"
 
         return msg, True
 
@@ -176,9 +423,11 @@ def register_callbacks(app: Dash):
         if tab != "tab-history":
             return no_update, no_update
 
-        # gather all completed job entries
-        base = Path("jobs").resolve()
+        # gather all job entries
+        base = JOBS_DIR.resolve()
         entries = list_job_entries(base)
+        # stage and ETA per job, parsed incrementally from the Slurm logs
+        annotate_entries(base, entries)
 
         # render the HTML table from those entries
         table = serve_history_table(entries)
@@ -190,9 +439,10 @@ def register_callbacks(app: Dash):
         Output("download-results", "data"),
         Input({"type": "download-history", "index": ALL}, "n_clicks"),
         State("store-history", "data"),
+        State("uid-store", "data"),
         prevent_initial_call=True,
     )
-    def download_results(n_clicks_list, history):
+    def download_results(n_clicks_list, history, user_uid):
         """
         Streams back the ZIP file for the clicked row in the Job History table.
         """
@@ -208,13 +458,98 @@ def register_callbacks(app: Dash):
         if not history or idx >= len(history):
             raise PreventUpdate
 
+        if not history[idx].get("zip"):
+            raise PreventUpdate
         zip_path = Path(history[idx]["zip"])
         if not zip_path.is_file():
             raise PreventUpdate
 
+        record(
+            JOBS_DIR.resolve(), "download", history[idx]["dir"],
+            uid=user_uid, bytes=zip_path.stat().st_size,
+        )
         # send the file to the browser
         return dcc.send_file(str(zip_path))
 
+    @app.callback(
+        Output("log-content", "children"),
+        Output("store-log-viewer", "data"),
+        Output("log-collapse", "is_open"),
+        Output("log-interval", "disabled"),
+        Output("log-title", "children"),
+        Input({"type": "view-log", "index": ALL}, "n_clicks"),
+        Input("log-interval", "n_intervals"),
+        Input("log-close", "n_clicks"),
+        State("store-log-viewer", "data"),
+        State("store-history", "data"),
+        prevent_initial_call=True,
+    )
+    def tail_log(view_clicks, n_intervals, close_clicks, viewer, history):
+        """
+        Open the log viewer for a history row, then append only the bytes
+        written since the previous poll. The read offset lives in this
+        viewer's store, so every browser tab tails independently and each
+        poll reads at most LOG_CHUNK_BYTES from disk. Polling stops once
+        the job is over, and the page keeps at most LOG_VIEW_MAX_CHARS.
+        """
+        triggered = ctx.triggered_id
+        base = JOBS_DIR.resolve()
+
+        if triggered == "log-close":
+            return [], None, False, True, no_update
+
+        # a Log button was clicked: start near the end of the file
+        if isinstance(triggered, dict) and triggered.get("type") == "view-log":
+            idx = triggered["index"]
+            if not (view_clicks[idx] or 0) or not history or idx >= len(history):
+                raise PreventUpdate
+            job_dir = base / Path(history[idx]["dir"]).name
+            log_path = find_slurm_log(job_dir)
+            title = f"Log: {history[idx]['dir']}"
+            if log_path is None:
+                return ["No Slurm output yet, the job has not started."], \
+                    {"dir": job_dir.name, "offset": 0}, True, False, title
+            offset = initial_log_offset(log_path)
+            text, offset = read_log_chunk(log_path, offset)
+            viewer = {"dir": job_dir.name, "log": log_path.name, "offset": offset, "sizes": [len(text)]}
+            return [text], viewer, True, False, title
+
+        # periodic poll: only new bytes are read and appended
+        if not viewer:
+            raise PreventUpdate
+        job_dir = base / Path(viewer["dir"]).name
+        content = Patch()
+        if "log" not in viewer:
+            log_path = find_slurm_log(job_dir)
+            if log_path is None:
+                raise PreventUpdate
+            viewer = {**viewer, "log": log_path.name, "offset": 0, "sizes": []}
+            content.clear()
+        else:
+            log_path = job_dir / "logs" / Path(viewer["log"]).name
+            try:
+                if log_path.stat().st_size < viewer["offset"]:
+                    # rotated or truncated: show it again from the start
+                    viewer = {**viewer, "offset": 0, "sizes": []}
+                    content.clear()
+            except FileNotFoundError:
+                pass
+
+        text, offset = read_log_chunk(log_path, viewer["offset"])
+        if not text:
+            # stop polling once the job is over (archive written, or failed)
+            over = any(job_dir.glob("*.zip")) or job_progress(job_dir)["stage"] in TERMINAL_STAGES
+            if viewer.get("sizes") == []:
+                return content, viewer, no_update, over, no_update
+            return no_update, no_update, no_update, over, no_update
+        content.append(text)
+        # keep at most LOG_VIEW_MAX_CHARS in LOG_VIEW_MAX_CHUNKS pieces, dropping the oldest
+        sizes = viewer.get("sizes", []) + [len(text)]
+        while len(sizes) > 1 and (sum(sizes) > LOG_VIEW_MAX_CHARS or len(sizes) > LOG_VIEW_MAX_CHUNKS):
+            del content[0]
+            sizes.pop(0)
+        return content, {**viewer, "offset": offset, "sizes": sizes}, no_update, False, no_update
+
     @app.callback(
         Output('uid-store', 'data'),
         Input('tabs', 'value'),
@@ -229,3 +564,22 @@ def register_callbacks(app: Dash):
     )
     def display_uid(user_uid):
         return f"You are logged in as: {user_uid}"
+
+    @app.callback(
+        Output('tab-analytics', 'style'),
+        Input('uid-store', 'data')
+    )
+    def show_analytics_tab(user_uid):
+        return TAB_STYLE if is_admin(user_uid) else {**TAB_STYLE, "display": "none"}
+
+    @app.callback(
+        Output('analytics-content', 'children'),
+        Input('tabs', 'value'),
+    )
+    def render_analytics(tab):
+        if tab != "tab-analytics":
+            raise PreventUpdate
+        # the tab is only hidden in the browser; check again here
+        if not is_admin(ctx.headers.get('HTTP_UID')):
+            return dbc.Alert("The analytics page is restricted to administrators.", color="warning")
+        return serve_analytics(summary(JOBS_DIR.resolve()))
@@ -0,0 +1,241 @@
+"""
+On-disk index of the PDB Chemical Component Dictionary (CCD).
+
+The dictionary (`components.cif`, ~400 MB uncompressed) is parsed once
+into a small SQLite table keyed on the component code:
+
+    python ccd_index.py build /path/to/components.cif.gz
+
+The app opens the index lazily on the first lookup (`get_index`). Codes
+are stored in upper case, as in the dictionary, and the app upper-cases
+what users type before checking it. Codes are the table's
+primary key in a WITHOUT ROWID table, so exact lookups and prefix
+searches are single B-tree range scans and take well under a
+millisecond.
+
+If no index has been built but `AF3_CCD_SOURCE` points at a local copy
+of the dictionary, `start_build` builds it in a background thread at
+start-up. Until an index exists, lookups are unavailable and CCD codes
+are not checked.
+"""
+import gzip
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import uuid
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+APP_DIR = Path(__file__).resolve().parent
+
+# Where the index lives, and the dictionary it is built from.
+CCD_INDEX = Path(os.environ.get("AF3_CCD_INDEX", APP_DIR / "data" / "ccd.sqlite"))
+CCD_SOURCE = os.environ.get("AF3_CCD_SOURCE")
+
+SCHEMA = """
+CREATE TABLE components (
+    code    TEXT PRIMARY KEY,
+    name    TEXT NOT NULL,
+    type    TEXT NOT NULL,
+    formula TEXT NOT NULL,
+    is_ion  INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+# single-atom formulas such as "Zn" or "Cl"
+SINGLE_ATOM_RE = re.compile(r"^[A-Z][a-z]?$")
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+
+def iter_components(lines):
+    """
+    Yield one dict per `data_` block of an mmCIF dictionary with the
+    `_chem_comp.*` key/value items (id, name, type, formula, ...). Values may
+    be bare, quoted, on the following line or in a `;` text field.
+    """
+    comp, key, text = None, None, None
+    for raw in lines:
+        line = raw.rstrip("\n")
+        if text is not None:  # inside a ;-delimited text field
+            if line.startswith(";"):
+                comp[key] = " ".join(text).strip()
+                key, text = None, None
+            else:
+                text.append(line.strip())
+            continue
+        if line.startswith("data_"):
+            if comp:
+                yield comp
+            comp, key = {}, None
+            continue
+        if comp is None:
+            continue
+        if key is not None:  # value on the line after its key
+            if line.startswith(";"):
+                text = [line[1:].strip()]
+            else:
+                comp[key] = _unquote(line)
+                key = None
+            continue
+        if line.startswith("_chem_comp."):
+            parts = line.split(None, 1)
+            name = parts[0][len("_chem_comp."):]
+            if len(parts) == 2:
+                comp[name] = _unquote(parts[1])
+            else:
+                key = name
+    if comp:
+        yield comp
+
+
+def is_ion(comp: dict) -> bool:
+    """Charged single-atom components (ZN, MG, CL, ...) are offered as ions."""
+    charge = comp.get("pdbx_formal_charge", "0")
+    return bool(SINGLE_ATOM_RE.match(comp.get("formula", ""))) and charge not in ("0", "?", ".")
+
+
+def _open_source(source: Path):
+    if str(source).endswith(".gz"):
+        return gzip.open(source, "rt", encoding="utf-8", errors="replace")
+    return open(source, encoding="utf-8", errors="replace")
+
+
+def build_index(source: Path, dest: Path = CCD_INDEX) -> int:
+    """
+    Parse the dictionary at `source` into a fresh SQLite index at `dest`.
+    The index is written to a temporary file and renamed into place, so
+    running apps keep reading the previous one until it is complete.
+    Returns the number of components indexed.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}.tmp")
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute(SCHEMA)
+        with _open_source(Path(source)) as fh:
+            rows = (
+                (c["id"], c.get("name", ""), c.get("type", ""), c.get("formula", ""), int(is_ion(c)))
+                for c in iter_components(fh)
+                if c.get("id")
+            )
+            conn.executemany("INSERT OR REPLACE INTO components VALUES (?, ?, ?, ?, ?)", rows)
+        count = conn.execute("SELECT COUNT(*) FROM components").fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, dest)
+    return count
+
+
+def _prefix_end(prefix: str) -> str:
+    """Smallest string greater than every string starting with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class CcdIndex:
+    """Read-only view of a built index; one SQLite connection per thread."""
+
+    def __init__(self, path: Path = CCD_INDEX):
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise FileNotFoundError(f"No CCD index at {self.path}")
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, code: str) -> dict | None:
+        row = self._conn().execute(
+            "SELECT * FROM components WHERE code = ?", (code,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def __contains__(self, code: str) -> bool:
+        return self.lookup(code) is not None
+
+    def search(self, prefix: str, limit: int = 20, ions_only: bool = False) -> list[dict]:
+        """Components whose code starts with `prefix` (case-insensitive), in code order."""
+        prefix = prefix.strip().upper()
+        where, args = "", []
+        if prefix:
+            where, args = "WHERE code >= ? AND code < ?", [prefix, _prefix_end(prefix)]
+        if ions_only:
+            where += (" AND" if where else "WHERE") + " is_ion = 1"
+        rows = self._conn().execute(
+            f"SELECT * FROM components {where} ORDER BY code LIMIT ?", (*args, limit)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
+_index: CcdIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> CcdIndex | None:
+    """
+    The app-wide index, opened on first use. None while no index has been
+    built (see `start_build`); requests never build it themselves.
+    """
+    global _index
+    if _index is not None:
+        return _index
+    with _index_lock:
+        if _index is None and CCD_INDEX.is_file():
+            _index = CcdIndex(CCD_INDEX)
+    return _index
+
+
+def start_build() -> threading.Thread | None:
+    """
+    Build the index from `AF3_CCD_SOURCE` in a daemon thread if it is
+    configured and no index exists yet. `build_index` renames the finished
+    file into place, so `get_index` never opens a partial index.
+    """
+    if CCD_INDEX.is_file() or not (CCD_SOURCE and Path(CCD_SOURCE).is_file()):
+        return None
+
+    def build():
+        try:
+            count = build_index(Path(CCD_SOURCE), CCD_INDEX)
+            log.info("indexed %d CCD components into %s", count, CCD_INDEX)
+        except Exception:
+            log.exception("could not build the CCD index from %s", CCD_SOURCE)
+
+    thread = threading.Thread(target=build, name="af3-ccd-index", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ["build"] and len(argv) in (2, 3):
+        dest = Path(argv[2]) if len(argv) == 3 else CCD_INDEX
+        count = build_index(Path(argv[1]), dest)
+        print(f"Indexed {count} components into {dest}")
+        return 0
+    if argv[:1] == ["search"] and len(argv) == 2:
+        for comp in CcdIndex(CCD_INDEX).search(argv[1]):
+            print(f"{comp['code']}\t{comp['name']}")
+        return 0
+    print("usage: ccd_index.py build <components.cif[.gz]> [index] | search <prefix>", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+"""
+Append-only log of job lifecycle events, and rollups for the admin
+analytics page.
+
+Each event is one JSON line in `<jobs>/.events.jsonl`:
+
+    {"ts": 1767225600.0, "event": "submit", "job": "<job dir>", "uid": ..., ...}
+
+Events recorded by the app:
+
+    submit         job directory created (uid, tokens, seeds, GPUs, options)
+    queued         held back by the per-user limit (admission.py)
+    sbatch         handed to Slurm (slurm_job_id)
+    submit_failed  rejected by sbatch (error)
+    start / stage  stage transitions parsed from the Slurm log (progress.py),
+                   with the time the stage began in `at` (`approx` when
+                   that is only when the log was read); the number
+                   recorded is kept in meta.json (`stages_recorded`), so
+                   restarts and other workers never repeat them
+    finish         final state, plus `sacct` accounting when available
+    download       results archive downloaded (uid, bytes)
+
+`rollup` folds new lines into a per-job summary kept in
+`<jobs>/.events.rollup.json`, together with the byte offset it has
+read up to, so each refresh of the analytics page only parses events
+appended since the previous one. `summary` aggregates those per-job
+records.
+"""
+import fcntl
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from subprocess import CalledProcessError, TimeoutExpired, run
+
+import helpers
+from helpers import atomic_write, read_job_meta, write_job_meta
+
+EVENTS_NAME = ".events.jsonl"
+ROLLUP_NAME = ".events.rollup.json"
+
+# HTTP_UIDs allowed to open the analytics page (comma-separated).
+ADMIN_UIDS = {u.strip() for u in os.environ.get("AF3_ADMIN_UIDS", "").split(",") if u.strip()}
+
+# `sacct` next to the configured `sbatch` (e.g. the bin/ shims), unless set.
+SACCT = os.environ.get(
+    "AF3_SACCT",
+    os.path.join(os.path.dirname(helpers.SBATCH), "sacct") if os.path.dirname(helpers.SBATCH) else "sacct",
+)
+SACCT_FIELDS = ("JobID", "State", "ExitCode", "Submit", "Start", "End", "ElapsedRaw", "AllocTRES")
+SLURM_ACTIVE_STATES = ("PENDING", "RUNNING", "REQUEUED", "RESIZING", "SUSPENDED", "COMPLETING", "CONFIGURING")
+
+# token-count buckets for failure rates by input size
+SIZE_BUCKETS = (500, 1000, 2000, 5000)
+
+log = logging.getLogger(__name__)
+
+
+def is_admin(uid: str | None) -> bool:
+    return uid in ADMIN_UIDS
+
+
+def _line(event: str, job: str | None, **fields) -> str:
+    return json.dumps(
+        {"ts": round(time.time(), 3), "event": event, "job": job, **fields},
+        separators=(",", ":"), default=str,
+    ) + "\n"
+
+
+@contextmanager
+def _locked_log(base: Path):
+    """The event log opened for appending, under an exclusive lock."""
+    base.mkdir(parents=True, exist_ok=True)
+    with open(base / EVENTS_NAME, "a", encoding="utf-8") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield fh
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def record(base: Path, event: str, job: str | None = None, **fields) -> None:
+    """
+    Append one event. The line is written with a single write under an
+    exclusive lock, so concurrent workers never interleave. Failures are
+    logged but never interrupt the caller.
+    """
+    try:
+        with _locked_log(base) as fh:
+            fh.write(_line(event, job, **fields))
+    except OSError:
+        log.exception("could not record %s event", event)
+
+
+def record_stages(job_dir: Path, stages: list, uid: str | None = None) -> None:
+    """
+    Record the stage transitions `[stage, at, exact]` of a job that are not yet in
+    the log. The count already recorded lives in meta.json and is updated
+    under the log's lock, so parsers in other processes, or after a
+    restart, skip what was recorded before.
+    """
+    try:
+        with _locked_log(job_dir.parent) as fh:
+            done = read_job_meta(job_dir).get("stages_recorded", 0)
+            if len(stages) <= done:
+                return
+            fh.write("".join(
+                _line("start" if stage == "started" else "stage", job_dir.name, uid=uid, stage=stage, at=at,
+                      **({} if all(exact) else {"approx": True}))
+                for stage, at, *exact in stages[done:]
+            ))
+            fh.flush()
+            write_job_meta(job_dir, stages_recorded=len(stages))
+    except OSError:
+        log.exception("could not record stages of %s", job_dir.name)
+
+
+# ---------------------------------------------------------------------------
+# Slurm accounting
+# ---------------------------------------------------------------------------
+
+def _parse_slurm_time(value: str) -> float | None:
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S").timestamp()
+    except ValueError:
+        return None  # "Unknown", "None"
+
+
+def _tres(value: str, key: str) -> int:
+    for part in value.split(","):
+        name, _, count = part.partition("=")
+        if name == key:
+            try:
+                return int(count)
+            except ValueError:
+                return 0
+    return 0
+
+
+def sacct_record(slurm_job_id: str) -> dict | None:
+    """
+    Accounting data of a job's allocation from `sacct`, or None when sacct
+    cannot be run or does not know the job.
+    """
+    try:
+        result = run(
+            [SACCT, f"--jobs={slurm_job_id}", "--allocations", "--noheader", "--parsable2",
+             "--format=" + ",".join(SACCT_FIELDS)],
+            capture_output=True, text=True, check=True, timeout=30,
+        )
+    except (OSError, CalledProcessError, TimeoutExpired):
+        return None
+    lines = [l for l in result.stdout.splitlines() if l.strip()]
+    if not lines:
+        return None
+    row = dict(zip(SACCT_FIELDS, lines[0].split("|")))
+    submit, start, end = (_parse_slurm_time(row.get(k, "")) for k in ("Submit", "Start", "End"))
+    return {
+        "state": (row.get("State") or "").split(" ")[0],
+        "exit_code": row.get("ExitCode"),
+        "submit": submit,
+        "start": start,
+        "end": end,
+        "elapsed_s": int(row["ElapsedRaw"]) if (row.get("ElapsedRaw") or "").isdigit() else None,
+        "gpus": _tres(row.get("AllocTRES", ""), "gres/gpu"),
+        "cpus": _tres(row.get("AllocTRES", ""), "cpu"),
+    }
+
+
+def record_finish(job_dir: Path, state: dict) -> bool:
+    """
+    Record the `finish` event of a job whose log shows a final state, once.
+    Waits (returns False) while sacct still lists the job as active, so the
+    event carries the final accounting data. Runs sacct, so it is only
+    called from the background tracker (progress.track_jobs), never from
+    a request.
+    """
+    meta = read_job_meta(job_dir)
+    if meta.get("finish_recorded"):
+        return True
+    acct = sacct_record(meta["slurm_job_id"]) if meta.get("slurm_job_id") else None
+    if acct and acct["state"] in SLURM_ACTIVE_STATES:
+        return False
+    line = _line(
+        "finish", job_dir.name,
+        uid=meta.get("uid"),
+        stage=state["stage"],
+        error=(state.get("error") or "")[:200] or None,
+        started_at=state.get("started_at"),
+        finished_at=state.get("finished_at"),
+        sacct=acct,
+    )
+    try:
+        with _locked_log(job_dir.parent) as fh:
+            # another tracker may have recorded it while sacct ran
+            if not read_job_meta(job_dir).get("finish_recorded"):
+                fh.write(line)
+                fh.flush()
+                write_job_meta(job_dir, finish_recorded=True)
+    except OSError:
+        log.exception("could not record the finish of %s", job_dir.name)
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# rollups
+# ---------------------------------------------------------------------------
+
+def _new_job() -> dict:
+    return {"stages": {}, "downloads": 0, "outcome": None}
+
+
+def apply_event(jobs: dict, ev: dict) -> None:
+    """Fold one event into the per-job records."""
+    name = ev.get("job")
+    if not name:
+        return
+    job = jobs.setdefault(name, _new_job())
+    kind, ts = ev.get("event"), ev.get("ts")
+    if kind == "submit":
+        job.update({k: ev.get(k) for k in ("uid", "tokens", "num_seeds", "num_gpus", "data_pipeline")})
+        job["submitted_at"] = ts
+    elif kind == "queued":
+        job.setdefault("queued_at", ts)
+    elif kind == "sbatch":
+        job["sbatch_at"] = ts
+    elif kind == "submit_failed":
+        job["outcome"] = "submit_failed"
+    elif kind in ("start", "stage"):
+        # the same stage may be seen again after an app restart; keep the first
+        job["stages"].setdefault(ev["stage"], ev.get("at", ts))
+        if ev.get("approx"):
+            job.setdefault("approx", []).append(ev["stage"])
+    elif kind == "finish":
+        job["outcome"] = ev.get("stage")
+        job["started_at"] = ev.get("started_at")
+        job["finished_at"] = ev.get("finished_at")
+        job["sacct"] = ev.get("sacct")
+    elif kind == "download":
+        job["downloads"] += 1
+
+
+_rollup_lock = threading.Lock()
+
+
+def rollup(base: Path) -> dict:
+    """
+    Bring the stored rollup up to date with the event log and return its
+    per-job records. Only complete lines after the stored offset are read.
+    """
+    path, rollup_path = base / EVENTS_NAME, base / ROLLUP_NAME
+    with _rollup_lock:
+        try:
+            state = json.loads(rollup_path.read_text())
+        except (OSError, json.JSONDecodeError):
+            state = {"offset": 0, "jobs": {}}
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return state["jobs"]
+        if size < state["offset"]:  # log was replaced: start over
+            state = {"offset": 0, "jobs": {}}
+        if size == state["offset"]:
+            return state["jobs"]
+
+        with open(path, "rb") as fh:
+            fh.seek(state["offset"])
+            data = fh.read(size - state["offset"])
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            try:
+                apply_event(state["jobs"], json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                continue
+        state["offset"] += len(complete)
+        atomic_write(rollup_path, json.dumps(state, separators=(",", ":")))
+        return state["jobs"]
+
+
+def _size_bucket(tokens: int | None) -> str:
+    if tokens is None:
+        return "unknown"
+    lower = 0
+    for upper in SIZE_BUCKETS:
+        if tokens < upper:
+            return f"{lower}–{upper - 1}"
+        lower = upper
+    return f"≥{lower}"
+
+
+def _quantiles(values: list[float]) -> dict:
+    if not values:
+        return {"n": 0, "median": None, "p90": None}
+    values = sorted(values)
+    return {
+        "n": len(values),
+        "median": statistics.median(values),
+        "p90": values[min(len(values) - 1, int(0.9 * len(values)))],
+    }
+
+
+def queue_wait(job: dict) -> float | None:
+    """Seconds from reaching Slurm to starting, from sacct if known."""
+    acct = job.get("sacct") or {}
+    if acct.get("submit") and acct.get("start"):
+        return acct["start"] - acct["submit"]
+    started = job["stages"].get("started")
+    if started and job.get("sbatch_at"):
+        return max(started - job["sbatch_at"], 0.0)
+    return None
+
+
+def gpu_hours(job: dict) -> float:
+    acct = job.get("sacct") or {}
+    if acct.get("elapsed_s") is not None and acct.get("gpus"):
+        return acct["elapsed_s"] * acct["gpus"] / 3600
+    if job.get("started_at") and job.get("finished_at"):
+        return (job["finished_at"] - job["started_at"]) * (job.get("num_gpus") or 1) / 3600
+    return 0.0
+
+
+def stage_durations(job: dict) -> dict[str, float]:
+    """
+    Seconds spent in each stage, from consecutive stage start times. Stages
+    that begin or end at an `approx` time are left out.
+    """
+    marks = sorted(job["stages"].items(), key=lambda kv: kv[1])
+    if job.get("finished_at"):
+        marks.append(("end", job["finished_at"]))
+    approx = set(job.get("approx", ()))
+    return {
+        stage: max(next_at - at, 0.0)
+        for (stage, at), (next_stage, next_at) in zip(marks, marks[1:])
+        if stage not in approx and next_stage not in approx
+    }
+
+
+def summary(base: Path) -> dict:
+    """Aggregates over all jobs in the event log, for the analytics page."""
+    jobs = rollup(base)
+    finished = [j for j in jobs.values() if j["outcome"] in ("completed", "failed")]
+
+    users: dict = {}
+    for j in jobs.values():
+        u = users.setdefault(j.get("uid") or "unknown", {"jobs": 0, "failed": 0, "gpu_hours": 0.0})
+        u["jobs"] += 1
+        u["failed"] += j["outcome"] in ("failed", "submit_failed")
+        u["gpu_hours"] += gpu_hours(j)
+
+    # buckets in size order, then jobs of unknown size
+    sizes: dict = {_size_bucket(t): {"jobs": 0, "failed": 0} for t in (0, *SIZE_BUCKETS, None)}
+    for j in finished:
+        b = sizes[_size_bucket(j.get("tokens"))]
+        b["jobs"] += 1
+        b["failed"] += j["outcome"] == "failed"
+    sizes = {k: v for k, v in sizes.items() if v["jobs"]}
+
+    stages: dict = {}
+    for j in finished:
+        for stage, seconds in stage_durations(j).items():
+            stages.setdefault(stage, []).append(seconds)
+
+    return {
+        "jobs": len(jobs),
+        "finished": len(finished),
+        "failed": sum(j["outcome"] == "failed" for j in finished),
+        "submit_failed": sum(j["outcome"] == "submit_failed" for j in jobs.values()),
+        "downloads": sum(j["downloads"] for j in jobs.values()),
+        "gpu_hours": sum(gpu_hours(j) for j in jobs.values()),
+        "queue_wait": _quantiles([w for w in map(queue_wait, jobs.values()) if w is not None]),
+        "users": dict(sorted(users.items(), key=lambda kv: -kv[1]["gpu_hours"])),
+        "sizes": sizes,
+        "stages": {s: _quantiles(v) for s, v in stages.items()},
+    }
@@ -0,0 +1,787 @@
+"""
+Local stand-in for the Slurm commands used by the app.
+
+The shims in `bin/` (sbatch, squeue, sacct, scancel, plus singularity,
+module and nvidia-smi) all dispatch into this module, so the submission
+path can be exercised off-cluster:
+
+    export AF3_SBATCH=$PWD/bin/sbatch
+    python app.py
+
+`sbatch` records the job under `$FAKE_SLURM_HOME` and hands it to a
+detached runner process. Runners share a small pool of slots, honour the
+`#SBATCH` job name, output/error paths and time limit of the script, and
+run it with `bin/` first on PATH so that `singularity exec ... run_alphafold.py`
+is answered by a stub that writes an AF3-like output tree after a delay.
+
+Behaviour is tuned through environment variables (seconds / probabilities):
+
+    FAKE_SLURM_HOME              state directory
+    FAKE_SLURM_MAX_RUNNING       size of the runner pool (default 2)
+    FAKE_SLURM_MAX_SUBMITTED     reject submissions above this many queued jobs
+    FAKE_SLURM_SUBMIT_LATENCY    time `sbatch` takes to answer
+    FAKE_SLURM_SUBMIT_FAIL_RATE  probability that `sbatch` rejects a job
+    FAKE_SLURM_QUEUE_DELAY       minimum time a job stays PENDING
+    FAKE_AF3_PIPELINE_DELAY      duration of the stub data pipeline (default 1)
+    FAKE_AF3_SEED_DELAY          duration of stub inference per seed (default 0.5)
+    FAKE_AF3_FAIL_RATE           probability that the stub AF3 run fails
+"""
+import fcntl
+import getpass
+import json
+import math
+import os
+import random
+import re
+import shlex
+import signal
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BIN_DIR = Path(__file__).resolve().parent / "bin"
+
+ACTIVE_STATES = ("PENDING", "RUNNING")
+STATE_CODES = {
+    "PENDING": "PD",
+    "RUNNING": "R",
+    "COMPLETED": "CD",
+    "FAILED": "F",
+    "CANCELLED": "CA",
+    "TIMEOUT": "TO",
+}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def state_dir() -> Path:
+    """Return (and create) the directory holding the fake scheduler state."""
+    default = Path(tempfile.gettempdir()) / f"fake_slurm-{getpass.getuser()}"
+    path = Path(os.environ.get("FAKE_SLURM_HOME", default))
+    (path / "jobs").mkdir(parents=True, exist_ok=True)
+    (path / "slots").mkdir(exist_ok=True)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# job records
+# ---------------------------------------------------------------------------
+
+def _job_file(job_id: str) -> Path:
+    return state_dir() / "jobs" / f"{job_id}.json"
+
+
+def load_job(job_id: str) -> dict | None:
+    try:
+        return json.loads(_job_file(str(job_id)).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_job(job: dict) -> None:
+    path = _job_file(job["id"])
+    tmp = path.with_suffix(f".tmp{os.getpid()}")
+    tmp.write_text(json.dumps(job))
+    os.replace(tmp, path)
+
+
+def update_job(job_id: str, **fields) -> dict | None:
+    """Update a job record unless it has already been cancelled."""
+    job = load_job(job_id)
+    if job is None or job["state"] == "CANCELLED":
+        return job
+    job.update(fields)
+    save_job(job)
+    return job
+
+
+def all_jobs() -> list[dict]:
+    jobs = []
+    for f in (state_dir() / "jobs").glob("*.json"):
+        try:
+            jobs.append(json.loads(f.read_text()))
+        except json.JSONDecodeError:
+            continue
+    jobs.sort(key=lambda j: int(j["id"]))
+    return jobs
+
+
+def _next_job_id() -> str:
+    counter = state_dir() / "next_id"
+    with open(counter, "a+") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        fh.seek(0)
+        current = int(fh.read().strip() or 1000)
+        fh.seek(0)
+        fh.truncate()
+        fh.write(str(current + 1))
+    return str(current)
+
+
+# ---------------------------------------------------------------------------
+# directive parsing
+# ---------------------------------------------------------------------------
+
+def parse_directives(script_text: str) -> dict:
+    """
+    Collect `#SBATCH --key=value` / `#SBATCH -k value` directives from the
+    header of a batch script. Parsing stops at the first command, like Slurm.
+    """
+    short = {"J": "job-name", "o": "output", "e": "error", "t": "time",
+             "p": "partition", "N": "nodes", "a": "array"}
+    directives = {}
+    for line in script_text.splitlines():
+        stripped = line.strip()
+        if not stripped or (stripped.startswith("#") and not stripped.startswith("#SBATCH")):
+            continue
+        if not stripped.startswith("#SBATCH"):
+            break
+        for key, value in _parse_options(shlex.split(stripped[len("#SBATCH"):]), short):
+            directives[key] = value
+    return directives
+
+
+def _parse_options(args: list[str], short: dict | None = None):
+    short = short or {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith("--"):
+            key, sep, value = arg[2:].partition("=")
+            yield key, value if sep else True
+        elif arg.startswith("-") and len(arg) > 1:
+            key = short.get(arg[1], arg[1])
+            if len(arg) > 2:
+                yield key, arg[2:]
+            elif i + 1 < len(args) and not args[i + 1].startswith("-"):
+                yield key, args[i + 1]
+                i += 1
+            else:
+                yield key, True
+        i += 1
+
+
+def parse_time_limit(value: str | None) -> float | None:
+    """
+    Convert a Slurm time specification to seconds. Accepts `M`, `M:S`,
+    `H:M:S`, `D-H`, `D-H:M` and `D-H:M:S`; returns None for no limit.
+    """
+    if not value or value in ("UNLIMITED", "infinite"):
+        return None
+    days = 0
+    if "-" in value:
+        d, value = value.split("-", 1)
+        days = int(d)
+        parts = [int(p) for p in value.split(":")]
+        parts += [0] * (3 - len(parts))
+        hours, minutes, seconds = parts
+    else:
+        parts = [int(p) for p in value.split(":")]
+        if len(parts) == 1:
+            hours, minutes, seconds = 0, parts[0], 0
+        elif len(parts) == 2:
+            hours, (minutes, seconds) = 0, parts
+        else:
+            hours, minutes, seconds = parts
+    return float(((days * 24 + hours) * 60 + minutes) * 60 + seconds)
+
+
+def expand_filename(pattern: str, job: dict) -> str:
+    """Expand the `%x`, `%j`, `%u` and `%%` replacement symbols."""
+    mapping = {"x": job["name"], "j": job["id"], "u": job["user"], "%": "%"}
+    return re.sub(r"%([xju%])", lambda m: mapping[m.group(1)], pattern)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    days, rem = divmod(seconds, 86400)
+    hours, rem = divmod(rem, 3600)
+    minutes, secs = divmod(rem, 60)
+    text = f"{hours:02d}:{minutes:02d}:{secs:02d}"
+    return f"{days}-{text}" if days else text
+
+
+def _fmt_time(ts: float | None) -> str:
+    if ts is None:
+        return "Unknown"
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+# ---------------------------------------------------------------------------
+# sbatch / runner
+# ---------------------------------------------------------------------------
+
+def sbatch(argv: list[str]) -> int:
+    opts, script, script_args = {}, None, []
+    for i, arg in enumerate(argv):
+        if not arg.startswith("-"):
+            script, script_args = arg, argv[i + 1:]
+            break
+        opts.update(_parse_options([arg]))
+
+    time.sleep(_env_float("FAKE_SLURM_SUBMIT_LATENCY", 0))
+    if script is None:
+        print("sbatch: error: Batch script is empty!", file=sys.stderr)
+        return 1
+    script_path = Path(script).resolve()
+    if not script_path.is_file():
+        print(f"sbatch: error: Unable to open file {script}", file=sys.stderr)
+        return 1
+
+    max_submitted = os.environ.get("FAKE_SLURM_MAX_SUBMITTED")
+    queued = sum(1 for j in all_jobs() if j["state"] in ACTIVE_STATES)
+    if (max_submitted and queued >= int(max_submitted)) or \
+            random.random() < _env_float("FAKE_SLURM_SUBMIT_FAIL_RATE", 0):
+        print(
+            "sbatch: error: QOSMaxSubmitJobPerUserLimit\n"
+            "sbatch: error: Batch job submission failed: Job violates "
+            "accounting/QOS policy (job submit limit, user's size and/or time limits)",
+            file=sys.stderr,
+        )
+        return 1
+
+    directives = parse_directives(script_path.read_text())
+    directives.update(opts)
+    job_id = _next_job_id()
+    job = {
+        "id": job_id,
+        "name": directives.get("job-name") or script_path.name,
+        "user": getpass.getuser(),
+        "partition": directives.get("partition", "debug"),
+        "script": str(script_path),
+        "args": script_args,
+        "workdir": os.getcwd(),
+        "directives": directives,
+        "time_limit": parse_time_limit(directives.get("time")),
+        "state": "PENDING",
+        "exit_code": "0:0",
+        "submit": time.time(),
+        "start": None,
+        "end": None,
+        "pid": None,
+        "step_pid": None,
+    }
+    job["output"] = expand_filename(directives.get("output", "slurm-%j.out"), job)
+    if "error" in directives:
+        job["error"] = expand_filename(directives["error"], job)
+    save_job(job)
+
+    runner = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "_run", job_id],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        env=os.environ.copy(),
+    )
+    update_job(job_id, pid=runner.pid)
+
+    if opts.get("parsable"):
+        print(job_id)
+    else:
+        print(f"Submitted batch job {job_id}")
+    return 0
+
+
+def _acquire_slot():
+    """Block until one of the FAKE_SLURM_MAX_RUNNING slots is free."""
+    size = max(1, int(_env_float("FAKE_SLURM_MAX_RUNNING", 2)))
+    slots = state_dir() / "slots"
+    while True:
+        for k in range(size):
+            fh = open(slots / f"{k}.lock", "w")
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fh
+            except BlockingIOError:
+                fh.close()
+        time.sleep(0.2)
+
+
+def _run(job_id: str) -> int:
+    job = load_job(job_id)
+    if job is None:
+        return 1
+
+    ready_at = job["submit"] + _env_float("FAKE_SLURM_QUEUE_DELAY", 0)
+    while time.time() < ready_at:
+        time.sleep(0.1)
+    slot = _acquire_slot()
+
+    job = load_job(job_id)
+    if job is None or job["state"] != "PENDING":
+        return 0
+
+    out_path = Path(job["workdir"]) / job["output"]
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out = open(out_path, "ab")
+    err = out
+    if job.get("error"):
+        err_path = Path(job["workdir"]) / job["error"]
+        err_path.parent.mkdir(parents=True, exist_ok=True)
+        err = open(err_path, "ab")
+
+    env = os.environ.copy()
+    env["PATH"] = f"{BIN_DIR}{os.pathsep}{env.get('PATH', '')}"
+    env.update({
+        "SLURM_JOB_ID": job_id,
+        "SLURM_JOB_NAME": job["name"],
+        "SLURM_SUBMIT_DIR": job["workdir"],
+        "SLURM_JOB_PARTITION": job["partition"],
+        "SLURMD_NODENAME": "fake-node",
+    })
+    env.setdefault("TMPDIR", tempfile.gettempdir())
+
+    proc = subprocess.Popen(
+        ["bash", job["script"], *job["args"]],
+        cwd=job["workdir"],
+        stdin=subprocess.DEVNULL,
+        stdout=out,
+        stderr=err,
+        env=env,
+        start_new_session=True,
+    )
+    update_job(job_id, state="RUNNING", start=time.time(), step_pid=proc.pid)
+
+    state = None
+    try:
+        rc = proc.wait(timeout=job["time_limit"])
+    except subprocess.TimeoutExpired:
+        stamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        out.write(
+            f"slurmstepd: error: *** JOB {job_id} ON fake-node CANCELLED AT "
+            f"{stamp} DUE TO TIME LIMIT ***\n".encode()
+        )
+        out.flush()
+        _kill_group(proc.pid, signal.SIGTERM)
+        try:
+            rc = proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            _kill_group(proc.pid, signal.SIGKILL)
+            rc = proc.wait()
+        state = "TIMEOUT"
+
+    if state is None:
+        state = "COMPLETED" if rc == 0 else "FAILED"
+    exit_code = f"{rc}:0" if rc >= 0 else f"0:{-rc}"
+    update_job(job_id, state=state, exit_code=exit_code, end=time.time())
+    slot.close()
+    return 0
+
+
+def _kill_group(pid: int | None, sig: int) -> None:
+    if not pid:
+        return
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+# ---------------------------------------------------------------------------
+# squeue / sacct / scancel
+# ---------------------------------------------------------------------------
+
+def _select(jobs: list[dict], opts: dict) -> list[dict]:
+    ids = opts.get("jobs") or opts.get("j")
+    if isinstance(ids, str):
+        wanted = set(ids.split(","))
+        jobs = [j for j in jobs if j["id"] in wanted]
+    names = opts.get("name") or opts.get("n")
+    if isinstance(names, str):
+        wanted = set(names.split(","))
+        jobs = [j for j in jobs if j["name"] in wanted]
+    user = opts.get("user") or opts.get("u")
+    if isinstance(user, str):
+        jobs = [j for j in jobs if j["user"] == user]
+    if opts.get("me"):
+        jobs = [j for j in jobs if j["user"] == getpass.getuser()]
+    return jobs
+
+
+def _elapsed(job: dict) -> float:
+    if not job["start"]:
+        return 0.0
+    return (job["end"] or time.time()) - job["start"]
+
+
+def squeue(argv: list[str]) -> int:
+    opts = dict(_parse_options(argv))
+    jobs = [j for j in _select(all_jobs(), opts) if j["state"] in ACTIVE_STATES]
+    fmt = opts.get("format") or opts.get("o") or "%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R"
+    fields = {
+        "i": lambda j: j["id"],
+        "j": lambda j: j["name"],
+        "u": lambda j: j["user"],
+        "P": lambda j: j["partition"],
+        "T": lambda j: j["state"],
+        "t": lambda j: STATE_CODES[j["state"]],
+        "M": lambda j: format_duration(_elapsed(j)),
+        "D": lambda j: "1",
+        "R": lambda j: "fake-node" if j["state"] == "RUNNING" else "(Priority)",
+        "N": lambda j: "fake-node" if j["state"] == "RUNNING" else "",
+    }
+    headers = {"i": "JOBID", "j": "NAME", "u": "USER", "P": "PARTITION", "T": "STATE",
+               "t": "ST", "M": "TIME", "D": "NODES", "R": "NODELIST(REASON)", "N": "NODELIST"}
+    spec = re.compile(r"%(\.?)(\d*)([a-zA-Z])")
+
+    def render(getter):
+        def sub(m):
+            text = getter(m.group(3))
+            width = int(m.group(2) or 0)
+            return text.rjust(width) if m.group(1) else text.ljust(width)
+        return spec.sub(sub, fmt)
+
+    if not (opts.get("noheader") or opts.get("h")):
+        print(render(lambda c: headers.get(c, c)))
+    for job in jobs:
+        print(render(lambda c: str(fields[c](job)) if c in fields else ""))
+    return 0
+
+
+SACCT_FIELDS = {
+    "jobid": lambda j: j["id"],
+    "jobname": lambda j: j["name"],
+    "user": lambda j: j["user"],
+    "partition": lambda j: j["partition"],
+    "account": lambda j: "fake",
+    "state": lambda j: j["state"],
+    "exitcode": lambda j: j["exit_code"],
+    "elapsed": lambda j: format_duration(_elapsed(j)),
+    "elapsedraw": lambda j: str(int(_elapsed(j))),
+    "submit": lambda j: _fmt_time(j["submit"]),
+    "start": lambda j: _fmt_time(j["start"]),
+    "end": lambda j: _fmt_time(j["end"]),
+    "timelimit": lambda j: format_duration(j["time_limit"]) if j["time_limit"] else "UNLIMITED",
+    "alloccpus": lambda j: str(j["directives"].get("ntasks-per-node", 1)),
+    "reqmem": lambda j: str(j["directives"].get("mem", "")),
+    "alloctres": lambda j: "cpu={},mem={},gres/gpu={}".format(
+        j["directives"].get("ntasks-per-node", 1),
+        j["directives"].get("mem", "0"),
+        str(j["directives"].get("gres", "gpu:0")).rsplit(":", 1)[-1],
+    ),
+    "totalcpu": lambda j: format_duration(_elapsed(j)),
+    "maxrss": lambda j: "",
+}
+
+
+def sacct(argv: list[str]) -> int:
+    opts = dict(_parse_options(argv))
+    jobs = _select(all_jobs(), opts)
+    fmt = opts.get("format") or opts.get("o") or "JobID,JobName,Partition,Account,AllocCPUS,State,ExitCode"
+    names = [f.split("%")[0] for f in fmt.split(",") if f]
+    parsable = opts.get("parsable2") or opts.get("P") or opts.get("parsable") or opts.get("p")
+
+    rows = []
+    if not (opts.get("noheader") or opts.get("n")):
+        rows.append(names)
+    for job in jobs:
+        rows.append([SACCT_FIELDS.get(n.lower(), lambda j: "")(job) for n in names])
+    for row in rows:
+        if parsable:
+            print("|".join(row))
+        else:
+            print(" ".join(cell[:10].rjust(10) for cell in row))
+    return 0
+
+
+def scancel(argv: list[str]) -> int:
+    status = 0
+    for job_id in [a for a in argv if not a.startswith("-")]:
+        job = load_job(job_id)
+        if job is None:
+            print(f"scancel: error: Invalid job id {job_id}", file=sys.stderr)
+            status = 1
+            continue
+        if job["state"] not in ACTIVE_STATES:
+            print(f"scancel: error: Kill job error on job id {job_id}: "
+                  "Job/step already completing or completed", file=sys.stderr)
+            continue
+        job.update(state="CANCELLED", end=time.time(), exit_code="0:15")
+        save_job(job)
+        _kill_group(job.get("step_pid"), signal.SIGTERM)
+        _kill_group(job.get("pid"), signal.SIGTERM)
+    return status
+
+
+# ---------------------------------------------------------------------------
+# AF3 stub (answers `singularity exec ... run_alphafold.py`)
+# ---------------------------------------------------------------------------
+
+def sanitised_name(name: str) -> str:
+    """Mirror AlphaFold3's folder naming for a fold input."""
+    lower_spaceless = name.lower().replace(" ", "_")
+    allowed = set(string.ascii_lowercase + string.digits + "_-.")
+    return "".join(c for c in lower_spaceless if c in allowed)
+
+
+def _chain_ids(entry_id) -> list[str]:
+    return entry_id if isinstance(entry_id, list) else [entry_id]
+
+
+def _token_count(fold_input: dict) -> int:
+    tokens = 0
+    for entry in fold_input.get("sequences", []):
+        kind, body = next(iter(entry.items()))
+        copies = len(_chain_ids(body["id"]))
+        if kind in ("protein", "rna", "dna"):
+            tokens += len(body.get("sequence", "")) * copies
+        elif body.get("smiles"):
+            tokens += sum(c.isalpha() and c.isupper() for c in body["smiles"]) * copies
+        else:
+            tokens += 10 * len(body.get("ccdCodes", [])) * copies
+    return max(tokens, 1)
+
+
+def _fake_cif(name: str, fold_input: dict) -> str:
+    lines = [
+        f"data_{name}",
+        "#",
+        "loop_",
+        "_atom_site.group_PDB",
+        "_atom_site.id",
+        "_atom_site.type_symbol",
+        "_atom_site.label_atom_id",
+        "_atom_site.label_seq_id",
+        "_atom_site.auth_asym_id",
+        "_atom_site.Cartn_x",
+        "_atom_site.Cartn_y",
+        "_atom_site.Cartn_z",
+        "_atom_site.B_iso_or_equiv",
+    ]
+    atom = 1
+    for entry in fold_input.get("sequences", []):
+        kind, body = next(iter(entry.items()))
+        length = len(body.get("sequence", "")) or 1
+        for chain in _chain_ids(body["id"]):
+            for res in range(length):
+                angle = res * 100 * math.pi / 180
+                lines.append(
+                    f"ATOM {atom} C CA {res + 1} {chain} "
+                    f"{2.3 * math.cos(angle):.3f} {2.3 * math.sin(angle):.3f} "
+                    f"{1.5 * res:.3f} {random.uniform(50, 95):.2f}"
+                )
+                atom += 1
+    lines.append("#")
+    return "\n".join(lines) + "\n"
+
+
+def _write_sample(dest: Path, name: str, fold_input: dict, tokens: int, score: float) -> None:
+    dest.mkdir(parents=True, exist_ok=True)
+    chains = [c for e in fold_input.get("sequences", []) for c in _chain_ids(next(iter(e.values()))["id"])]
+    # AF3 3.0.1 names: <job>_seed-<S>_sample-<N>_<file>
+    prefix = f"{name}_{dest.name}_"
+    (dest / f"{prefix}model.cif").write_text(_fake_cif(name, fold_input))
+    (dest / f"{prefix}confidences.json").write_text(json.dumps({
+        "atom_plddts": [round(random.uniform(40, 95), 2) for _ in range(tokens)],
+        "pae": [[round(random.uniform(0, 30), 2) for _ in range(tokens)] for _ in range(tokens)],
+        "token_chain_ids": [chains[i % len(chains)] for i in range(tokens)] if chains else [],
+    }))
+    (dest / f"{prefix}summary_confidences.json").write_text(json.dumps({
+        "chain_iptm": [round(score, 2) for _ in chains],
+        "chain_ptm": [round(score, 2) for _ in chains],
+        "fraction_disordered": 0.0,
+        "has_clash": 0.0,
+        "iptm": round(score, 2),
+        "num_recycles": 10.0,
+        "ptm": round(score, 2),
+        "ranking_score": round(score, 2),
+    }, indent=1))
+
+
+def _with_data_pipeline(fold_input: dict) -> dict:
+    data = json.loads(json.dumps(fold_input))
+    for entry in data.get("sequences", []):
+        kind, body = next(iter(entry.items()))
+        if kind == "protein":
+            query = f">query\n{body['sequence']}\n"
+            body.setdefault("unpairedMsa", query)
+            body.setdefault("pairedMsa", query)
+            body.setdefault("templates", [])
+        elif kind == "rna":
+            body.setdefault("unpairedMsa", f">query\n{body['sequence']}\n")
+    return data
+
+
+def _inline_paths(fold_input: dict, json_dir: Path) -> dict:
+    """Replace MSA/template *Path fields with file contents, as AF3 does on load."""
+    data = json.loads(json.dumps(fold_input))
+    for entry in data.get("sequences", []):
+        body = next(iter(entry.values()))
+        for key in ("unpairedMsa", "pairedMsa"):
+            if body.get(f"{key}Path") is not None:
+                if body.get(key) is not None:
+                    raise ValueError(f"Only one of {key} and {key}Path can be set")
+                body[key] = (json_dir / body.pop(f"{key}Path")).read_text()
+        for tpl in body.get("templates") or []:
+            if tpl.get("mmcifPath") is not None:
+                tpl["mmcif"] = (json_dir / tpl.pop("mmcifPath")).read_text()
+    return data
+
+
+def _missing_msa(fold_input: dict) -> str | None:
+    for entry in fold_input.get("sequences", []):
+        kind, body = next(iter(entry.items()))
+        needed = {"protein": ("unpairedMsa", "pairedMsa", "templates"), "rna": ("unpairedMsa",)}.get(kind, ())
+        if any(body.get(k) is None for k in needed):
+            return f"{kind.capitalize()} chain {_chain_ids(body['id'])[0]} has no {'/'.join(needed)}"
+    return None
+
+
+def fake_alphafold(flags: dict) -> int:
+    """Produce an AF3 3.x style output tree for the given run_alphafold flags."""
+    def flag(name, default=True):
+        value = flags.get(name, default)
+        return value if isinstance(value, bool) else str(value).lower() != "false"
+
+    json_path = Path(flags["json_path"])
+    try:
+        fold_input = _inline_paths(json.loads(json_path.read_text()), json_path.parent)
+    except (OSError, ValueError) as e:
+        print("Traceback (most recent call last):", file=sys.stderr)
+        print(f"ValueError: {e}", file=sys.stderr)
+        return 1
+    name = sanitised_name(fold_input["name"])
+    out_dir = Path(flags["output_dir"]) / name
+    seeds = fold_input.get("modelSeeds") or [1]
+    tokens = _token_count(fold_input)
+    fail_at = random.random() < _env_float("FAKE_AF3_FAIL_RATE", 0)
+
+    print(f"Processing fold input {fold_input['name']}", flush=True)
+    if flag("run_data_pipeline"):
+        delay = _env_float("FAKE_AF3_PIPELINE_DELAY", 1.0)
+        start = time.time()
+        print("Running data pipeline...", flush=True)
+        for entry in fold_input.get("sequences", []):
+            kind, body = next(iter(entry.items()))
+            if kind not in ("protein", "rna"):
+                continue
+            chain = _chain_ids(body["id"])[0]
+            if body.get("unpairedMsa") is not None:
+                print(f"Skipping MSA and template search for {kind} chain {chain}: provided in input", flush=True)
+                continue
+            print(f"Processing chain {chain}", flush=True)
+            time.sleep(delay / 2)
+            print(f"Getting {kind} MSAs took {delay / 2:.2f} seconds", flush=True)
+            if kind == "protein":
+                print(f"Getting protein templates took {delay / 4:.2f} seconds", flush=True)
+            print(f"Processing chain {chain} took {delay / 2:.2f} seconds", flush=True)
+        print(f"Running data pipeline took {time.time() - start:.2f} seconds", flush=True)
+        fold_input = _with_data_pipeline(fold_input)
+    elif _missing_msa(fold_input):
+        print("Traceback (most recent call last):", file=sys.stderr)
+        print(f"ValueError: {_missing_msa(fold_input)} and the data pipeline is disabled", file=sys.stderr)
+        return 1
+    out_dir.mkdir(parents=True, exist_ok=True)
+    print(f"Writing model input JSON to {out_dir}", flush=True)
+    (out_dir / f"{name}_data.json").write_text(json.dumps(fold_input, indent=2))
+
+    if fail_at:
+        print("Traceback (most recent call last):", file=sys.stderr)
+        print("RuntimeError: fake AlphaFold3 failure injected by FAKE_AF3_FAIL_RATE", file=sys.stderr)
+        return 1
+    if not flag("run_inference"):
+        print(f"Fold job {fold_input['name']} done, output written to {out_dir}", flush=True)
+        return 0
+
+    delay = _env_float("FAKE_AF3_SEED_DELAY", 0.5)
+    print(f"Predicting 3D structure for {fold_input['name']} with {len(seeds)} seed(s)...", flush=True)
+    print(f"Featurising data with {len(seeds)} seed(s)...", flush=True)
+    print(f"Featurising data with {len(seeds)} seed(s) took 0.01 seconds.", flush=True)
+    ranking = []
+    for seed in seeds:
+        print(f"Running model inference with seed {seed}...", flush=True)
+        time.sleep(delay)
+        print(f"Running model inference with seed {seed} took {delay:.2f} seconds.", flush=True)
+        print(f"Extracting output structure samples with seed {seed}...", flush=True)
+        for sample in range(5):
+            score = random.uniform(0.3, 0.95)
+            _write_sample(out_dir / f"seed-{seed}_sample-{sample}", name, fold_input, tokens, score)
+            ranking.append((seed, sample, score))
+        print(f"Extracting output structure samples with seed {seed} took 0.01 seconds.", flush=True)
+
+    print(f"Writing outputs with {len(seeds)} seed(s)...", flush=True)
+    with open(out_dir / f"{name}_ranking_scores.csv", "w") as fh:
+        fh.write("seed,sample,ranking_score\n")
+        for seed, sample, score in ranking:
+            fh.write(f"{seed},{sample},{score:.2f}\n")
+    best_seed, best_sample, _ = max(ranking, key=lambda r: r[2])
+    best = out_dir / f"seed-{best_seed}_sample-{best_sample}"
+    for fname in ("model.cif", "confidences.json", "summary_confidences.json"):
+        (out_dir / f"{name}_{fname}").write_bytes((best / f"{name}_{best.name}_{fname}").read_bytes())
+    (out_dir / "TERMS_OF_USE.md").write_text("Fake AlphaFold3 output for local testing.\n")
+    print(f"Fold job {fold_input['name']} done, output written to {out_dir}", flush=True)
+    return 0
+
+
+def singularity(argv: list[str]) -> int:
+    if not argv or argv[0] != "exec":
+        print("singularity (fake): only `exec` is supported", file=sys.stderr)
+        return 1
+    args, binds = argv[1:], []
+    while args and args[0].startswith("-"):
+        opt = args.pop(0)
+        if opt in ("--bind", "-B"):
+            binds.append(args.pop(0))
+        elif opt.startswith("--bind="):
+            binds.append(opt.split("=", 1)[1])
+    command = args[1:]  # drop the image
+
+    mounts = sorted(
+        (b.split(":")[1], b.split(":")[0]) for b in binds if ":" in b
+    )[::-1]
+
+    def host_path(path: str) -> str:
+        for inner, outer in mounts:
+            if path == inner or path.startswith(inner.rstrip("/") + "/"):
+                return outer + path[len(inner):]
+        return path
+
+    if not any(part.endswith("run_alphafold.py") for part in command):
+        return subprocess.call([host_path(c) for c in command])
+    flags = {}
+    for key, value in _parse_options(command):
+        flags[key] = host_path(value) if isinstance(value, str) else value
+    return fake_alphafold(flags)
+
+
+def nvidia_smi(argv: list[str]) -> int:
+    print("NVIDIA-SMI (fake)    GPU 0: NVIDIA L40S (fake)    0MiB / 46068MiB")
+    return 0
+
+
+def module(argv: list[str]) -> int:
+    return 0
+
+
+COMMANDS = {
+    "sbatch": sbatch,
+    "squeue": squeue,
+    "sacct": sacct,
+    "scancel": scancel,
+    "singularity": singularity,
+    "nvidia-smi": nvidia_smi,
+    "module": module,
+    "_run": lambda argv: _run(argv[0]),
+}
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS:
+        print(f"usage: fake_slurm.py {{{','.join(c for c in COMMANDS if c != '_run')}}} ...", file=sys.stderr)
+        return 2
+    return COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
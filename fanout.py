@@ -0,0 +1,140 @@
+"""
+Split and merge steps for multi-seed AF3 jobs fanned out across GPUs.
+
+When a job asks for more seeds than one GPU should run, the submission
+template runs the data pipeline once, then one inference task per GPU,
+each over a slice of the seeds, all reading the same `*_data.json`.
+This script is called from the job itself, so it only uses the
+standard library:
+
+    python3 fanout.py split <workdir> <num_tasks>
+    python3 fanout.py merge <workdir> <dest>
+
+`split` writes `fanout/task-<i>/input.json` from the data-pipeline output
+in `fanout/data/`. `merge` combines the per-task output trees into
+`<workdir>/<dest>/` with a unified ranking CSV and the top-ranked model
+copied to the top level, as a single-task AF3 run would produce.
+"""
+import csv
+import json
+import shutil
+import sys
+from pathlib import Path
+
+# Per-sample files promoted to the top level. AF3 3.0.1 prefixes them with
+# `<job>_seed-<S>_sample-<N>_`; older releases wrote the bare names.
+TOP_LEVEL_FILES = ("summary_confidences.json", "confidences.json", "model.cif")
+
+
+def split_seeds(seeds: list[int], num_tasks: int) -> list[list[int]]:
+    """Deal `seeds` into at most `num_tasks` contiguous, evenly sized groups."""
+    num_tasks = max(1, min(num_tasks, len(seeds)))
+    size, extra = divmod(len(seeds), num_tasks)
+    groups, start = [], 0
+    for i in range(num_tasks):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(seeds[start:end])
+        start = end
+    return groups
+
+
+def find_data_json(data_dir: Path) -> Path:
+    matches = sorted(data_dir.glob("*/*_data.json"))
+    if not matches:
+        raise FileNotFoundError(f"No *_data.json under {data_dir}")
+    return matches[0]
+
+
+def split(workdir: Path, num_tasks: int) -> list[Path]:
+    """Write one inference input per task, each with its share of the seeds."""
+    fanout = workdir / "fanout"
+    data = json.loads(find_data_json(fanout / "data").read_text())
+    inputs = []
+    for i, seeds in enumerate(split_seeds(data["modelSeeds"], num_tasks)):
+        task_dir = fanout / f"task-{i}"
+        task_dir.mkdir(parents=True, exist_ok=True)
+        path = task_dir / "input.json"
+        path.write_text(json.dumps({**data, "modelSeeds": seeds}))
+        inputs.append(path)
+    return inputs
+
+
+def _top_level_kind(filename: str) -> str | None:
+    """Which of TOP_LEVEL_FILES a (possibly prefixed) sample file is."""
+    for kind in TOP_LEVEL_FILES:  # longest suffix first
+        if filename == kind or filename.endswith(f"_{kind}"):
+            return kind
+    return None
+
+
+def _ranking_csv(out_dir: Path) -> Path | None:
+    return next(iter(sorted(out_dir.glob("*ranking_scores.csv"))), None)
+
+
+def merge(workdir: Path, dest: str) -> Path:
+    """
+    Move the per-seed sample folders of every task into `<workdir>/<dest>/`,
+    write one ranking CSV over all of them and copy the best sample's files
+    to the top level. Returns the merged directory.
+    """
+    fanout = workdir / "fanout"
+    task_outputs = sorted(
+        (d for t in fanout.glob("task-*") for d in t.iterdir() if d.is_dir()),
+        key=lambda d: int(d.parent.name.split("-", 1)[1]),
+    )
+    if not task_outputs:
+        raise FileNotFoundError(f"No task outputs under {fanout}")
+    prefix = task_outputs[0].name
+
+    merged = workdir / dest
+    merged.mkdir(parents=True, exist_ok=True)
+    data_json = find_data_json(fanout / "data")
+    shutil.copy2(data_json, merged / f"{prefix}_data.json")
+
+    rows, csv_name = [], "ranking_scores.csv"
+    for out_dir in task_outputs:
+        ranking = _ranking_csv(out_dir)
+        if ranking is not None:
+            csv_name = ranking.name
+            with open(ranking, newline="") as fh:
+                rows.extend(csv.DictReader(fh))
+        for sample_dir in out_dir.glob("seed-*_sample-*"):
+            shutil.move(str(sample_dir), merged / sample_dir.name)
+        for extra in ("TERMS_OF_USE.md",):
+            if (out_dir / extra).is_file() and not (merged / extra).exists():
+                shutil.copy2(out_dir / extra, merged / extra)
+
+    if not rows:
+        raise ValueError("No ranking scores found in task outputs")
+    rows.sort(key=lambda r: (int(r["seed"]), int(r["sample"])))
+    with open(merged / csv_name, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=["seed", "sample", "ranking_score"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    best = max(rows, key=lambda r: float(r["ranking_score"]))
+    best_dir = merged / f"seed-{best['seed']}_sample-{best['sample']}"
+    for path in best_dir.iterdir():
+        kind = _top_level_kind(path.name)
+        if kind and path.is_file():
+            shutil.copy2(path, merged / f"{prefix}_{kind}")
+
+    shutil.rmtree(fanout)
+    return merged
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if len(argv) == 3 and argv[0] == "split":
+        for path in split(Path(argv[1]), int(argv[2])):
+            print(f"Wrote {path}")
+        return 0
+    if len(argv) == 3 and argv[0] == "merge":
+        print(f"Merged outputs into {merge(Path(argv[1]), argv[2])}")
+        return 0
+    print("usage: fanout.py split <workdir> <num_tasks> | merge <workdir> <dest>", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,210 @@
+import os
 import re
 import json
+import fcntl
+import math
+import shutil
+import time
+import uuid
 from datetime import datetime
 from pathlib import Path
 from subprocess import run
 
-from submission import AF3Submission
+from submission import AF3Submission, dumps
+from precomputed import needs_data_pipeline
 
+# Path to the `sbatch` binary; point this at `bin/sbatch` to use the local
+# fake scheduler in `fake_slurm.py` instead of a real cluster.
+SBATCH = os.environ.get("AF3_SBATCH", "sbatch")
+# Seconds an sbatch call may take; well below admission.RESERVATION_TIMEOUT,
+# so a slow call is abandoned long before its reservation is retried.
+SBATCH_TIMEOUT = 120
 
-def create_job_dir(base: Path, job_name: str, ts: str) -> Path:
+# Taken around every read-modify-write of a job's meta.json.
+META_LOCK_NAME = ".meta.lock"
+
+# Root of the per-job directories (inputs, logs and result archives).
+JOBS_DIR = Path(os.environ.get("AF3_JOBS_DIR", "jobs"))
+
+# Seeds one GPU runs within the template's walltime; jobs with more seeds
+# are fanned out over several GPUs (see fanout.py).
+SEEDS_PER_GPU = int(os.environ.get("AF3_SEEDS_PER_GPU", 5))
+MAX_GPUS_PER_JOB = int(os.environ.get("AF3_MAX_GPUS_PER_JOB", 4))
+
+# Default for the "stage on node-local scratch" option of new submissions.
+STAGE_LOCAL_DEFAULT = os.environ.get("AF3_STAGE_LOCAL", "0") == "1"
+
+# Directory containing this app; the job script calls fanout.py from here.
+APP_DIR = Path(__file__).resolve().parent
+
+# Log viewer: bytes shown when a log is first opened, and the most that a
+# single poll reads from disk.
+LOG_TAIL_BYTES = 64 * 1024
+LOG_CHUNK_BYTES = 256 * 1024
+# Most log text, and most separately appended chunks, a viewer keeps; older
+# chunks are dropped from the page.
+LOG_VIEW_MAX_CHARS = 2 * 1024 * 1024
+LOG_VIEW_MAX_CHUNKS = 500
+
+# Idempotency keys only guard repeated clicks on one generated input; they
+# are removed after this many seconds.
+KEY_MAX_AGE = 24 * 3600
+
+# Job names become directory, archive and Slurm job names and are pasted
+# into the job script: letters, digits, '.', '_' and '-' only, and no
+# leading dot (hidden directories are staging areas).
+JOB_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+def new_run_id(now: datetime | None = None) -> str:
     """
-    Create a timestamped job directory under `base` and ensure a logs subdirectory exists.
+    Return a unique run ID of the form `<YYYYmmddTHHMMSS>-<8 hex chars>`.
+    It takes the place of the bare timestamp in job directory and archive
+    names, so two submissions of the same job name never collide.
     """
+    now = now or datetime.now()
+    return f"{now.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def parse_run_timestamp(run_id: str) -> datetime:
+    """Extract the submission time from a run ID (or a legacy bare timestamp)."""
+    return datetime.strptime(run_id.split("-", 1)[0], "%Y%m%dT%H%M%S")
+
+def atomic_write(path: Path, data: str | bytes) -> Path:
+    """
+    Write `data` to a temporary sibling of `path`, flush it to disk and
+    rename it into place, so readers never observe a partially written file.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return path
+
+def create_job_dir(
+    base: Path,
+    job_name: str,
+    ts: str,
+    files: dict[str, str | bytes | Path] | None = None,
+) -> Path:
+    """
+    Create the job directory `<job_name>_<ts>` under `base` with a logs
+    subdirectory and the given `files`. Names may include subdirectories;
+    Path values are hard-linked (or copied across filesystems).
+
+    The directory is assembled in a hidden staging area and renamed into
+    place in one step, so it either appears complete or not at all.
+    Raises FileExistsError if the directory already exists, and
+    ValueError for job names other than JOB_NAME_RE allows.
+    """
+    if not valid_job_name(job_name):
+        raise ValueError(f"Invalid job name: {job_name!r}")
     job_dir = base / f"{job_name}_{ts}"
-    job_dir.mkdir(parents=True, exist_ok=True)
-    (job_dir / "logs").mkdir(exist_ok=True)
+    staging = base / ".staging" / uuid.uuid4().hex
+    (staging / "logs").mkdir(parents=True)
+    try:
+        for name, data in (files or {}).items():
+            dest = staging / name
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(data, Path):
+                try:
+                    os.link(data, dest)
+                except OSError:
+                    shutil.copy2(data, dest)
+            else:
+                atomic_write(dest, data)
+        if job_dir.exists():
+            raise FileExistsError(f"Job directory already exists: {job_dir}")
+        os.rename(staging, job_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
     return job_dir
 
-def write_json_input(job_dir: Path, submission_dict: dict) -> Path:
+def valid_job_name(job_name: str) -> bool:
+    return bool(JOB_NAME_RE.match(job_name or ""))
+
+def claim_idempotency_key(base: Path, key: str, job_dir_name: str) -> str | None:
     """
-    Serialize the AF3 submission dict to `input.json` in the job directory.
+    Record that the submission identified by `key` creates `job_dir_name`.
+
+    Returns None if the key was unused (the caller owns the submission), or
+    the job directory name recorded by the earlier claim. Claims are made
+    with a hard link, which fails atomically if the key already exists.
     """
-    path = job_dir / "input.json"
-    path.write_text(json.dumps(submission_dict, indent=2))
-    return path
+    keys_dir = base / ".keys"
+    keys_dir.mkdir(parents=True, exist_ok=True)
+    key_file = keys_dir / key
+    tmp = atomic_write(keys_dir / f".{key}.{uuid.uuid4().hex}", job_dir_name)
+    try:
+        os.link(tmp, key_file)
+        return None
+    except FileExistsError:
+        return key_file.read_text().strip()
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def release_idempotency_key(base: Path, key: str) -> None:
+    """Forget a claimed key whose submission failed, so it can be retried."""
+    (base / ".keys" / key).unlink(missing_ok=True)
+
+def prune_idempotency_keys(base: Path, max_age: float = KEY_MAX_AGE) -> None:
+    """Remove idempotency keys claimed more than `max_age` seconds ago."""
+    keys_dir = base / ".keys"
+    cutoff = time.time() - max_age
+    for key_file in keys_dir.iterdir() if keys_dir.exists() else []:
+        try:
+            if key_file.stat().st_mtime < cutoff:
+                key_file.unlink()
+        except FileNotFoundError:
+            continue
+
+def read_job_meta(job_dir: Path) -> dict:
+    """Load `meta.json` from a job directory (empty dict if missing or unreadable)."""
+    try:
+        return json.loads((job_dir / "meta.json").read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def write_job_meta(job_dir: Path, **fields) -> dict:
+    """
+    Merge `fields` into the job's `meta.json` and write it atomically. The
+    merge runs under an exclusive lock on the job's META_LOCK_NAME file, so
+    writers in other threads and processes never drop each other's fields.
+    """
+    with open(job_dir / META_LOCK_NAME, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            meta = read_job_meta(job_dir)
+            meta.update(fields)
+            atomic_write(job_dir / "meta.json", json.dumps(meta, indent=2))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return meta
+
+def write_json_input(job_dir: Path, submission: dict | bytes) -> Path:
+    """
+    Write the AF3 input to `input.json` in the job directory. Already
+    serialised bytes are written unchanged; a dict is serialised canonically.
+    """
+    payload = submission if isinstance(submission, bytes) else dumps(submission)
+    return atomic_write(job_dir / "input.json", payload)
 
 def render_slurm_script(
     job_name: str,
     email: str,
     workdir: str,
     timestamp: str,
-    template_path: Path = Path("templates") / "submit_template.sh"
+    template_path: Path = Path("templates") / "submit_template.sh",
+    num_gpus: int = 1,
+    stage_local: bool = False,
+    run_data_pipeline: bool = True,
 ) -> str:
     """
     Load SLURM template and replace placeholders:
@@ -37,7 +212,15 @@ def render_slurm_script(
       {{EMAIL}}     → user email for notifications
       {{WORKDIR}}   → working directory to cd into
       {{TIMESTAMP}} → timestamp used to name the results ZIP
+      {{NUM_GPUS}}  → GPUs requested; the seeds are fanned out over them
+      {{APP_DIR}}   → directory of this app (for fanout.py)
+      {{STAGE_LOCAL}} → 1 to run AF3 I/O on node-local scratch, else 0
+      {{RUN_DATA_PIPELINE}} → false when every chain has a precomputed MSA
+
+    The job name is pasted into shell code, so it must match JOB_NAME_RE.
     """
+    if not valid_job_name(job_name):
+        raise ValueError(f"Invalid job name: {job_name!r}")
     tpl = template_path.read_text()
     script = (
         tpl
@@ -45,39 +228,72 @@ def render_slurm_script(
         .replace("{{EMAIL}}", email)
         .replace("{{WORKDIR}}", workdir)
         .replace("{{TIMESTAMP}}", timestamp)
+        .replace("{{NUM_GPUS}}", str(num_gpus))
+        .replace("{{APP_DIR}}", str(APP_DIR))
+        .replace("{{STAGE_LOCAL}}", "1" if stage_local else "0")
+        .replace("{{RUN_DATA_PIPELINE}}", "true" if run_data_pipeline else "false")
     )
     return script
 
+def max_seeds_per_job() -> int:
+    """Most seeds a job may ask for: SEEDS_PER_GPU on each of MAX_GPUS_PER_JOB GPUs."""
+    return SEEDS_PER_GPU * MAX_GPUS_PER_JOB
+
+def plan_gpu_tasks(num_seeds: int) -> int:
+    """
+    Number of GPUs to fan a job's seeds out over: one per SEEDS_PER_GPU
+    seeds, capped at MAX_GPUS_PER_JOB. Submissions are limited to
+    max_seeds_per_job() seeds, so no GPU gets more than its walltime
+    budget.
+    """
+    return max(1, min(MAX_GPUS_PER_JOB, math.ceil(num_seeds / SEEDS_PER_GPU)))
+
 def write_and_submit_script(
     job_dir: Path,
     email: str,
-    template_path: Path = Path("templates") / "submit_template.sh"
+    template_path: Path = Path("templates") / "submit_template.sh",
+    num_gpus: int | None = None,
+    stage_local: bool = False,
 ) -> str:
     """
     Render the SLURM submission script (including zipping & cleanup steps),
     write it to disk, submit it via sbatch, and capture the job ID.
+    Unless given, the number of GPUs is planned from the seeds in input.json,
+    and the data pipeline is skipped if input.json brings every chain's MSA.
+    With `stage_local`, the job runs AF3 on node-local scratch.
 
-    Returns the Slurm job ID.
+    Returns the Slurm job ID. Raises TimeoutExpired if sbatch does not
+    answer within SBATCH_TIMEOUT, in which case the job may or may not
+    have been queued.
     """
     job_name, timestamp = job_dir.name.rsplit("/")[-1].rsplit("_", 1)
+    try:
+        fold_input = json.loads((job_dir / "input.json").read_text())
+    except (OSError, json.JSONDecodeError):
+        fold_input = {}
+    if num_gpus is None:
+        num_gpus = plan_gpu_tasks(len(fold_input.get("modelSeeds") or [1]))
     # render & write the submission script
     script_text = render_slurm_script(
         job_name,
         email,
         str(job_dir),
         timestamp,
-        template_path
+        template_path,
+        num_gpus=num_gpus,
+        stage_local=stage_local,
+        run_data_pipeline=needs_data_pipeline(fold_input) if fold_input else True,
     )
-    script_file = job_dir / "submit.sh"
-    script_file.write_text(script_text)
+    script_file = atomic_write(job_dir / "submit.sh", script_text)
 
     # submit the job
     # NOTE: move --constraint option to the script template once longleaf RHEL9 migration is complete
     result = run(
-        ["sbatch", str(script_file), "--constraint=cuda-570.86.15"],
+        [SBATCH, str(script_file), "--constraint=cuda-570.86.15"],
         capture_output=True,
         text=True,
-        check=True
+        check=True,
+        timeout=SBATCH_TIMEOUT,
     )
 
     # write sbatch logs
@@ -94,38 +310,51 @@ def list_job_entries(base: Path) -> list[dict]:
     Scan the `base` jobs directory for job subfolders.
     Returns a list of dicts with:
       - name: the folder name (jobname)
+      - dir: the job directory name (jobname_runid)
       - timestamp: the timestamp portion
-      - zip: absolute path to results_<timestamp>.zip if it exists
+      - status: "completed" once the results archive exists, else "in progress"
+      - zip: absolute path to the results archive (or the partial archive
+        salvaged from a failed staged run), or None if not there yet
+    Hidden directories (staging areas, idempotency keys) and folders whose
+    name does not end in a run ID are skipped.
     """
     entries = []
     if not base.exists():
         return entries
     
     for d in base.iterdir():
-        if not d.is_dir():
+        if not d.is_dir() or d.name.startswith("."):
             continue
 
         parts = d.name.rsplit("_", 1)
+        if len(parts) != 2:
+            continue
         job_name, ts = parts
+        try:
+            dt = parse_run_timestamp(ts)
+        except ValueError:
+            continue
         
         zip_file = d / f"{job_name}_{ts}.zip"
-        if not zip_file.exists():
-            continue
+        done = zip_file.exists()
+        # outputs salvaged from a failed run staged on node-local scratch
+        partial_zip = d / f"{job_name}_{ts}_partial.zip"
 
-        user_email = None
+        user_email = read_job_meta(d).get("email")
         submit_sh = d / "submit.sh"
-        if submit_sh.is_file():
+        if user_email is None and submit_sh.is_file():
             content = submit_sh.read_text()
             m = re.search(r"--mail-user=([^\s]+)", content)
             if m:
                 user_email = m.group(1)
 
-        dt = datetime.strptime(ts, "%Y%m%dT%H%M%S")
         entries.append({
             "name": job_name,
+            "dir": d.name,
             "timestamp": dt.strftime("%Y/%m/%d - %H:%M:%S"),
             "email": user_email, 
-            "zip": str(zip_file),
+            "status": "completed" if done else "in progress",
+            "zip": str(zip_file) if done else (str(partial_zip) if partial_zip.exists() else None),
             "_dt": dt,
         })
     
@@ -135,6 +364,62 @@ def list_job_entries(base: Path) -> list[dict]:
 
     return entries
 
+def find_slurm_log(job_dir: Path) -> Path | None:
+    """
+    Locate the Slurm output file (`logs/%x-%j.out`) of a job. Uses the job ID
+    recorded in meta.json and falls back to the newest `.out` file.
+    """
+    logs_dir = job_dir / "logs"
+    slurm_id = read_job_meta(job_dir).get("slurm_job_id")
+    if slurm_id:
+        path = logs_dir / f"{job_dir.name}-{slurm_id}.out"
+        if path.is_file():
+            return path
+    candidates = [p for p in logs_dir.glob("*.out") if p.name != "sbatch.out"]
+    return max(candidates, key=lambda p: p.stat().st_mtime, default=None)
+
+def initial_log_offset(path: Path, tail_bytes: int = LOG_TAIL_BYTES) -> int:
+    """
+    Offset at which a newly opened viewer starts reading: the beginning of
+    the first complete line within the last `tail_bytes` of the file.
+    """
+    size = path.stat().st_size
+    if size <= tail_bytes:
+        return 0
+    with open(path, "rb") as fh:
+        fh.seek(size - tail_bytes)
+        head = fh.read(tail_bytes)
+    newline = head.find(b"\n")
+    return size - tail_bytes + (newline + 1 if newline >= 0 else 0)
+
+def read_log_chunk(path: Path, offset: int, max_bytes: int = LOG_CHUNK_BYTES) -> tuple[str, int]:
+    """
+    Read at most `max_bytes` of `path` starting at `offset` and return the
+    text together with the offset to continue from. A trailing partial line
+    is left for the next read unless it fills the whole chunk. If the file
+    shrank (rotated or truncated), reading restarts from the beginning.
+    """
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return "", offset
+    if size < offset:
+        offset = 0
+    if size == offset:
+        return "", offset
+
+    with open(path, "rb") as fh:
+        fh.seek(offset)
+        data = fh.read(max_bytes)
+
+    if not data.endswith(b"\n"):
+        cut = data.rfind(b"\n")
+        if cut >= 0:
+            data = data[:cut + 1]
+        elif len(data) < max_bytes:
+            return "", offset
+    return data.decode("utf-8", errors="replace"), offset + len(data)
+
 def build_submission(
     job_name: str,
     card_ids: list[str],
@@ -144,12 +429,19 @@ def build_submission(
     smiles: list[str],
     ccds: list[str],
     ions: list[str],
-    bonded: list[str]
+    bonded: list[str],
+    num_seeds: int | str | None = 1,
+    msas: list[dict | None] | None = None,
 ) -> AF3Submission:
-    """Build an AF3Submission object from the provided parameters."""
+    """
+    Build an AF3Submission object from the provided parameters. `msas`
+    holds the uploaded-file references of each protein/RNA/DNA card, in
+    the same order as `seqs` (resolved later by precomputed.attach).
+    """
 
     seq_i = smile_i = ccd_i = ion_i = bonded_i = 0
     submission = AF3Submission(name=job_name)
+    submission.num_seeds = int(num_seeds or 1)
 
     for i, card in enumerate(card_ids):
         t = types[i]
@@ -161,19 +453,22 @@ def build_submission(
 
         if t in ["protein", "rna", "dna"]:
             ent.sequence = (seqs[seq_i] or "").strip()
+            if msas and seq_i < len(msas) and t in ("protein", "rna"):
+                ent.precomputed = msas[seq_i]
             seq_i += 1
 
         elif t == "ligand":
             ent.smiles = (smiles[smile_i] or "").strip()
             smile_i += 1
 
+            # CCD codes are upper case; accept what users type in any case
             ent.ccd_codes = [
-                c.strip() for c in (ccds[ccd_i] or "").split(",") if c.strip()
+                c.strip().upper() for c in (ccds[ccd_i] or "").split(",") if c.strip()
             ]
             ccd_i += 1
 
         else:  # ion
-            ent.ion_name = (ions[ion_i] or "").strip()
+            ent.ion_name = (ions[ion_i] or "").strip().upper()
             ion_i += 1
 
         raw_bond = bonded[bonded_i] or ""
@@ -1,6 +1,10 @@
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 
+from helpers import STAGE_LOCAL_DEFAULT, max_seeds_per_job
+from submission import MAX_SEEDS
+from progress import STAGES, format_seconds
+
 ENTITY_TYPES = ["protein", "rna", "dna", "ligand", "ion"]
 
 
@@ -47,6 +51,34 @@ def serve_entity_card(uid):
         id={"type": "entity-card", "index": uid},
     )
 
+
+def serve_msa_uploads(uid, entity_type):
+    """
+    Upload buttons for precomputed data of a protein/RNA chain. Uploaded
+    files are written to disk by the upload callback; the card only keeps
+    their references in the `msa-store`.
+    """
+    def upload(kind, label, shown, multiple=False):
+        return dcc.Upload(
+            dbc.Button(label, color="secondary", outline=True, size="sm"),
+            id={"type": f"{kind}-upload", "index": uid},
+            multiple=multiple,
+            style={"display": "inline-block" if shown else "none", "marginRight": "0.5rem"},
+        )
+
+    msa_capable = entity_type in ("protein", "rna")
+    return html.Div(
+        [
+            upload("unpaired", "Unpaired MSA (A3M)", msa_capable),
+            upload("paired", "Paired MSA (A3M)", entity_type == "protein"),
+            upload("template", "Templates (mmCIF)", entity_type == "protein", multiple=True),
+            html.Small(id={"type": "msa-summary", "index": uid}, className="text-muted"),
+            dcc.Store(id={"type": "msa-store", "index": uid}),
+        ],
+        className="mb-2",
+    )
+
+
 def serve_submission_tab():
     """Serve the layout for the AlphaFold 3 submission tool."""
     return dbc.Container(
@@ -56,6 +88,13 @@ def serve_submission_tab():
                 [
                     dbc.Col(dbc.Input(id="job-name", placeholder="Job name", type="text"), width=4),
                     dbc.Col(dbc.Input(id="email", placeholder="Your email", type="email"), width=4),
+                    dbc.Col(
+                        dbc.InputGroup([
+                            dbc.InputGroupText("Seeds"),
+                            dbc.Input(id="num-seeds", type="number", min=1, max=min(MAX_SEEDS, max_seeds_per_job()), step=1, value=1),
+                        ]),
+                        width=3,
+                    ),
                 ],
                 class_name="mb-3",
             ),
@@ -72,6 +111,39 @@ def serve_submission_tab():
                 class_name="mb-3",
             ),
 
+            # precomputed MSAs/templates from an earlier AF3 run
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dcc.Upload(
+                            dbc.Button("Reuse MSAs from a *_data.json", color="secondary", outline=True, size="sm"),
+                            id="data-json-upload",
+                            accept=".json",
+                        ),
+                        width="auto",
+                    ),
+                    dbc.Col(html.Small(id="data-json-status", className="text-muted"), width="auto"),
+                    dcc.Store(id="store-data-json"),
+                ],
+                class_name="mb-3",
+                align="center",
+            ),
+
+            # execution options
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.Switch(
+                            id="stage-local",
+                            label="Stage AF3 I/O on node-local scratch",
+                            value=STAGE_LOCAL_DEFAULT,
+                        ),
+                        width="auto",
+                    ),
+                ],
+                class_name="mb-3",
+            ),
+
             # submit buttons
             dbc.Row(
                 [
@@ -91,6 +163,7 @@ def serve_submission_tab():
 
             # hidden stores for data passing
             dcc.Store(id="store-submission"),
+            dcc.Store(id="store-submit-key"),
             dcc.Download(id="download-json"),
             
             # JSON preview and status
@@ -98,7 +171,7 @@ def serve_submission_tab():
                 dbc.Card(
                     [
                         dbc.CardHeader("Preview AF3 Input JSON"),
-                        dbc.CardBody(html.Pre(id="json-preview-content", style={"whiteSpace": "pre-wrap", "textAlign": "left"})),
+                        dbc.CardBody(html.Pre(id="json-preview-content", style={"whiteSpace": "pre-wrap", "wordBreak": "break-all", "textAlign": "left"})),
                     ]
                 ),
                 id="json-collapse",
@@ -118,18 +191,31 @@ def serve_history_table(entries):
       - name: the job folder name
       - timestamp: the TS string
       - email: the user email
-      - zip: the absolute path to the .zip file
-    return a Dash `dbc.Table` with one row per entry and a Download button.
+      - status: "completed", "in progress" or "failed"
+      - progress: optional stage / ETA text
+      - zip: the absolute path to the .zip file (None while the job runs)
+    return a Dash `dbc.Table` with one row per entry, a Log button and a
+    Download button (disabled until the results archive exists).
     """
     header = html.Thead(html.Tr([
         html.Th("Job"),
         html.Th("Time (YYYY/MM/DD - HH:MM:SS)"),
         html.Th("User Email"),
+        html.Th("Status"),
+        html.Th("Progress"),
+        html.Th("Log"),
         html.Th("Download"),
     ]))
 
     rows = []
     for idx, e in enumerate(entries):
+        log_btn = dbc.Button(
+            "View",
+            id={"type": "view-log", "index": idx},
+            size="sm",
+            color="secondary",
+            outline=True,
+        )
         btn = dbc.Button(
             "Download",
             id={"type": "download-history", "index": idx},
@@ -137,31 +223,131 @@ def serve_history_table(entries):
             color="primary",
             outline=True,
             class_name="btn-download",
+            disabled=not e.get("zip"),
         )
         rows.append(html.Tr([
             html.Td(e["name"]),
             html.Td(e["timestamp"]),
             html.Td(e["email"]),
+            html.Td(e.get("status", "")),
+            html.Td(e.get("progress", "")),
+            html.Td(log_btn),
             html.Td(btn),
         ]))
 
     body = html.Tbody(rows)
     return dbc.Table([header, body], bordered=True, hover=True, class_name="text-center align-middle")
 
+def serve_log_viewer():
+    """Collapsible viewer that tails the Slurm output of the selected job."""
+    return dbc.Collapse(
+        dbc.Card(
+            [
+                dbc.CardHeader(
+                    dbc.Row(
+                        [
+                            dbc.Col(html.Span(id="log-title")),
+                            dbc.Col(
+                                dbc.Button("Close", id="log-close", size="sm", color="secondary", outline=True),
+                                width="auto",
+                            ),
+                        ],
+                        align="center",
+                    )
+                ),
+                dbc.CardBody(
+                    html.Pre(
+                        id="log-content",
+                        children=[],
+                        className="log-viewer",
+                    )
+                ),
+            ],
+            class_name="mb-3",
+        ),
+        id="log-collapse",
+        is_open=False,
+    )
+
+TAB_STYLE = {
+    "padding": "10px 24px",
+    "fontSize": "1.2rem",
+    "width": "200px",
+    "textAlign": "center",
+}
+SELECTED_TAB_STYLE = {**TAB_STYLE, "fontWeight": "bold"}
+
+
+def _fmt_duration(seconds):
+    return "–" if seconds is None else format_seconds(seconds)
+
+
+def _table(columns, rows):
+    return dbc.Table(
+        [
+            html.Thead(html.Tr([html.Th(c) for c in columns])),
+            html.Tbody([html.Tr([html.Td(v) for v in row]) for row in rows]),
+        ],
+        bordered=True, hover=True, size="sm", class_name="text-center align-middle",
+    )
+
+
+def serve_analytics(summary):
+    """
+    Render the aggregates from events.summary(): headline numbers, GPU
+    hours per user, failure rate by input size and time spent per stage.
+    """
+    wait = summary["queue_wait"]
+    failure_rate = summary["failed"] / summary["finished"] if summary["finished"] else 0.0
+    headline = dbc.Row(
+        [
+            dbc.Col(dbc.Card(dbc.CardBody([html.H4(value), html.Small(label, className="text-muted")])))
+            for label, value in [
+                ("jobs", summary["jobs"]),
+                ("finished", summary["finished"]),
+                ("failure rate", f"{failure_rate:.0%}"),
+                ("median queue wait", _fmt_duration(wait["median"])),
+                ("p90 queue wait", _fmt_duration(wait["p90"])),
+                ("GPU hours", f"{summary['gpu_hours']:.1f}"),
+                ("downloads", summary["downloads"]),
+            ]
+        ],
+        class_name="mb-4 text-center",
+    )
+    users = _table(
+        ["User", "Jobs", "Failed", "GPU hours"],
+        [[uid, u["jobs"], u["failed"], f"{u['gpu_hours']:.1f}"] for uid, u in summary["users"].items()],
+    )
+    sizes = _table(
+        ["Tokens", "Finished jobs", "Failed", "Failure rate"],
+        [[b, s["jobs"], s["failed"], f"{s['failed'] / s['jobs']:.0%}"] for b, s in summary["sizes"].items()],
+    )
+    stages = _table(
+        ["Stage", "Jobs", "Median", "p90"],
+        [
+            [STAGES.get(stage, stage), q["n"], _fmt_duration(q["median"]), _fmt_duration(q["p90"])]
+            for stage, q in summary["stages"].items()
+        ],
+    )
+    return html.Div([
+        headline,
+        dbc.Row([
+            dbc.Col([html.H5("GPU hours by user"), users], md=6),
+            dbc.Col([html.H5("Failures by input size"), sizes], md=6),
+        ]),
+        html.H5("Time per stage (finished jobs)"),
+        html.P(
+            "Stages of older jobs whose log lines carry no timestamp are only known "
+            "to within a tracker interval and are left out.",
+            className="text-muted small",
+        ),
+        stages,
+    ])
+
+
 def serve_layout():
-    tab_style = {
-        "padding": "10px 24px",
-        "fontSize": "1.2rem",
-        "width": "200px",
-        "textAlign": "center",
-    }
-    selected_tab_style = {
-        "padding": "10px 24px",
-        "fontSize": "1.2rem",
-        "width": "200px",
-        "textAlign": "center",
-        "fontWeight": "bold",
-    }
+    tab_style = TAB_STYLE
+    selected_tab_style = SELECTED_TAB_STYLE
     return dbc.Container([
         html.Link(id="theme-link", rel="stylesheet", href=dbc.themes.LUX),
         dcc.Store(id="theme-store", data={
@@ -216,10 +402,30 @@ def serve_layout():
                                         "Download may take a few seconds to start, thank you for your patience. ",
                                         style={"marginBottom": "1rem"}
                                     ),
+                                    serve_log_viewer(),
                                     html.Div(id="job-history-table"),
                                 ], style={"padding": "1rem"})                                
                             ],
                         ),
+                        dcc.Tab(
+                            label="Analytics",
+                            value="tab-analytics",
+                            id="tab-analytics",
+                            # shown to AF3_ADMIN_UIDS only (see callbacks.show_analytics_tab)
+                            style={**tab_style, "display": "none"},
+                            selected_style=selected_tab_style,
+                            children=[
+                                html.Div([
+                                    html.H2("Cluster Efficiency", style={"marginTop": "1rem", "textAlign": "center"}),
+                                    html.P(
+                                        "Aggregated from the job event log: queue waits, GPU hours, "
+                                        "failure rates and time spent per stage.",
+                                        className="text-muted mb-4",
+                                    ),
+                                    html.Div(id="analytics-content"),
+                                ], style={"padding": "1rem"})
+                            ],
+                        ),
                     ],
                 ),
                 style={
@@ -231,6 +437,8 @@ def serve_layout():
             # hidden stores & downloads
             dcc.Store(id="uid-store"),
             dcc.Store(id="store-history"),
+            dcc.Store(id="store-log-viewer"),
+            dcc.Interval(id="log-interval", interval=3000, disabled=True),
             dcc.Download(id="download-results"),
         ])
     ], fluid=False, class_name="pt-4")
@@ -0,0 +1,525 @@
+"""
+Load generator replaying user sessions against the Dash callback endpoint.
+
+Each virtual user walks through the submission flow the same way the
+browser does -- it adds entity cards (`update_entity_list`), picks their
+types (`render_fields`), generates the input JSON (`generate_json`),
+downloads it, submits (`submit_job`), opens the history tab
+(`update_history`) and downloads a result archive (`download_results`) --
+by POSTing to `/_dash-update-component`. Latency, error rate and payload
+sizes are reported per callback.
+
+Run fully offline against a throwaway instance that uses the fake
+scheduler from `fake_slurm.py` and a synthetic `jobs/` tree:
+
+    python loadtest.py --spawn --users 20 --sessions 5 --synthetic-jobs 500
+
+or against an already running app:
+
+    python loadtest.py --url http://localhost:8050 --users 10
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+REPO = Path(__file__).resolve().parent
+ENDPOINT = "/_dash-update-component"
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+LIGANDS = ["CC(=O)OC1=CC=CC=C1C(=O)O", "C1=CC=C(C=C1)O", "CCO"]
+IONS = ["MG", "ZN", "NA", "CL"]
+
+
+def _pattern(type_, wildcard="ALL"):
+    return json.dumps({"index": [wildcard], "type": type_}, separators=(",", ":"))
+
+
+def _multi(*outputs):
+    return ".." + "...".join(outputs) + ".."
+
+
+# ---------------------------------------------------------------------------
+# transport & statistics
+# ---------------------------------------------------------------------------
+
+class HTTPTransport:
+    """One keep-alive connection per virtual user."""
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.conn = None
+
+    def post(self, path: str, body: bytes, headers: dict) -> tuple[int, bytes]:
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request("POST", path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+        raise RuntimeError("unreachable")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Stats:
+    """Thread-safe per-callback latency / error / payload accounting."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name: str, latency: float, ok: bool, sent: int, received: int):
+        with self.lock:
+            s = self.samples.setdefault(
+                name, {"latency": [], "errors": 0, "sent": 0, "received": 0}
+            )
+            s["latency"].append(latency)
+            s["errors"] += 0 if ok else 1
+            s["sent"] += sent
+            s["received"] += received
+
+    def summary(self) -> dict:
+        out = {}
+        with self.lock:
+            for name, s in self.samples.items():
+                n = len(s["latency"])
+                lat = sorted(s["latency"])
+                out[name] = {
+                    "count": n,
+                    "errors": s["errors"],
+                    "error_rate": s["errors"] / n if n else 0.0,
+                    "p50_ms": percentile(lat, 50) * 1000,
+                    "p95_ms": percentile(lat, 95) * 1000,
+                    "p99_ms": percentile(lat, 99) * 1000,
+                    "avg_request_bytes": s["sent"] / n if n else 0,
+                    "avg_response_bytes": s["received"] / n if n else 0,
+                }
+        return out
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+# ---------------------------------------------------------------------------
+# a single virtual user session
+# ---------------------------------------------------------------------------
+
+class Session:
+    """
+    Replays one browser session. Component state that the browser would
+    hold (entity cards, stores) is kept here and fed back as callback
+    inputs/states, so payload sizes match what a real client sends.
+    """
+
+    def __init__(self, transport, stats: Stats, rng: random.Random, uid: str = "loadtest"):
+        self.transport = transport
+        self.stats = stats
+        self.rng = rng
+        self.headers = {"Content-Type": "application/json", "UID": uid}
+        self.cards = []          # [{"uid", "type", "fields": {...}}]
+        self.children = []       # entity-list children as returned by the server
+        self.add_clicks = 0
+        self.submission = None
+        self.submit_key = None
+        self.num_seeds = 1
+        self.history = None
+
+    def call(self, name: str, output: str, outputs, inputs, state=(), changed=()):
+        payload = {
+            "output": output,
+            "outputs": outputs,
+            "inputs": list(inputs),
+            "state": list(state),
+            "changedPropIds": list(changed),
+        }
+        body = json.dumps(payload).encode()
+        start = time.perf_counter()
+        try:
+            status, data = self.transport.post(ENDPOINT, body, self.headers)
+        except (OSError, http.client.HTTPException):
+            self.stats.add(name, time.perf_counter() - start, False, len(body), 0)
+            return None
+        self.stats.add(name, time.perf_counter() - start, status in (200, 204), len(body), len(data))
+        if status != 200:
+            return None
+        return json.loads(data)["response"]
+
+    # -- callbacks ---------------------------------------------------------
+
+    def add_entity(self):
+        self.add_clicks += 1
+        removes = [
+            {"id": {"type": "remove-entity", "index": c["uid"]}, "property": "n_clicks", "value": 0}
+            for c in self.cards
+        ]
+        resp = self.call(
+            "update_entity_list",
+            "entity-list.children",
+            {"id": "entity-list", "property": "children"},
+            [{"id": "add-entity-button", "property": "n_clicks", "value": self.add_clicks}, removes],
+            [{"id": "entity-list", "property": "children", "value": self.children}],
+            ["add-entity-button.n_clicks"],
+        )
+        if resp is None:
+            return None
+        self.children = resp["entity-list"]["children"]
+        uid = self.children[-1]["props"]["id"]["index"]
+        card = {"uid": uid, "type": None, "copies": 1, "fields": {}}
+        self.cards.append(card)
+        return card
+
+    def set_type(self, card: dict, entity_type: str):
+        card["type"] = entity_type
+        ident = {"type": "entity-type", "index": card["uid"]}
+        self.call(
+            "render_fields",
+            _pattern("entity-body", "MATCH") + ".children",
+            {"id": {"type": "entity-body", "index": card["uid"]}, "property": "children"},
+            [{"id": ident, "property": "value", "value": entity_type}],
+            changed=[json.dumps(ident, separators=(",", ":")) + ".value"],
+        )
+        rng = self.rng
+        if entity_type in ("protein", "rna", "dna"):
+            alphabet = AMINO_ACIDS if entity_type == "protein" else ("ACGU" if entity_type == "rna" else "ACGT")
+            card["fields"]["sequence"] = "".join(rng.choice(alphabet) for _ in range(rng.randint(50, 800)))
+            card["fields"]["msa-store"] = None
+        elif entity_type == "ligand":
+            card["fields"]["ligand-smiles"] = rng.choice(LIGANDS)
+            card["fields"]["ligand-ccd"] = ""
+        else:
+            card["fields"]["ion-name"] = rng.choice(IONS)
+            self.autocomplete(card, "ion-name", "ion-options", card["fields"]["ion-name"][:1])
+        card["fields"]["bonded-ids"] = ""
+
+    def autocomplete(self, card: dict, field: str, options: str, value: str):
+        ident = {"type": field, "index": card["uid"]}
+        self.call(
+            "suggest_ion" if field == "ion-name" else "suggest_ccd",
+            _multi(_pattern(options, "MATCH") + ".children", _pattern(field, "MATCH") + ".invalid"),
+            [
+                {"id": {"type": options, "index": card["uid"]}, "property": "children"},
+                {"id": ident, "property": "invalid"},
+            ],
+            [{"id": ident, "property": "value", "value": value}],
+            changed=[json.dumps(ident, separators=(",", ":")) + ".value"],
+        )
+
+    def _all(self, type_: str, prop: str = "value"):
+        values = []
+        for c in self.cards:
+            if type_ in ("entity-card",):
+                values.append({"id": {"type": type_, "index": c["uid"]}, "property": "id",
+                               "value": {"type": type_, "index": c["uid"]}})
+            elif type_ == "entity-type":
+                values.append({"id": {"type": type_, "index": c["uid"]}, "property": prop, "value": c["type"]})
+            elif type_ == "entity-copies":
+                values.append({"id": {"type": type_, "index": c["uid"]}, "property": prop, "value": c["copies"]})
+            elif type_ in c["fields"]:
+                values.append({"id": {"type": type_, "index": c["uid"]}, "property": prop,
+                               "value": c["fields"][type_]})
+        return values
+
+    def generate_json(self, job_name: str):
+        resp = self.call(
+            "generate_json",
+            _multi("json-preview-content.children", "json-collapse.is_open",
+                   "store-submission.data", "store-submit-key.data"),
+            [
+                {"id": "json-preview-content", "property": "children"},
+                {"id": "json-collapse", "property": "is_open"},
+                {"id": "store-submission", "property": "data"},
+                {"id": "store-submit-key", "property": "data"},
+            ],
+            [{"id": "generate-json-button", "property": "n_clicks", "value": 1}],
+            [
+                {"id": "job-name", "property": "value", "value": job_name},
+                self._all("entity-card", "id"),
+                self._all("entity-type"),
+                self._all("entity-copies"),
+                self._all("sequence"),
+                self._all("ligand-smiles"),
+                self._all("ligand-ccd"),
+                self._all("ion-name"),
+                self._all("bonded-ids"),
+                {"id": "num-seeds", "property": "value", "value": self.num_seeds},
+                self._all("msa-store", "data"),
+                {"id": "store-data-json", "property": "data", "value": None},
+            ],
+            ["generate-json-button.n_clicks"],
+        )
+        if resp is not None:
+            self.submission = resp["store-submission"]["data"]
+            self.submit_key = resp["store-submit-key"]["data"]
+
+    def download_json(self, job_name: str):
+        self.call(
+            "download_json",
+            "download-json.data",
+            {"id": "download-json", "property": "data"},
+            [{"id": "download-json-button", "property": "n_clicks", "value": 1}],
+            [
+                {"id": "job-name", "property": "value", "value": job_name},
+                {"id": "store-submission", "property": "data", "value": self.submission},
+            ],
+            ["download-json-button.n_clicks"],
+        )
+
+    def submit_job(self, job_name: str, email: str):
+        self.call(
+            "submit_job",
+            _multi("job-status.children", "job-status.is_open"),
+            [{"id": "job-status", "property": "children"}, {"id": "job-status", "property": "is_open"}],
+            [{"id": "submit-job", "property": "n_clicks", "value": 1}],
+            [
+                {"id": "job-name", "property": "value", "value": job_name},
+                {"id": "email", "property": "value", "value": email},
+                {"id": "store-submission", "property": "data", "value": self.submission},
+                {"id": "store-submit-key", "property": "data", "value": self.submit_key},
+                {"id": "uid-store", "property": "data", "value": self.headers["UID"]},
+                {"id": "stage-local", "property": "value", "value": False},
+            ],
+            ["submit-job.n_clicks"],
+        )
+
+    def update_history(self):
+        resp = self.call(
+            "update_history",
+            _multi("job-history-table.children", "store-history.data"),
+            [{"id": "job-history-table", "property": "children"}, {"id": "store-history", "property": "data"}],
+            [{"id": "tabs", "property": "value", "value": "tab-history"}],
+            changed=["tabs.value"],
+        )
+        if resp is not None:
+            self.history = resp["store-history"]["data"]
+
+    def download_results(self):
+        if not self.history:
+            return
+        idx = self.rng.randrange(len(self.history))
+        clicks = [
+            {"id": {"type": "download-history", "index": i}, "property": "n_clicks",
+             "value": 1 if i == idx else None}
+            for i in range(len(self.history))
+        ]
+        self.call(
+            "download_results",
+            "download-results.data",
+            {"id": "download-results", "property": "data"},
+            [clicks],
+            [
+                {"id": "store-history", "property": "data", "value": self.history},
+                {"id": "uid-store", "property": "data", "value": self.headers["UID"]},
+            ],
+            [json.dumps({"index": idx, "type": "download-history"}, separators=(",", ":")) + ".n_clicks"],
+        )
+
+    # -- scenario ------------------------------------------------------------
+
+    def run(self, submit: bool = True):
+        rng = self.rng
+        job_name = f"load{uuid.uuid4().hex[:8]}"
+        types = ["protein"] + rng.sample(["protein", "ligand", "ion", "rna"], rng.randint(0, 3))
+        for entity_type in types:
+            card = self.add_entity()
+            if card is None:
+                return
+            self.set_type(card, entity_type)
+        self.generate_json(job_name)
+        if self.submission is None:
+            return
+        self.download_json(job_name)
+        if submit:
+            self.submit_job(job_name, "loadtest@example.com")
+        self.update_history()
+        self.download_results()
+
+
+# ---------------------------------------------------------------------------
+# offline fixtures
+# ---------------------------------------------------------------------------
+
+def make_synthetic_jobs(base: Path, count: int, zip_bytes: int = 64 * 1024, seed: int = 0) -> None:
+    """Populate `base` with completed-looking job directories and result archives."""
+    rng = random.Random(seed)
+    base.mkdir(parents=True, exist_ok=True)
+    payload = rng.randbytes(zip_bytes)
+    start = time.time() - count * 3600
+    for i in range(count):
+        ts = time.strftime("%Y%m%dT%H%M%S", time.localtime(start + i * 3600))
+        name = f"synthetic{i:05d}"
+        job_dir = base / f"{name}_{ts}"
+        (job_dir / "logs").mkdir(parents=True, exist_ok=True)
+        (job_dir / "submit.sh").write_text(f"#SBATCH --mail-user=user{i % 17}@example.com\n")
+        with zipfile.ZipFile(job_dir / f"{name}_{ts}.zip", "w") as zf:
+            zf.writestr(f"{name}/ranking_scores.csv", "seed,sample,ranking_score\n1,0,0.80\n")
+            zf.writestr(f"{name}/{name}_model.cif", payload)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_app(workdir: Path, synthetic_jobs: int) -> tuple[subprocess.Popen, str]:
+    """Start a local app instance wired to the fake scheduler; return it and its URL."""
+    jobs = workdir / "jobs"
+    make_synthetic_jobs(jobs, synthetic_jobs)
+    port = _free_port()
+    env = os.environ.copy()
+    env.update({
+        "AF3_JOBS_DIR": str(jobs),
+        "AF3_SBATCH": str(REPO / "bin" / "sbatch"),
+        "FAKE_SLURM_HOME": str(workdir / "slurm"),
+        "AF3_BACKGROUND": "1",
+    })
+    env.setdefault("FAKE_AF3_PIPELINE_DELAY", "2")
+    env.setdefault("FAKE_AF3_SEED_DELAY", "2")
+    proc = subprocess.Popen(
+        [sys.executable, "-c",
+         f"from app import app; app.run(host='127.0.0.1', port={port}, debug=False, threaded=True)"],
+        cwd=REPO,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline and proc.poll() is None:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/_dash-layout")
+            if conn.getresponse().status == 200:
+                return proc, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("app did not start")
+
+
+# ---------------------------------------------------------------------------
+# driver
+# ---------------------------------------------------------------------------
+
+def run_load(url: str, users: int, sessions: int, submit: bool = True, seed: int = 0,
+             transport_factory=None) -> tuple[dict, float]:
+    """
+    Run `users` concurrent virtual users, each replaying `sessions` sessions.
+    Returns the per-callback summary and the wall-clock duration.
+    """
+    stats = Stats()
+    transport_factory = transport_factory or (lambda: HTTPTransport(url))
+
+    def user(n):
+        transport = transport_factory()
+        rng = random.Random(seed * 100003 + n)
+        try:
+            for _ in range(sessions):
+                Session(transport, stats, rng, uid=f"vu{n}").run(submit=submit)
+        finally:
+            close = getattr(transport, "close", None)
+            if close:
+                close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(user, range(users)))
+    return stats.summary(), time.perf_counter() - start
+
+
+def format_report(summary: dict, elapsed: float) -> str:
+    header = f"{'callback':<20}{'count':>7}{'err%':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req B':>10}{'resp B':>11}"
+    lines = [header, "-" * len(header)]
+    total = 0
+    for name, s in sorted(summary.items()):
+        total += s["count"]
+        lines.append(
+            f"{name:<20}{s['count']:>7}{s['error_rate'] * 100:>6.1f}%"
+            f"{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}"
+            f"{s['avg_request_bytes']:>10.0f}{s['avg_response_bytes']:>11.0f}"
+        )
+    lines.append("-" * len(header))
+    lines.append(f"{total} requests in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} req/s)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8050", help="running app to target")
+    parser.add_argument("--spawn", action="store_true", help="start a throwaway local app with the fake scheduler")
+    parser.add_argument("--synthetic-jobs", type=int, default=200, help="job directories to pre-populate with --spawn")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--sessions", type=int, default=3, help="sessions per virtual user")
+    parser.add_argument("--no-submit", action="store_true", help="skip submit_job (no sbatch calls)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    proc, url = None, args.url
+    with tempfile.TemporaryDirectory(prefix="af3-loadtest-") as tmp:
+        if args.spawn:
+            proc, url = spawn_app(Path(tmp), args.synthetic_jobs)
+        try:
+            summary, elapsed = run_load(url, args.users, args.sessions, not args.no_submit, args.seed)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+                subprocess.run([str(REPO / "bin" / "scancel"), *_active_fake_jobs(Path(tmp))],
+                               env={**os.environ, "FAKE_SLURM_HOME": str(Path(tmp) / "slurm")},
+                               capture_output=True)
+
+    if args.json:
+        print(json.dumps({"elapsed_s": elapsed, "callbacks": summary}, indent=2))
+    else:
+        print(format_report(summary, elapsed))
+    return 0
+
+
+def _active_fake_jobs(workdir: Path) -> list[str]:
+    jobs = workdir / "slurm" / "jobs"
+    if not jobs.is_dir():
+        return []
+    ids = []
+    for f in jobs.glob("*.json"):
+        try:
+            if json.loads(f.read_text())["state"] in ("PENDING", "RUNNING"):
+                ids.append(f.stem)
+        except (json.JSONDecodeError, KeyError):
+            continue
+    return ids
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+Precomputed MSAs and templates for protein and RNA chains.
+
+Uploaded files never live in the Dash stores. `save_upload` decodes each
+upload straight into `<jobs>/.uploads/<token>/<file>`, and the browser
+keeps only the short reference `<token>/<file>`. In the AF3 input the
+files are referenced by path (`unpairedMsaPath`, `pairedMsaPath`,
+template `mmcifPath`) relative to `input.json`, as `msas/<token>/<file>`.
+On submission `job_files` links them into the job directory under those
+names.
+
+A previous job's `*_data.json` already contains every chain's MSAs and
+templates inline. `import_data_json` splits them into files keyed by
+chain sequence, so matching chains of a new job can reuse them.
+
+When every protein and RNA chain has an MSA, `needs_data_pipeline` is
+false and the job script runs AF3 with `--run_data_pipeline=false`.
+
+This module only uses the standard library.
+"""
+import base64
+import binascii
+import difflib
+import hashlib
+import json
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+UPLOADS_DIRNAME = ".uploads"
+MSA_DIRNAME = "msas"
+
+# Uploads not used by a submission within this many seconds are removed.
+UPLOAD_MAX_AGE = 7 * 24 * 3600
+
+REF_RE = re.compile(r"^[0-9a-f]{32}/[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+# residue names of standard (and common modified) amino acids / nucleotides
+ONE_LETTER = {
+    "ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C", "GLN": "Q",
+    "GLU": "E", "GLY": "G", "HIS": "H", "ILE": "I", "LEU": "L", "LYS": "K",
+    "MET": "M", "PHE": "F", "PRO": "P", "SER": "S", "THR": "T", "TRP": "W",
+    "TYR": "Y", "VAL": "V", "MSE": "M", "SEC": "U", "PYL": "O",
+    "A": "A", "C": "C", "G": "G", "U": "U",
+}
+
+
+# ---------------------------------------------------------------------------
+# uploads
+# ---------------------------------------------------------------------------
+
+def _safe_name(filename: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", Path(filename or "upload").name).lstrip("._")
+    return name or "upload"
+
+
+def decode_contents(contents: str) -> bytes:
+    """Decode the `data:<mime>;base64,<data>` string of a dcc.Upload."""
+    try:
+        return base64.b64decode(contents.split(",", 1)[1], validate=True)
+    except (IndexError, ValueError, binascii.Error) as e:
+        raise ValueError("Upload could not be decoded") from e
+
+
+def save_upload(base: Path, filename: str, contents: str, token: str | None = None) -> str:
+    """
+    Write an uploaded file under `<base>/.uploads/<token>/` and return its
+    reference `<token>/<file>`. A new token is drawn unless one is given.
+    """
+    token = token or uuid.uuid4().hex
+    folder = base / UPLOADS_DIRNAME / token
+    folder.mkdir(parents=True, exist_ok=True)
+    name = _safe_name(filename)
+    (folder / name).write_bytes(decode_contents(contents))
+    return f"{token}/{name}"
+
+
+def upload_path(base: Path, ref: str) -> Path:
+    """Path of an uploaded file; rejects anything but `<token>/<file>` references."""
+    if not isinstance(ref, str) or not REF_RE.match(ref):
+        raise ValueError(f"Invalid upload reference: {ref!r}")
+    return base / UPLOADS_DIRNAME / ref
+
+
+def input_path(ref: str) -> str:
+    """How an uploaded file is referenced from a job's input.json."""
+    return f"{MSA_DIRNAME}/{ref}"
+
+
+def prune_uploads(base: Path, max_age: float = UPLOAD_MAX_AGE) -> None:
+    """Remove upload folders older than `max_age` seconds."""
+    root = base / UPLOADS_DIRNAME
+    cutoff = time.time() - max_age
+    for folder in root.iterdir() if root.exists() else []:
+        try:
+            if folder.stat().st_mtime < cutoff:
+                shutil.rmtree(folder, ignore_errors=True)
+        except FileNotFoundError:
+            continue
+
+
+# ---------------------------------------------------------------------------
+# file checks
+# ---------------------------------------------------------------------------
+
+def a3m_query(path: Path) -> str | None:
+    """The first (query) sequence of an A3M/FASTA file, gaps removed."""
+    seq, started = [], False
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            line = line.strip()
+            if line.startswith(">"):
+                if started:
+                    break
+                started = True
+            elif started and line:
+                seq.append(line)
+    if not started:
+        return None
+    return "".join(seq).replace("-", "").replace(".", "").upper()
+
+
+def _loop_rows(lines: list[str], category: str) -> list[dict]:
+    """Rows of the first `loop_` whose columns belong to `category` (simple mmCIF)."""
+    for i, line in enumerate(lines):
+        if line.strip() != "loop_" or not lines[i + 1:i + 2] or \
+                not lines[i + 1].startswith(f"_{category}."):
+            continue
+        cols, j = [], i + 1
+        while j < len(lines) and lines[j].startswith(f"_{category}."):
+            cols.append(lines[j].split()[0].split(".", 1)[1])
+            j += 1
+        rows = []
+        while j < len(lines) and not lines[j].startswith(("_", "loop_", "#", "data_")):
+            values = lines[j].split()
+            if len(values) == len(cols):
+                rows.append(dict(zip(cols, values)))
+            j += 1
+        return rows
+    return []
+
+
+def template_sequence(mmcif: str) -> str:
+    """
+    One-letter sequence of the first polymer in a template mmCIF: the
+    `_entity_poly_seq` records if present, else the residues with CA/P
+    atoms in `_atom_site`.
+    """
+    lines = mmcif.splitlines()
+    rows = _loop_rows(lines, "entity_poly_seq")
+    if rows:
+        entity = rows[0]["entity_id"]
+        return "".join(ONE_LETTER.get(r["mon_id"], "X") for r in rows if r["entity_id"] == entity)
+    seq, seen = [], set()
+    atoms = _loop_rows(lines, "atom_site")
+    chain = atoms[0].get("label_asym_id") if atoms else None
+    for r in atoms:
+        if r.get("label_asym_id") != chain or r.get("label_atom_id") not in ("CA", "P"):
+            continue
+        key = r.get("label_seq_id")
+        if key not in seen:
+            seen.add(key)
+            seq.append(ONE_LETTER.get(r.get("label_comp_id"), "X"))
+    return "".join(seq)
+
+
+def template_mapping(query: str, template: str) -> tuple[list[int], list[int]]:
+    """
+    Zero-based query/template residue indices of identical aligned
+    residues, from the matching blocks of a difflib alignment.
+    """
+    matcher = difflib.SequenceMatcher(None, query, template, autojunk=False)
+    query_idx, template_idx = [], []
+    for a, b, size in matcher.get_matching_blocks():
+        query_idx.extend(range(a, a + size))
+        template_idx.extend(range(b, b + size))
+    return query_idx, template_idx
+
+
+# ---------------------------------------------------------------------------
+# previous jobs' *_data.json
+# ---------------------------------------------------------------------------
+
+def sequence_key(sequence: str) -> str:
+    return hashlib.sha256(sequence.strip().upper().encode()).hexdigest()[:16]
+
+
+def import_data_json(base: Path, contents: str) -> tuple[str, int]:
+    """
+    Split the inline MSAs and templates of an AF3 `*_data.json` upload into
+    files under a new upload token, with a `manifest.json` keyed by chain
+    sequence. Returns the token and the number of chains imported.
+    """
+    try:
+        data = json.loads(decode_contents(contents))
+        sequences = data["sequences"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Not an AlphaFold3 data JSON") from e
+
+    token = uuid.uuid4().hex
+    folder = base / UPLOADS_DIRNAME / token
+    folder.mkdir(parents=True)
+    manifest = {}
+    for entry in sequences:
+        kind, body = next(iter(entry.items()))
+        if kind not in ("protein", "rna") or body.get("unpairedMsa") is None:
+            continue
+        key = sequence_key(body["sequence"])
+        if key in manifest:
+            continue
+        record = {"kind": kind, "unpaired": None, "paired": None, "templates": []}
+        (folder / f"{key}_unpaired.a3m").write_text(body["unpairedMsa"])
+        record["unpaired"] = f"{token}/{key}_unpaired.a3m"
+        if body.get("pairedMsa"):
+            (folder / f"{key}_paired.a3m").write_text(body["pairedMsa"])
+            record["paired"] = f"{token}/{key}_paired.a3m"
+        for i, tpl in enumerate(body.get("templates") or []):
+            (folder / f"{key}_template_{i}.cif").write_text(tpl["mmcif"])
+            record["templates"].append({
+                "ref": f"{token}/{key}_template_{i}.cif",
+                "queryIndices": tpl["queryIndices"],
+                "templateIndices": tpl["templateIndices"],
+            })
+        manifest[key] = record
+    (folder / "manifest.json").write_text(json.dumps(manifest))
+    return token, len(manifest)
+
+
+def data_json_record(base: Path, token: str, sequence: str) -> dict | None:
+    """Precomputed data imported under `token` for a chain `sequence`, if any."""
+    if not re.fullmatch(r"[0-9a-f]{32}", token or ""):
+        return None
+    try:
+        manifest = json.loads((base / UPLOADS_DIRNAME / token / "manifest.json").read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+    return manifest.get(sequence_key(sequence))
+
+
+# ---------------------------------------------------------------------------
+# submissions
+# ---------------------------------------------------------------------------
+
+def attach(submission, base: Path, data_json_token: str | None = None) -> str | None:
+    """
+    Resolve the precomputed data of each protein/RNA entity of an
+    `AF3Submission` into input paths: its own uploads (`ent.precomputed`,
+    a dict of references) or else a chain of the imported data JSON with
+    the same sequence. Returns an error message, or None.
+    """
+    for ent in submission.entities:
+        if ent.type not in ("protein", "rna") or not ent.sequence:
+            continue
+        refs = ent.precomputed or {}
+        if not refs.get("unpaired") and data_json_token:
+            refs = data_json_record(base, data_json_token, ent.sequence) or refs
+        if not any(refs.get(k) for k in ("unpaired", "paired", "templates")):
+            continue
+        try:
+            for key in ("unpaired", "paired"):
+                if refs.get(key):
+                    path = upload_path(base, refs[key])
+                    if not path.is_file():
+                        return f"Uploaded MSA {path.name} is no longer available; upload it again."
+                    query = a3m_query(path)
+                    if query != ent.sequence.upper():
+                        return f"The first sequence in {path.name} does not match the {ent.type} sequence."
+            templates = []
+            for tpl in refs.get("templates") or []:
+                tpl = tpl if isinstance(tpl, dict) else {"ref": tpl}
+                path = upload_path(base, tpl["ref"])
+                if not path.is_file():
+                    return f"Uploaded template {path.name} is no longer available; upload it again."
+                if "queryIndices" not in tpl:
+                    q, t = template_mapping(ent.sequence.upper(), template_sequence(path.read_text()))
+                    if not q:
+                        return f"Template {path.name} shares no residues with the {ent.type} sequence."
+                    tpl = {**tpl, "queryIndices": q, "templateIndices": t}
+                templates.append({
+                    "mmcifPath": input_path(tpl["ref"]),
+                    "queryIndices": tpl["queryIndices"],
+                    "templateIndices": tpl["templateIndices"],
+                })
+        except ValueError as e:
+            return str(e)
+        ent.unpaired_msa_path = input_path(refs["unpaired"]) if refs.get("unpaired") else None
+        ent.paired_msa_path = input_path(refs["paired"]) if refs.get("paired") else None
+        ent.templates = templates
+    return None
+
+
+def _chains(fold_input: dict):
+    for entry in fold_input.get("sequences", []):
+        kind, body = next(iter(entry.items()))
+        if kind in ("protein", "rna"):
+            yield kind, body
+
+
+def needs_data_pipeline(fold_input: dict) -> bool:
+    """True unless every protein and RNA chain comes with its MSA."""
+    return any(
+        body.get("unpairedMsa") is None and body.get("unpairedMsaPath") is None
+        for _, body in _chains(fold_input)
+    )
+
+
+def job_files(base: Path, fold_input: dict) -> dict[str, Path]:
+    """Job-relative names and upload paths of the files an input references."""
+    files = {}
+    for _, body in _chains(fold_input):
+        paths = [body.get("unpairedMsaPath"), body.get("pairedMsaPath")]
+        paths += [t.get("mmcifPath") for t in body.get("templates") or []]
+        for rel in paths:
+            if rel and rel.startswith(f"{MSA_DIRNAME}/"):
+                files[rel] = upload_path(base, rel[len(MSA_DIRNAME) + 1:])
+    return files
@@ -0,0 +1,419 @@
+"""
+Stage-aware progress tracking and runtime prediction for AF3 jobs.
+
+`job_progress` follows a job's Slurm output incrementally: the parsed
+state and the byte offset reached are cached per log file, so a refresh
+only parses lines written since the previous one. Once a job is over
+its final state is stored in meta.json and the log is never read again.
+
+Every stage transition is also appended to the event log (events.py).
+`start_tracker` follows unfinished jobs in the background, so events are
+recorded even while nobody looks at the Job History, and it alone
+records a job's `finish` event (with `sacct` data) once its final state
+is known.
+
+`EtaModel` fits the wall time of completed jobs against their token count
+and number of seeds by least squares and predicts how long running or
+pending jobs will take.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+from helpers import (
+    find_slurm_log, read_job_meta, write_job_meta, read_log_chunk
+)
+from events import record_finish, record_stages
+
+log = logging.getLogger(__name__)
+
+# ordered stages and their display labels
+STAGES = {
+    "queued": "Queued (per-user job limit)",
+    "pending": "Pending",
+    "started": "Starting",
+    "msa": "MSA search",
+    "templates": "Template search",
+    "featurising": "Featurising",
+    "inference": "Inference",
+    "writing": "Writing outputs",
+    "packaging": "Packaging results",
+    "completed": "Completed",
+    "failed": "Failed",
+}
+TERMINAL_STAGES = ("completed", "failed")
+
+# marker lines echoed by templates/submit_template.sh
+MARKER_RE = re.compile(r"AF3_DASHAPP stage=(\w+) time=(\d+)(?: status=(\d+))?")
+# the template prefixes every AF3 output line with the time it was written
+STAMP_RE = re.compile(r"^\[(\d+)\] ")
+
+# AF3 log lines (substring match) and the stage they start
+LINE_STAGES = [
+    ("Running data pipeline...", "msa"),
+    ("Processing chain", "msa"),
+    ("MSAs took", "templates"),
+    ("Running data pipeline took", "featurising"),
+    ("Featurising data with", "featurising"),
+    ("Running model inference with seed", "inference"),
+    ("Writing outputs with", "writing"),
+]
+SEED_DONE_RE = re.compile(r"Running model inference with seed \d+ took")
+SEEDS_TOTAL_RE = re.compile(r"Predicting 3D structure for .* with (\d+) seed")
+FAILURE_MARKERS = ("Traceback (most recent call last)", "slurmstepd: error", "DUE TO TIME LIMIT")
+
+
+def new_state() -> dict:
+    return {
+        "stage": "pending",
+        "started_at": None,
+        "finished_at": None,
+        "stage_since": None,
+        "seeds_total": None,
+        "seeds_done": 0,
+        "error": None,
+        "offset": 0,
+        "stages": [],
+    }
+
+
+def _enter(state: dict, stage: str, at: float, exact: bool = True) -> None:
+    if state["stage"] != stage:
+        state["stage"] = stage
+        state["stage_since"] = at
+        state["stages"].append([stage, at, exact])
+
+
+def parse_lines(state: dict, text: str, now: float | None = None) -> dict:
+    """
+    Advance `state` with newly read log `text`. Marker lines and the AF3
+    lines stamped by the template carry the time they were written. Lines
+    without one (Slurm's own, or logs of older templates) are dated `now`,
+    which may be a whole tracker interval late; their transitions are kept
+    in `stages` as `[stage, at, False]` so that no duration is measured
+    from them. Only the start and end markers set `started_at`/`finished_at`,
+    which the ETA model uses.
+    """
+    now = now or time.time()
+    for line in text.splitlines():
+        stamp = STAMP_RE.match(line)
+        at, exact = (float(stamp.group(1)), True) if stamp else (now, False)
+        line = line[stamp.end():] if stamp else line
+        m = MARKER_RE.search(line)
+        if m:
+            marker, at, status = m.group(1), float(m.group(2)), m.group(3)
+            if marker == "start":
+                state["started_at"] = at
+                _enter(state, "started", at)
+            elif marker == "inference_done" and status not in (None, "0"):
+                state["error"] = state["error"] or f"AlphaFold3 exited with status {status}"
+            elif marker == "packaging":
+                _enter(state, "packaging", at)
+            elif marker == "end":
+                state["finished_at"] = at
+                _enter(state, "failed" if state["error"] else "completed", at)
+            continue
+
+        if any(f in line for f in FAILURE_MARKERS) and not state["error"]:
+            state["error"] = line.strip()
+        if "slurmstepd: error" in line:
+            # Slurm killed the job (time limit, cancellation): no end marker follows
+            _enter(state, "failed", at, exact)
+            continue
+        m = SEEDS_TOTAL_RE.search(line)
+        if m:
+            # fanned-out jobs print one such line per GPU task
+            state["seeds_total"] = (state["seeds_total"] or 0) + int(m.group(1))
+        if SEED_DONE_RE.search(line):
+            state["seeds_done"] += 1
+            continue
+        for needle, stage in LINE_STAGES:
+            if needle in line:
+                _enter(state, stage, at, exact)
+                break
+    return state
+
+
+# ---------------------------------------------------------------------------
+# incremental per-job tracking
+# ---------------------------------------------------------------------------
+
+_cache: dict[str, dict] = {}
+_cache_lock = threading.Lock()
+_job_locks: dict[str, threading.Lock] = {}
+
+# Seconds between background passes over unfinished jobs (0 disables).
+TRACK_INTERVAL = float(os.environ.get("AF3_TRACK_INTERVAL", 60))
+
+
+def job_progress(job_dir: Path) -> dict:
+    """
+    Current progress of the job in `job_dir`. Only log bytes appended since
+    the previous call are parsed; finished jobs are answered from meta.json.
+    New stages are recorded in the event log as they are parsed.
+    """
+    meta = read_job_meta(job_dir)
+    if meta.get("progress", {}).get("stage") in TERMINAL_STAGES:
+        return meta["progress"]
+
+    log_path = find_slurm_log(job_dir)
+    archive_done = (job_dir / f"{job_dir.name}.zip").exists()
+    if log_path is None:
+        state = new_state()
+        if meta.get("status") == "submit_failed":
+            state.update(stage="failed", error=meta.get("error"))
+        elif meta.get("status") == "queued":
+            state["stage"] = "queued"
+        elif archive_done:
+            state["stage"] = "completed"
+        return state
+
+    key = str(log_path)
+    with _cache_lock:
+        lock = _job_locks.setdefault(key, threading.Lock())
+    # one parser per log at a time in this process
+    with lock:
+        final = read_job_meta(job_dir).get("progress", {})
+        if final.get("stage") in TERMINAL_STAGES:
+            return final  # finished while this call waited for the lock
+        with _cache_lock:
+            cached = _cache.get(key) or new_state()
+            state = {**cached, "stages": list(cached.get("stages", []))}
+        seen = len(state["stages"])
+
+        while True:
+            text, offset = read_log_chunk(log_path, state["offset"])
+            if not text:
+                break
+            if offset < state["offset"]:  # log was rewritten, start over
+                state, seen = new_state(), 0
+            parse_lines(state, text)
+            state["offset"] = offset
+
+        if archive_done and state["stage"] not in TERMINAL_STAGES and not state["error"]:
+            # logs written by older templates have no end marker
+            state["stage"] = "completed"
+            state["finished_at"] = state["finished_at"] or (job_dir / f"{job_dir.name}.zip").stat().st_mtime
+
+        if len(state["stages"]) > seen:
+            # deduplicated across processes and restarts via meta.json
+            record_stages(job_dir, state["stages"], uid=meta.get("uid"))
+        if state["stage"] in TERMINAL_STAGES:
+            write_job_meta(job_dir, progress=state)
+            # from now on the job is answered from meta.json
+            with _cache_lock:
+                _cache.pop(key, None)
+                _job_locks.pop(key, None)
+        else:
+            with _cache_lock:
+                _cache[key] = state
+    return state
+
+
+def track_jobs(base: Path) -> None:
+    """
+    Advance the progress of every submitted job not yet recorded as
+    finished, and record the `finish` of those that are over.
+    """
+    for d in base.iterdir() if base.exists() else []:
+        if not d.is_dir() or d.name.startswith("."):
+            continue
+        meta = read_job_meta(d)
+        if meta.get("status") == "submitted" and not meta.get("finish_recorded"):
+            state = job_progress(d)
+            if state["stage"] in TERMINAL_STAGES:
+                record_finish(d, state)
+
+
+def start_tracker(base: Path, interval: float = TRACK_INTERVAL) -> threading.Thread | None:
+    """Run `track_jobs` on `base` every `interval` seconds in a daemon thread."""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                track_jobs(base.resolve())
+            except Exception:  # keep the tracker alive across transient errors
+                log.exception("tracking job progress failed")
+
+    thread = threading.Thread(target=loop, name="af3-progress", daemon=True)
+    thread.start()
+    return thread
+
+
+# ---------------------------------------------------------------------------
+# token counting & ETA model
+# ---------------------------------------------------------------------------
+
+SMILES_ATOM_RE = re.compile(r"Cl|Br|\[[^\]]+\]|[BCNOPSFI]|[bcnops]")
+CCD_TOKENS_GUESS = 20
+
+
+def count_tokens(fold_input: dict) -> int:
+    """
+    Approximate AF3 token count: one per residue/nucleotide and one per
+    ligand heavy atom (estimated from SMILES, or a fixed guess per CCD code).
+    """
+    tokens = 0
+    for entry in fold_input.get("sequences", []):
+        kind, body = next(iter(entry.items()))
+        ids = body.get("id")
+        copies = len(ids) if isinstance(ids, list) else 1
+        if kind in ("protein", "rna", "dna"):
+            per_copy = len(body.get("sequence") or "")
+        elif body.get("smiles"):
+            per_copy = len(SMILES_ATOM_RE.findall(body["smiles"]))
+        else:
+            per_copy = CCD_TOKENS_GUESS * max(1, len(body.get("ccdCodes") or []))
+            if len(body.get("ccdCodes") or []) == 1 and len(body["ccdCodes"][0]) <= 2:
+                per_copy = 1  # ions
+        tokens += per_copy * copies
+    return tokens
+
+
+def job_size(job_dir: Path) -> tuple[int, int] | None:
+    """
+    (tokens, seeds per GPU) of a job, from meta.json or, for older jobs,
+    input.json. Seeds fanned out over several GPUs run in parallel, so only
+    the largest per-GPU share counts towards wall time.
+    """
+    meta = read_job_meta(job_dir)
+    if "tokens" in meta and "num_seeds" in meta:
+        return meta["tokens"], math.ceil(meta["num_seeds"] / meta.get("num_gpus", 1))
+    try:
+        fold_input = json.loads((job_dir / "input.json").read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+    return count_tokens(fold_input), len(fold_input.get("modelSeeds") or [1])
+
+
+def _solve(a: list[list[float]], b: list[float]) -> list[float] | None:
+    """Solve a small dense linear system by Gaussian elimination."""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(n):
+            if r != col:
+                f = m[r][col] / m[col][col]
+                m[r] = [x - f * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] for i in range(n)]
+
+
+class EtaModel:
+    """
+    Least-squares fit of wall time (seconds) on
+    `1, tokens, tokens * seeds`: a fixed overhead, a data-pipeline term
+    growing with input size and an inference term per seed.
+    """
+
+    def __init__(self, coef: list[float] | None = None, n_samples: int = 0):
+        self.coef = coef
+        self.n_samples = n_samples
+
+    @staticmethod
+    def features(tokens: int, seeds: int) -> list[float]:
+        return [1.0, float(tokens), float(tokens * seeds)]
+
+    @classmethod
+    def fit(cls, samples: list[tuple[int, int, float]]) -> "EtaModel":
+        """Fit on (tokens, seeds, seconds) samples; degrades to a mean with few samples."""
+        if not samples:
+            return cls()
+        if len(samples) < 3:
+            mean = sum(s[2] for s in samples) / len(samples)
+            return cls([mean, 0.0, 0.0], len(samples))
+        xtx = [[0.0] * 3 for _ in range(3)]
+        xty = [0.0] * 3
+        for tokens, seeds, seconds in samples:
+            x = cls.features(tokens, seeds)
+            for i in range(3):
+                xty[i] += x[i] * seconds
+                for j in range(3):
+                    xtx[i][j] += x[i] * x[j]
+        coef = _solve(xtx, xty)
+        if coef is None:
+            mean = sum(s[2] for s in samples) / len(samples)
+            coef = [mean, 0.0, 0.0]
+        return cls(coef, len(samples))
+
+    def predict(self, tokens: int, seeds: int) -> float | None:
+        if self.coef is None:
+            return None
+        value = sum(c * x for c, x in zip(self.coef, self.features(tokens, seeds)))
+        return max(value, 60.0)
+
+
+_model_cache = {"key": None, "model": EtaModel()}
+
+
+def fitted_model(base: Path) -> EtaModel:
+    """
+    ETA model over all completed jobs under `base`. Refitted only when the
+    set of completed jobs changes; completed jobs are read from meta.json.
+    """
+    samples = []
+    for d in base.iterdir() if base.exists() else []:
+        if not d.is_dir() or d.name.startswith("."):
+            continue
+        prog = read_job_meta(d).get("progress") or {}
+        if prog.get("stage") != "completed" or not (prog.get("started_at") and prog.get("finished_at")):
+            continue
+        size = job_size(d)
+        if size:
+            samples.append((d.name, *size, prog["finished_at"] - prog["started_at"]))
+    key = (str(base), tuple(sorted(s[0] for s in samples)))
+    if key != _model_cache["key"]:
+        _model_cache["model"] = EtaModel.fit([s[1:] for s in samples])
+        _model_cache["key"] = key
+    return _model_cache["model"]
+
+
+def format_seconds(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{max(minutes, 1)} min"
+    return f"{minutes // 60} h {minutes % 60:02d} min"
+
+
+def describe(state: dict, eta_seconds: float | None) -> str:
+    """Short human-readable progress text for the history table."""
+    text = STAGES.get(state["stage"], state["stage"])
+    if state["stage"] == "failed" and state.get("error"):
+        return f"{text}: {state['error'][:80]}"
+    if state["stage"] == "inference" and state.get("seeds_total"):
+        text += f" ({state['seeds_done']}/{state['seeds_total']} seeds)"
+    if eta_seconds is not None and state["stage"] not in TERMINAL_STAGES:
+        text += f", ~{format_seconds(eta_seconds)} left"
+    return text
+
+
+def annotate_entries(base: Path, entries: list[dict]) -> list[dict]:
+    """Add `progress` text (stage and ETA) to history entries from list_job_entries."""
+    # update every job first, so jobs that just finished join the fit
+    states = [job_progress(base / e["dir"]) for e in entries]
+    model = fitted_model(base)
+    now = time.time()
+    for e, state in zip(entries, states):
+        job_dir = base / e["dir"]
+        eta = None
+        size = job_size(job_dir) if state["stage"] not in TERMINAL_STAGES else None
+        if size:
+            total = model.predict(*size)
+            if total is not None:
+                elapsed = now - state["started_at"] if state["started_at"] else 0.0
+                eta = max(total - elapsed, 0.0)
+        e["progress"] = describe(state, eta)
+        if state["stage"] == "failed":
+            e["status"] = "failed"
+    return entries
@@ -1,6 +1,32 @@
+import hashlib
+import json
 import random
 import string
 
+MAX_SEEDS = 100
+
+try:  # optional fast backend for very large inputs
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is absent
+    orjson = None
+
+
+def dumps(data) -> bytes:
+    """
+    Canonical serialisation of an AF3 input: compact UTF-8 JSON with keys in
+    insertion order. orjson and the standard library produce identical bytes
+    for the str/int/list/dict values used here; orjson is used when installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def content_hash(payload: bytes) -> str:
+    """SHA-256 hex digest identifying a serialised submission."""
+    return hashlib.sha256(payload).hexdigest()
+
+
 class Entity:
     def __init__(self, entity_type, copies=1):
         self.type = entity_type
@@ -10,53 +36,92 @@ class Entity:
         self.ccd_codes = []
         self.ion_name = None
         self.bonded_atom_pairs = []
+        # precomputed data (protein/RNA): uploaded file references, and the
+        # input-relative paths they resolve to (see precomputed.py)
+        self.precomputed = None
+        self.unpaired_msa_path = None
+        self.paired_msa_path = None
+        self.templates = []
 
 class AF3Submission:
     def __init__(self, name='', email=None):
         self.name = name
         self.email = email
         self.entities = []
-        self._id_counter = 0
+        self.num_seeds = 1
+        self.model_seeds = None
 
-    def _next_label(self):
-        """Generate labels: A, B, ..., Z, AA, AB, ..."""
-        n = self._id_counter
+    @staticmethod
+    def _label(n):
+        """Label for the n-th chain: A, B, ..., Z, AA, AB, ..."""
         label = ''
         while True:
             label = string.ascii_uppercase[n % 26] + label
             n = n // 26 - 1
             if n < 0:
                 break
-        self._id_counter += 1
         return label
 
+    def seeds(self):
+        """
+        `num_seeds` distinct model seeds, drawn once per submission so
+        serialisation is stable.
+        """
+        if self.model_seeds is None or len(self.model_seeds) != self.num_seeds:
+            self.model_seeds = sorted(random.sample(range(1, 100_000), self.num_seeds))
+        return self.model_seeds
+
     def add_entity(self, entity_type, copies=1):
         ent = Entity(entity_type, copies)
         self.entities.append(ent)
         return ent
 
-    def validate(self):
+    def validate(self, ccd=None, max_seeds=MAX_SEEDS):
+        """
+        Return an error message for the first problem found, or None.
+        With a CCD index (see ccd_index.py), ligand CCD codes and ion names
+        are also checked against the Chemical Component Dictionary.
+        `max_seeds` lowers the seed limit (e.g. to what the GPUs of one job
+        can run).
+        """
         if not self.name:
             return 'Job name is required.'
         if not self.entities:
             return 'At least one entity is required.'
+        if not 1 <= self.num_seeds <= max_seeds:
+            return f'Number of seeds must be between 1 and {max_seeds}.'
         for ent in self.entities:
             if ent.type in ['protein', 'rna', 'dna']:
                 if not ent.sequence:
                     return f'Sequence required for {ent.type}.'
+                if (ent.paired_msa_path or ent.templates) and not ent.unpaired_msa_path:
+                    return 'Paired MSAs and templates need an unpaired MSA as well.'
             if ent.type == 'ligand':
                 if not (ent.smiles or ent.ccd_codes):
                     return 'Ligand must have SMILES or CCD codes.'
+                if ccd is not None:
+                    for code in ent.ccd_codes:
+                        if code not in ccd:
+                            return f'Unknown CCD code: {code}.'
             if ent.type == 'ion':
                 if not ent.ion_name:
                     return 'Ion name is required for ion entities.'
+                if ccd is not None and ent.ion_name not in ccd:
+                    return f'Unknown ion CCD code: {ent.ion_name}.'
         return None
 
     def to_json(self):
         sequences = []
+        n_chains = 0
+        # the job runs without the data pipeline when every protein and RNA
+        # chain has an MSA (see precomputed.needs_data_pipeline)
+        skip_pipeline = all(
+            ent.unpaired_msa_path for ent in self.entities if ent.type in ('protein', 'rna')
+        )
         for ent in self.entities:
             # generate unique labels per copy
-            labels = [self._next_label() for _ in range(ent.copies)]
+            labels = [self._label(n_chains + k) for k in range(ent.copies)]
+            n_chains += ent.copies
             entity_id = labels[0] if ent.copies == 1 else labels
 
             if ent.type in ['protein', 'rna', 'dna']:
@@ -66,6 +131,17 @@ class AF3Submission:
                         'sequence': ent.sequence
                     }
                 }
+                if ent.unpaired_msa_path:
+                    entry[ent.type]['unpairedMsaPath'] = ent.unpaired_msa_path
+                    if ent.type == 'protein':
+                        # unset fields are searched by the data pipeline; without
+                        # it AF3 needs them spelled out (empty = none)
+                        if ent.paired_msa_path:
+                            entry[ent.type]['pairedMsaPath'] = ent.paired_msa_path
+                        elif skip_pipeline:
+                            entry[ent.type]['pairedMsa'] = ''
+                        if ent.templates or skip_pipeline:
+                            entry[ent.type]['templates'] = ent.templates
                 if ent.bonded_atom_pairs:
                     entry[ent.type]['bondedAtomPairs'] = ent.bonded_atom_pairs
                 sequences.append(entry)
@@ -88,10 +164,16 @@ class AF3Submission:
 
         return {
             'name': self.name,
-            'modelSeeds': [random.randint(1, 100)],
+            'modelSeeds': list(self.seeds()),
             'sequences': sequences,
             'dialect': 'alphafold3',
             'version': 2
         }
-    
-    
\ No newline at end of file
+
+    def serialize(self):
+        """
+        Return the canonical bytes of `to_json()` and their content hash.
+        Preview, download and the job's `input.json` all reuse these bytes.
+        """
+        payload = dumps(self.to_json())
+        return payload, content_hash(payload)
@@ -1,21 +1,57 @@
 #!/bin/bash
-#SBATCH --job-name={{JOBNAME}}_{{TIMESTAMP}}
+#SBATCH --job-name="{{JOBNAME}}_{{TIMESTAMP}}"
 #SBATCH --partition=l40-gpu
 #SBATCH --nodes=1
 #SBATCH --ntasks-per-node=32
 #SBATCH --mem=256GB
-#SBATCH --gres=gpu:1
+#SBATCH --gres=gpu:{{NUM_GPUS}}
 #SBATCH --time=1-00:00:00
 #SBATCH --qos=gpu_access
 #SBATCH --mail-type=ALL
 #SBATCH --mail-user={{EMAIL}}
 #SBATCH --output={{WORKDIR}}/logs/%x-%j.out
 
+# progress markers parsed by progress.py
+echo "AF3_DASHAPP stage=start time=$(date +%s)"
 hostname
 nvidia-smi
 
 export AF3_INPUT_DIR={{WORKDIR}}
 export AF3_OUTPUT_DIR={{WORKDIR}}
+ZIP_NAME="{{JOBNAME}}_{{TIMESTAMP}}.zip"
+
+# Number of GPU inference tasks the seeds are fanned out over
+NUM_TASKS={{NUM_GPUS}}
+
+# false when the input brings precomputed MSAs/templates for every chain
+RUN_DATA_PIPELINE={{RUN_DATA_PIPELINE}}
+
+# Optional node-local staging: run AF3 and packaging on local scratch and
+# copy only the final archive back to the shared filesystem
+STAGE_LOCAL={{STAGE_LOCAL}}
+if [ "$STAGE_LOCAL" = "1" ]; then
+    SCRATCH_DIR="${AF3_SCRATCH_ROOT:-${TMPDIR:-/tmp}}/af3_${SLURM_JOB_ID:-$$}"
+    mkdir -p "$SCRATCH_DIR"
+    find {{WORKDIR}} -mindepth 1 -maxdepth 1 ! -name logs -exec cp -r {} "$SCRATCH_DIR"/ \;
+    export AF3_INPUT_DIR=$SCRATCH_DIR
+    export AF3_OUTPUT_DIR=$SCRATCH_DIR
+
+    # On failure or timeout, salvage whatever AF3 produced, then free scratch
+    cleanup_scratch() {
+        if [ ! -f "{{WORKDIR}}/${ZIP_NAME}" ] && [ -d "$SCRATCH_DIR" ]; then
+            echo "AF3_DASHAPP stage=salvage time=$(date +%s)"
+            PARTIAL="{{JOBNAME}}_{{TIMESTAMP}}_partial.zip"
+            (cd "$SCRATCH_DIR" && zip -qr "${SCRATCH_DIR}_${PARTIAL}" . -x "*.zip") \
+                && cp "${SCRATCH_DIR}_${PARTIAL}" "{{WORKDIR}}/.${PARTIAL}.part" \
+                && mv "{{WORKDIR}}/.${PARTIAL}.part" "{{WORKDIR}}/${PARTIAL}"
+            rm -f "${SCRATCH_DIR}_${PARTIAL}"
+        fi
+        rm -rf "$SCRATCH_DIR"
+    }
+    trap cleanup_scratch EXIT
+    trap 'exit 143' TERM INT
+    echo "Staging AF3 I/O in ${SCRATCH_DIR}"
+fi
 
 # Load Singularity and AF3 resources
 module load singularity
@@ -28,23 +64,80 @@ export AF3_DATABASES_DIR=/datacommons/alphafold/db_3.0.1
 # Ensure output directory exists
 mkdir -p $AF3_OUTPUT_DIR
 
-# Run AlphaFold3 via Singularity
-singularity exec \
-    --nv \
-    --bind $AF3_INPUT_DIR:/root/af_input \
-    --bind $AF3_OUTPUT_DIR:/root/af_output \
-    --bind $AF3_MODEL_PARAMETERS_DIR:/root/models \
-    --bind $AF3_DATABASES_DIR:/root/public_databases \
-    --bind $AF3_CODE_DIR:/root/code \
-    $AF3_IMAGE \
-    python /root/code/alphafold3/run_alphafold.py \
-    --json_path=/root/af_input/input.json \
-    --model_dir=/root/models \
-    --db_dir=/root/public_databases \
-    --output_dir=/root/af_output
+# Prefix each output line with the time it was written, so progress.py can
+# date AF3's stages however late it reads the log
+stamp_lines() {
+    while IFS= read -r line; do
+        printf '[%(%s)T] %s\n' -1 "$line"
+    done
+}
+export PYTHONUNBUFFERED=1
+
+# Run AlphaFold3 via Singularity: run_af3 <json_path> <output_dir> [extra flags]
+run_af3() {
+    singularity exec \
+        --nv \
+        --bind $AF3_INPUT_DIR:/root/af_input \
+        --bind $AF3_OUTPUT_DIR:/root/af_output \
+        --bind $AF3_MODEL_PARAMETERS_DIR:/root/models \
+        --bind $AF3_DATABASES_DIR:/root/public_databases \
+        --bind $AF3_CODE_DIR:/root/code \
+        $AF3_IMAGE \
+        python /root/code/alphafold3/run_alphafold.py \
+        --json_path="$1" \
+        --model_dir=/root/models \
+        --db_dir=/root/public_databases \
+        --output_dir="$2" \
+        "${@:3}" 2>&1 | stamp_lines
+    return "${PIPESTATUS[0]}"
+}
+
+if [ "$NUM_TASKS" -gt 1 ]; then
+    # Data pipeline once, then one inference task per GPU over a share of
+    # the seeds, all reusing the same MSAs and templates
+    run_af3 /root/af_input/input.json /root/af_output/fanout/data \
+        --run_data_pipeline=$RUN_DATA_PIPELINE --run_inference=false
+    AF3_STATUS=$?
+    if [ "$AF3_STATUS" -eq 0 ]; then
+        python3 {{APP_DIR}}/fanout.py split "$AF3_OUTPUT_DIR" $NUM_TASKS \
+            || { AF3_STATUS=1; echo "Splitting the seeds over GPU tasks failed"; }
+    fi
+    if [ "$AF3_STATUS" -eq 0 ]; then
+        PIDS=()
+        for i in $(seq 0 $((NUM_TASKS - 1))); do
+            CUDA_VISIBLE_DEVICES=$i run_af3 \
+                /root/af_output/fanout/task-$i/input.json \
+                /root/af_output/fanout/task-$i \
+                --run_data_pipeline=false &
+            PIDS+=($!)
+        done
+        for pid in "${PIDS[@]}"; do
+            wait $pid || AF3_STATUS=$?
+        done
+    fi
+    if [ "$AF3_STATUS" -eq 0 ]; then
+        # Merge per-task outputs into one results tree with a unified ranking
+        python3 {{APP_DIR}}/fanout.py merge "$AF3_OUTPUT_DIR" "{{JOBNAME}}"
+        AF3_STATUS=$?
+    fi
+else
+    run_af3 /root/af_input/input.json /root/af_output --run_data_pipeline=$RUN_DATA_PIPELINE
+    AF3_STATUS=$?
+fi
+echo "AF3_DASHAPP stage=inference_done time=$(date +%s) status=${AF3_STATUS}"
 
 # Package and clean up results
-cd {{WORKDIR}}
-ZIP_NAME="{{JOBNAME}}_{{TIMESTAMP}}.zip"
-zip -r "${ZIP_NAME}" {{JOBNAME}}/
-rm -rf {{JOBNAME}}/
+echo "AF3_DASHAPP stage=packaging time=$(date +%s)"
+cd "$AF3_OUTPUT_DIR"
+if [ "$STAGE_LOCAL" = "1" ]; then
+    # one bulk copy back; the rename makes the archive appear complete.
+    # Failed runs are left to cleanup_scratch, which salvages a partial archive
+    [ "$AF3_STATUS" -eq 0 ] \
+        && zip -r "${ZIP_NAME}" "{{JOBNAME}}/" \
+        && cp "${ZIP_NAME}" "{{WORKDIR}}/.${ZIP_NAME}.part" \
+        && mv "{{WORKDIR}}/.${ZIP_NAME}.part" "{{WORKDIR}}/${ZIP_NAME}"
+else
+    zip -r "${ZIP_NAME}" "{{JOBNAME}}/"
+    rm -rf "{{JOBNAME}}/"
+fi
+echo "AF3_DASHAPP stage=end time=$(date +%s)"
@@ -0,0 +1,232 @@
+import fcntl
+import json
+import subprocess
+import time
+from pathlib import Path
+from subprocess import CalledProcessError, TimeoutExpired
+
+import pytest
+
+import admission
+import fake_slurm
+import helpers
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def make_job(base, name, uid, status="created", **meta):
+    job_dir = base / f"{name}_20250101T000000-{len(list(base.glob('*'))):08x}"
+    job_dir.mkdir(parents=True)
+    (job_dir / "meta.json").write_text(json.dumps(
+        {"name": name, "uid": uid, "email": f"{uid}@x.com", "status": status, **meta}
+    ))
+    return job_dir
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    """Stand-in sbatch/squeue: submitted IDs stay active until removed."""
+    state = {"active": set(), "names": {}, "next": 100, "reject": None}
+
+    def submit(job_dir, email, num_gpus=None, stage_local=False):
+        if state["reject"]:
+            raise CalledProcessError(1, "sbatch", stderr=state["reject"])
+        state["next"] += 1
+        state["active"].add(str(state["next"]))
+        state["names"][job_dir.name] = str(state["next"])
+        return str(state["next"])
+
+    def by_name(name):
+        job_id = state["names"].get(name)
+        return [job_id] if job_id in state["active"] else []
+
+    monkeypatch.setattr(admission, "write_and_submit_script", submit)
+    monkeypatch.setattr(admission, "active_slurm_ids", lambda: set(state["active"]))
+    monkeypatch.setattr(admission, "slurm_ids_by_name", by_name)
+    monkeypatch.setattr(admission, "MAX_JOBS_PER_USER", 2)
+    monkeypatch.setattr(admission, "MAX_JOBS_TOTAL", 0)
+    return state
+
+
+def status(job_dir):
+    return helpers.read_job_meta(job_dir)["status"]
+
+
+def test_admit_queues_over_user_limit(tmp_path, scheduler):
+    jobs = [make_job(tmp_path, f"a{i}", "alice") for i in range(3)]
+    results = [admission.admit(tmp_path, d) for d in jobs]
+    assert [r["status"] for r in results] == ["submitted", "submitted", "queued"]
+    assert results[2]["position"] == 1 and results[2]["in_flight"] == 2
+
+    # another user is not held back by alice's queue
+    bob = make_job(tmp_path, "b0", "bob")
+    assert admission.admit(tmp_path, bob)["status"] == "submitted"
+
+    # nothing frees up, nothing is released
+    assert admission.release(tmp_path) == []
+    scheduler["active"].discard(helpers.read_job_meta(jobs[0])["slurm_job_id"])
+    assert admission.release(tmp_path) == [jobs[2].name]
+    assert status(jobs[2]) == "submitted"
+
+
+def test_release_round_robins_between_users(tmp_path, scheduler, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_JOBS_TOTAL", 2)
+    queued = []
+    for i in range(3):
+        queued.append(make_job(tmp_path, f"a{i}", "alice", status="queued", queued_at=i))
+    queued.append(make_job(tmp_path, "b0", "bob", status="queued", queued_at=10))
+
+    released = admission.release(tmp_path)
+    assert released == [queued[0].name, queued[3].name]
+    assert status(queued[1]) == "queued"
+
+
+def test_qos_rejection_keeps_job_queued(tmp_path, scheduler):
+    scheduler["reject"] = "sbatch: error: QOSMaxSubmitJobPerUserLimit"
+    job = make_job(tmp_path, "a0", "alice")
+    result = admission.admit(tmp_path, job)
+    assert result["status"] == "queued" and "QOSMax" in result["error"]
+    assert admission.release(tmp_path) == []
+    assert status(job) == "queued"
+
+    scheduler["reject"] = "sbatch: error: invalid partition"
+    assert admission.release(tmp_path) == []
+    assert status(job) == "submit_failed"
+
+
+def test_sbatch_runs_outside_the_lock(tmp_path, scheduler, monkeypatch):
+    seen = []
+
+    def submit(job_dir, email, num_gpus=None, stage_local=False):
+        # another worker can take the lock while sbatch runs
+        with open(tmp_path / admission.LOCK_NAME, "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(fh, fcntl.LOCK_UN)
+        seen.append(status(job_dir))
+        return "200"
+
+    monkeypatch.setattr(admission, "write_and_submit_script", submit)
+    job = make_job(tmp_path, "a0", "alice")
+    assert admission.admit(tmp_path, job)["status"] == "submitted"
+    # the slot was reserved before the lock was released
+    assert seen == ["submitting"]
+
+
+def test_missing_sbatch_fails_the_job(tmp_path, scheduler, monkeypatch):
+    def submit(job_dir, email, num_gpus=None, stage_local=False):
+        raise FileNotFoundError(2, "No such file or directory", "sbatch")
+
+    monkeypatch.setattr(admission, "write_and_submit_script", submit)
+    job = make_job(tmp_path, "a0", "alice")
+    result = admission.admit(tmp_path, job)
+    assert result["status"] == "submit_failed" and "sbatch" in result["error"]
+    assert status(job) == "submit_failed"
+
+
+def test_stale_reservation_is_requeued(tmp_path, scheduler):
+    job = make_job(tmp_path, "a0", "alice", status="submitting", reserved_at=time.time())
+    assert admission.release(tmp_path) == []
+    helpers.write_job_meta(job, reserved_at=time.time() - admission.RESERVATION_TIMEOUT - 1)
+    assert admission.release(tmp_path) == [job.name]
+    assert status(job) == "submitted"
+
+
+def test_sbatch_timeout_never_submits_twice(tmp_path, scheduler, monkeypatch):
+    calls = []
+    original = admission.write_and_submit_script
+
+    def slow_submit(job_dir, email, num_gpus=None, stage_local=False):
+        calls.append(job_dir.name)
+        original(job_dir, email)  # Slurm queues the job, but sbatch never answers
+        raise TimeoutExpired("sbatch", helpers.SBATCH_TIMEOUT)
+
+    monkeypatch.setattr(admission, "write_and_submit_script", slow_submit)
+    monkeypatch.setattr(admission, "slurm_ids_by_name", lambda name: [])  # squeue lags behind
+    job = make_job(tmp_path, "a0", "alice")
+    result = admission.admit(tmp_path, job)
+    assert result["status"] == "submitting" and "did not answer" in result["error"]
+    assert status(job) == "submitting"
+
+    # once the reservation is stale, squeue lists the job: it is adopted, not resubmitted
+    helpers.write_job_meta(job, reserved_at=time.time() - admission.RESERVATION_TIMEOUT - 1)
+    monkeypatch.setattr(admission, "write_and_submit_script", lambda *a, **k: pytest.fail("resubmitted"))
+    monkeypatch.setattr(admission, "slurm_ids_by_name", lambda name: ["101"])
+    assert admission.release(tmp_path) == [job.name]
+    assert helpers.read_job_meta(job)["slurm_job_id"] == "101" and calls == [job.name]
+
+
+def test_stale_reservation_waits_for_squeue(tmp_path, scheduler, monkeypatch):
+    stale = time.time() - admission.RESERVATION_TIMEOUT - 1
+    job = make_job(tmp_path, "a0", "alice", status="submitting", reserved_at=stale)
+    monkeypatch.setattr(admission, "slurm_ids_by_name", lambda name: None)
+    assert admission.release(tmp_path) == []
+    assert status(job) == "submitting" and not scheduler["active"]
+
+
+def test_in_flight_without_squeue(tmp_path):
+    job = make_job(tmp_path, "a0", "alice", status="submitted", slurm_job_id="7")
+    meta = helpers.read_job_meta(job)
+    assert admission.in_flight(job, meta, None)
+    assert not admission.in_flight(job, meta, {"8"})
+    (job / f"{job.name}.zip").write_text("done")
+    assert not admission.in_flight(job, meta, None)
+
+
+def test_admission_with_fake_slurm(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setenv("FAKE_SLURM_HOME", str(tmp_path / "slurm"))
+    monkeypatch.setenv("FAKE_AF3_PIPELINE_DELAY", "0")
+    monkeypatch.setenv("FAKE_AF3_SEED_DELAY", "0")
+    monkeypatch.setattr(helpers, "SBATCH", str(REPO / "bin" / "sbatch"))
+    monkeypatch.setattr(admission, "SQUEUE", str(REPO / "bin" / "squeue"))
+    monkeypatch.setattr(admission, "MAX_JOBS_PER_USER", 1)
+    base = tmp_path / "jobs"
+
+    jobs = []
+    for i in range(2):
+        job = make_job(base, f"j{i}", "alice", num_gpus=1)
+        helpers.write_json_input(job, {
+            "name": f"j{i}", "modelSeeds": [1],
+            "sequences": [{"protein": {"id": "A", "sequence": "MATT"}}],
+            "dialect": "alphafold3", "version": 2,
+        })
+        jobs.append(job)
+    assert [admission.admit(base, d)["status"] for d in jobs] == ["submitted", "queued"]
+
+    deadline = time.time() + 30
+    while status(jobs[1]) == "queued" and time.time() < deadline:
+        admission.release(base)
+        time.sleep(0.1)
+    assert status(jobs[1]) == "submitted"
+    assert (jobs[0] / f"{jobs[0].name}.zip").exists()
+
+
+def test_sbatch_timeout_with_fake_slurm(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setenv("FAKE_SLURM_HOME", str(tmp_path / "slurm"))
+    monkeypatch.setenv("FAKE_SLURM_QUEUE_DELAY", "60")
+    monkeypatch.setattr(helpers, "SBATCH", str(REPO / "bin" / "sbatch"))
+    monkeypatch.setattr(helpers, "SBATCH_TIMEOUT", 0.5)
+    monkeypatch.setattr(admission, "SQUEUE", str(REPO / "bin" / "squeue"))
+    base = tmp_path / "jobs"
+    job = make_job(base, "j0", "alice", num_gpus=1)
+    helpers.write_json_input(job, {"name": "j0", "modelSeeds": [1], "sequences": [], "dialect": "alphafold3", "version": 2})
+
+    # sbatch is killed before Slurm saw the job
+    monkeypatch.setenv("FAKE_SLURM_SUBMIT_LATENCY", "2")
+    assert admission.admit(base, job)["status"] == "submitting"
+    assert admission.release(base) == []  # not stale yet
+
+    # once stale, the job is not in squeue, so it is submitted again
+    monkeypatch.setenv("FAKE_SLURM_SUBMIT_LATENCY", "0")
+    helpers.write_job_meta(job, reserved_at=time.time() - admission.RESERVATION_TIMEOUT - 1)
+    assert admission.release(base) == [job.name]
+    job_id = helpers.read_job_meta(job)["slurm_job_id"]
+    assert admission.slurm_ids_by_name(job.name) == [job_id]
+
+    # a stale reservation of a job squeue lists is adopted, not submitted twice
+    helpers.write_job_meta(job, status="submitting", reserved_at=time.time() - admission.RESERVATION_TIMEOUT - 1)
+    assert admission.release(base) == [job.name]
+    assert helpers.read_job_meta(job)["slurm_job_id"] == job_id
+    assert len(fake_slurm.all_jobs()) == 1
+    subprocess.run([str(REPO / "bin" / "scancel"), job_id], check=True)
@@ -0,0 +1,32 @@
+import threading
+
+import app
+
+
+def test_import_starts_no_threads():
+    assert not [t for t in threading.enumerate() if t.name.startswith("af3-")]
+    assert app._background_lock is None
+
+
+def test_background_tasks_start_once_per_jobs_dir(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(app, "start_releaser", lambda base: started.append(("releaser", base)))
+    monkeypatch.setattr(app, "start_build", lambda: started.append(("build", None)))
+    monkeypatch.setattr(app, "start_tracker", lambda base: started.append(("tracker", base)))
+    monkeypatch.setattr(app, "_background_lock", None)
+    base = tmp_path / "jobs"
+
+    assert app.start_background_tasks(base)
+    assert started == [("releaser", base), ("build", None), ("tracker", base)]
+    assert not app.start_background_tasks(base)  # already running here
+    held = app._background_lock
+
+    # another process (a separate open file) cannot take the lock
+    app._background_lock = None
+    assert not app.start_background_tasks(base)
+    assert len(started) == 3
+
+    held.close()  # the holder exits
+    assert app.start_background_tasks(base)
+    assert len(started) == 6
+    app._background_lock.close()
@@ -0,0 +1,267 @@
+import base64
+import json
+from pathlib import Path
+
+import pytest
+
+import admission
+import callbacks
+import helpers
+from app import app
+from submission import AF3Submission
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def multi(*outputs):
+    return ".." + "...".join(outputs) + ".."
+
+
+def pattern(type_, index=0):
+    """A pattern-matching component ID (or wildcard) as Dash's client serialises it."""
+    return json.dumps({"index": index, "type": type_}, separators=(",", ":"), sort_keys=True)
+
+
+def post(output, inputs, state=(), changed=(), index=None):
+    """
+    Call a callback through Dash's HTTP endpoint and return its response.
+    `index` fills in the MATCH wildcard of pattern-matching outputs.
+    """
+    ids = [o.rsplit(".", 1) for o in output.strip(".").split("...")]
+    ids = [(json.loads(i) if i.startswith("{") else i, p) for i, p in ids]
+    ids = [({**i, "index": index} if isinstance(i, dict) else i, p) for i, p in ids]
+    resp = app.server.test_client().post("/_dash-update-component", json={
+        "output": output,
+        "outputs": [{"id": i, "property": p} for i, p in ids] if len(ids) > 1 else
+                   {"id": ids[0][0], "property": ids[0][1]},
+        "inputs": list(inputs),
+        "state": list(state),
+        "changedPropIds": list(changed),
+    })
+    assert resp.status_code == 200, resp.data
+    return resp.get_json()["response"]
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    base = tmp_path / "jobs"
+    monkeypatch.setattr(callbacks, "JOBS_DIR", base)
+    monkeypatch.setattr(admission, "active_slurm_ids", lambda: set())
+    return base
+
+
+def stored_input(name="job1"):
+    sub = AF3Submission(name=name)
+    sub.add_entity("ion").ion_name = "MG"
+    return {"json": sub.serialize()[0].decode()}
+
+
+def submit(stored, key, name="job1"):
+    resp = post(
+        multi("job-status.children", "job-status.is_open"),
+        [{"id": "submit-job", "property": "n_clicks", "value": 1}],
+        [
+            {"id": "job-name", "property": "value", "value": name},
+            {"id": "email", "property": "value", "value": "me@x.com"},
+            {"id": "store-submission", "property": "data", "value": stored},
+            {"id": "store-submit-key", "property": "data", "value": key},
+            {"id": "uid-store", "property": "data", "value": "alice"},
+            {"id": "stage-local", "property": "value", "value": False},
+        ],
+        ["submit-job.n_clicks"],
+    )
+    return resp["job-status"]["children"]
+
+
+def test_failed_submission_can_be_retried(jobs, monkeypatch):
+    monkeypatch.setattr(helpers, "SBATCH", str(jobs / "no-such-sbatch"))
+    stored, key = stored_input(), "a" * 32
+
+    assert submit(stored, key).startswith("Submission failed: Could not run sbatch")
+    # the failed attempt did not claim the input
+    assert submit(stored, key).startswith("Submission failed")
+
+    monkeypatch.setattr(admission, "write_and_submit_script", lambda *a, **k: "77")
+    assert submit(stored, key).startswith("Job submitted (ID 77")
+    assert submit(stored, key).startswith("This input was already submitted (ID 77")
+
+
+def test_submit_rejects_tampered_store(jobs):
+    for stored in ({"json": '{"name": "job1", "sequ'}, {"json": "[]"}, {"text": "{}"}, {"json": 3}):
+        assert submit(stored, "c" * 32) == "Error: The generated input is invalid. Generate JSON again."
+
+
+def test_submit_rejects_unsafe_job_names(jobs):
+    assert submit(stored_input(), "b" * 32, name="a;b c").startswith("Error: Job name may only contain")
+    assert not jobs.exists() or not [d for d in jobs.iterdir() if not d.name.startswith(".")]
+
+
+def tail(trigger, viewer=None, history=()):
+    inputs = [
+        [{"id": {"type": "view-log", "index": 0}, "property": "n_clicks", "value": 1 if trigger == "view" else None}],
+        {"id": "log-interval", "property": "n_intervals", "value": 1},
+        {"id": "log-close", "property": "n_clicks", "value": 1 if trigger == "close" else None},
+    ]
+    changed = {
+        "view": '{"index":0,"type":"view-log"}.n_clicks',
+        "poll": "log-interval.n_intervals",
+        "close": "log-close.n_clicks",
+    }[trigger]
+    resp = post(
+        multi("log-content.children", "store-log-viewer.data", "log-collapse.is_open",
+              "log-interval.disabled", "log-title.children"),
+        inputs,
+        [
+            {"id": "store-log-viewer", "property": "data", "value": viewer},
+            {"id": "store-history", "property": "data", "value": list(history)},
+        ],
+        [changed],
+    )
+    return {k: v[next(iter(v))] for k, v in resp.items()}
+
+
+def operations(content):
+    return [(op["operation"], op["params"]) for op in content["operations"]
+            if op["operation"] != "Delete" or op["location"] == [0]]
+
+
+def test_tail_log_resumes_from_offset(jobs):
+    job = jobs / "j1_run"
+    (job / "logs").mkdir(parents=True)
+    helpers.write_job_meta(job, status="submitted", slurm_job_id="5")
+    log = job / "logs" / "j1_run-5.out"
+    log.write_text("first\n")
+
+    out = tail("view", history=[{"dir": job.name}])
+    assert out["log-content"] == ["first\n"] and out["log-collapse"] and not out["log-interval"]
+    viewer = out["store-log-viewer"]
+    assert viewer["offset"] == 6
+
+    with open(log, "a") as fh:
+        fh.write("second\n")
+    out = tail("poll", viewer)
+    assert operations(out["log-content"]) == [("Append", {"value": "second\n"})]
+    viewer = out["store-log-viewer"]
+    assert viewer["offset"] == 13 and viewer["sizes"] == [6, 7]
+
+    # a truncated log is shown again from its start
+    log.write_text("new\n")
+    out = tail("poll", viewer)
+    assert operations(out["log-content"]) == [("Clear", {}), ("Append", {"value": "new\n"})]
+    assert out["store-log-viewer"]["offset"] == 4 and out["store-log-viewer"]["sizes"] == [4]
+
+
+def test_tail_log_keeps_the_page_bounded(jobs, monkeypatch):
+    monkeypatch.setattr(callbacks, "LOG_VIEW_MAX_CHARS", 12)
+    monkeypatch.setattr(callbacks, "LOG_VIEW_MAX_CHUNKS", 3)
+    job = jobs / "j1_run"
+    (job / "logs").mkdir(parents=True)
+    log = job / "logs" / "j1_run-5.out"
+    log.write_text("")
+    viewer = {"dir": job.name, "log": log.name, "offset": 0, "sizes": []}
+
+    for line, dropped in (("aaaa\n", 0), ("bbbb\n", 0), ("cccc\n", 1), ("d\n", 0), ("e\n", 1)):
+        with open(log, "a") as fh:
+            fh.write(line)
+        out = tail("poll", viewer)
+        ops = operations(out["log-content"])
+        assert ops[0] == ("Append", {"value": line})
+        assert ops[1:] == [("Delete", {})] * dropped
+        viewer = out["store-log-viewer"]
+        assert sum(viewer["sizes"]) <= 12 and len(viewer["sizes"]) <= 3
+    assert viewer["sizes"] == [5, 2, 2]
+
+
+def test_tail_log_stops_polling_and_closes(jobs):
+    job = jobs / "j1_run"
+    (job / "logs").mkdir(parents=True)
+    helpers.write_job_meta(job, status="submitted", slurm_job_id="5")
+    log = job / "logs" / "j1_run-5.out"
+    log.write_text("AF3_DASHAPP stage=start time=1\n")
+    viewer = tail("view", history=[{"dir": job.name}])["store-log-viewer"]
+    assert tail("poll", viewer)["log-interval"] is False
+
+    # a failed job leaves no archive, polling stops once it is over
+    helpers.write_job_meta(job, status="submit_failed")
+    with open(log, "a") as fh:
+        fh.write("AF3_DASHAPP stage=end time=2 status=1\n")
+    out = tail("poll", viewer)
+    viewer = out["store-log-viewer"]
+    assert out["log-interval"] is False
+    assert tail("poll", viewer)["log-interval"] is True
+
+    out = tail("close", viewer)
+    assert out == {"log-content": [], "store-log-viewer": None, "log-collapse": False,
+                   "log-interval": True}
+
+
+def test_submit_with_uploaded_msa(jobs, monkeypatch):
+    monkeypatch.chdir(REPO)
+    a3m = ">query\nMATTKL\n>hit\nMATSKL\n"
+    contents = "data:application/octet-stream;base64," + base64.b64encode(a3m.encode()).decode()
+
+    # uploading stores a reference only, the file itself lands under .uploads
+    resp = post(
+        multi(*(f"{pattern(t, ['MATCH'])}.{p}" for t, p in [
+            ("msa-store", "data"), ("msa-summary", "children"), ("unpaired-upload", "contents"),
+            ("paired-upload", "contents"), ("template-upload", "contents"),
+        ])),
+        [
+            {"id": {"index": 0, "type": "unpaired-upload"}, "property": "contents", "value": contents},
+            {"id": {"index": 0, "type": "paired-upload"}, "property": "contents", "value": None},
+            {"id": {"index": 0, "type": "template-upload"}, "property": "contents", "value": None},
+        ],
+        [
+            {"id": {"index": 0, "type": "unpaired-upload"}, "property": "filename", "value": "chain A.a3m"},
+            {"id": {"index": 0, "type": "paired-upload"}, "property": "filename", "value": None},
+            {"id": {"index": 0, "type": "template-upload"}, "property": "filename", "value": None},
+            {"id": {"index": 0, "type": "msa-store"}, "property": "data", "value": None},
+        ],
+        [f"{pattern('unpaired-upload')}.contents"],
+        index=0,
+    )
+    refs = resp[pattern("msa-store")]["data"]
+    assert resp[pattern("unpaired-upload")]["contents"] is None
+    token, filename = refs["unpaired"].split("/")
+
+    def all_(type_, prop, value):
+        return [{"id": {"index": 0, "type": type_}, "property": prop, "value": value}]
+
+    resp = post(
+        multi("json-preview-content.children", "json-collapse.is_open",
+              "store-submission.data", "store-submit-key.data"),
+        [{"id": "generate-json-button", "property": "n_clicks", "value": 1}],
+        [
+            {"id": "job-name", "property": "value", "value": "withmsa"},
+            all_("entity-card", "id", {"index": 0, "type": "entity-card"}),
+            all_("entity-type", "value", "protein"),
+            all_("entity-copies", "value", 1),
+            all_("sequence", "value", "MATTKL"),
+            [], [], [],
+            all_("bonded-ids", "value", ""),
+            {"id": "num-seeds", "property": "value", "value": 1},
+            all_("msa-store", "data", refs),
+            {"id": "store-data-json", "property": "data", "value": None},
+        ],
+        ["generate-json-button.n_clicks"],
+    )
+    stored, key = resp["store-submission"]["data"], resp["store-submit-key"]["data"]
+    assert stored, resp["json-preview-content"]["children"]
+
+    submitted = []
+
+    def fake_run(cmd, **kwargs):
+        submitted.append(Path(cmd[1]))
+        return type("Result", (), {"stdout": "Submitted batch job 555\n", "stderr": ""})()
+
+    monkeypatch.setattr(helpers, "run", fake_run)
+    assert submit(stored, key, name="withmsa").startswith("Job submitted (ID 555")
+
+    job_dir = submitted[0].parent
+    linked = job_dir / "msas" / token / filename
+    assert linked.read_text() == a3m
+    assert linked.stat().st_ino == (jobs / ".uploads" / token / filename).stat().st_ino
+    fold_input = json.loads((job_dir / "input.json").read_text())
+    assert fold_input["sequences"][0]["protein"]["unpairedMsaPath"] == f"msas/{token}/{filename}"
+    script = (job_dir / "submit.sh").read_text()
+    assert "RUN_DATA_PIPELINE=false" in script and "--run_data_pipeline=$RUN_DATA_PIPELINE" in script
@@ -0,0 +1,157 @@
+import gzip
+import time
+
+import pytest
+
+import callbacks
+import ccd_index
+import helpers
+from submission import AF3Submission
+
+COMPONENTS = """\
+data_ATP
+#
+_chem_comp.id                                    ATP
+_chem_comp.name                                  "ADENOSINE-5'-TRIPHOSPHATE"
+_chem_comp.type                                  NON-POLYMER
+_chem_comp.pdbx_type                             HETAIN
+_chem_comp.formula                               "C10 H16 N5 O13 P3"
+_chem_comp.pdbx_formal_charge                    0
+#
+loop_
+_chem_comp_atom.comp_id
+_chem_comp_atom.atom_id
+ATP PG
+ATP O1G
+#
+data_ATG
+#
+_chem_comp.id                                    ATG
+_chem_comp.name
+;2-[(2-AMINO-4-OXO-3,4-DIHYDRO-PTERIDIN-6-YLMETHYL)-AMINO]-BENZOIC
+ACID
+;
+_chem_comp.type                                  NON-POLYMER
+_chem_comp.formula                               "C14 H12 N6 O3"
+_chem_comp.pdbx_formal_charge                    0
+#
+data_MG
+#
+_chem_comp.id                                    MG
+_chem_comp.name                                  "MAGNESIUM ION"
+_chem_comp.type                                  NON-POLYMER
+_chem_comp.formula                               Mg
+_chem_comp.pdbx_formal_charge                    2
+#
+data_ZN
+#
+_chem_comp.id                                    ZN
+_chem_comp.name                                  "ZINC ION"
+_chem_comp.type                                  NON-POLYMER
+_chem_comp.formula                               Zn
+_chem_comp.pdbx_formal_charge                    2
+#
+data_HOH
+#
+_chem_comp.id                                    HOH
+_chem_comp.name                                  WATER
+_chem_comp.type                                  NON-POLYMER
+_chem_comp.formula                               "H2 O"
+_chem_comp.pdbx_formal_charge                    0
+"""
+
+
+@pytest.fixture
+def index(tmp_path):
+    source = tmp_path / "components.cif.gz"
+    with gzip.open(source, "wt") as fh:
+        fh.write(COMPONENTS)
+    assert ccd_index.build_index(source, tmp_path / "ccd.sqlite") == 5
+    return ccd_index.CcdIndex(tmp_path / "ccd.sqlite")
+
+
+def test_iter_components_reads_quoted_and_text_field_values():
+    comps = {c["id"]: c for c in ccd_index.iter_components(COMPONENTS.splitlines(True))}
+    assert comps["ATP"]["name"] == "ADENOSINE-5'-TRIPHOSPHATE"
+    assert comps["ATG"]["name"].startswith("2-[(2-AMINO") and comps["ATG"]["name"].endswith("ACID")
+    assert comps["MG"]["formula"] == "Mg"
+    assert [ccd_index.is_ion(comps[c]) for c in ("ATP", "MG", "HOH")] == [False, True, False]
+
+
+def test_lookup_and_prefix_search(index):
+    assert index.lookup("ATP")["type"] == "NON-POLYMER"
+    assert index.lookup("XYZ") is None
+    assert "HOH" in index and "hoh" not in index
+    assert [c["code"] for c in index.search("at")] == ["ATG", "ATP"]
+    assert [c["code"] for c in index.search("", ions_only=True)] == ["MG", "ZN"]
+    assert [c["code"] for c in index.search("Z", ions_only=True)] == ["ZN"]
+    assert index.search("Q") == []
+
+
+def test_prefix_search_is_fast(index):
+    start = time.perf_counter()
+    for _ in range(1000):
+        index.search("AT")
+    assert (time.perf_counter() - start) / 1000 < 1e-3
+
+
+def test_index_is_built_in_background(tmp_path, monkeypatch):
+    source = tmp_path / "components.cif"
+    source.write_text(COMPONENTS)
+    monkeypatch.setattr(ccd_index, "CCD_INDEX", tmp_path / "data" / "ccd.sqlite")
+    monkeypatch.setattr(ccd_index, "CCD_SOURCE", None)
+    monkeypatch.setattr(ccd_index, "_index", None)
+    assert ccd_index.start_build() is None
+    assert ccd_index.get_index() is None
+
+    monkeypatch.setattr(ccd_index, "CCD_SOURCE", str(source))
+    # lookups never build the index themselves
+    assert ccd_index.get_index() is None
+    ccd_index.start_build().join()
+    index = ccd_index.get_index()
+    assert "MG" in index
+    assert ccd_index.start_build() is None
+    assert ccd_index.get_index() is index
+
+
+def test_validate_checks_ccd_codes(index):
+    sub = AF3Submission(name="x")
+    lig = sub.add_entity("ligand")
+    lig.ccd_codes = ["ATP", "NOPE"]
+    assert sub.validate() is None
+    assert sub.validate(ccd=index) == "Unknown CCD code: NOPE."
+    lig.ccd_codes = ["ATP"]
+    ion = sub.add_entity("ion")
+    ion.ion_name = "Mg"
+    assert sub.validate(ccd=index) == "Unknown ion CCD code: Mg."
+    ion.ion_name = "MG"
+    assert sub.validate(ccd=index) is None
+
+
+def test_typed_codes_are_upper_cased(index, monkeypatch):
+    sub = helpers.build_submission(
+        "x", ["a", "b"], ["ligand", "ion"], [1, 1], [], [""], ["atp, hoh"], ["mg"], ["", ""],
+    )
+    assert sub.entities[0].ccd_codes == ["ATP", "HOH"]
+    assert sub.entities[1].ion_name == "MG"
+    assert sub.validate(ccd=index) is None
+    # the input is not flagged for what validate accepts
+    monkeypatch.setattr(callbacks, "get_index", lambda: index)
+    assert not callbacks.ccd_suggestions("hoh, at")[1]
+    assert not callbacks.ccd_suggestions("mg", ions_only=True)[1]
+
+
+def test_ccd_suggestions(index, monkeypatch):
+    monkeypatch.setattr(callbacks, "get_index", lambda: index)
+    options, invalid = callbacks.ccd_suggestions("HOH, at")
+    assert [o.value for o in options] == ["HOH, ATG", "HOH, ATP"]
+    assert not invalid
+    assert callbacks.ccd_suggestions("NOPE, AT")[1]
+    assert callbacks.ccd_suggestions("Q")[1]
+    options, _ = callbacks.ccd_suggestions("", ions_only=True)
+    assert options == []
+    options, _ = callbacks.ccd_suggestions("m", ions_only=True)
+    assert [o.value for o in options] == ["MG"]
+
+    monkeypatch.setattr(callbacks, "get_index", lambda: None)
+    assert callbacks.ccd_suggestions("NOPE") == ([], False)
@@ -0,0 +1,169 @@
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+import admission
+import events
+import helpers
+import progress
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def make_job(base, name, **meta):
+    job_dir = base / name
+    job_dir.mkdir(parents=True)
+    helpers.write_job_meta(job_dir, **meta)
+    return job_dir
+
+
+def write_events(base, lines):
+    with open(base / events.EVENTS_NAME, "a") as fh:
+        for ev in lines:
+            fh.write(json.dumps(ev) + "\n")
+
+
+def test_record_appends_json_lines(tmp_path):
+    events.record(tmp_path, "submit", "j1", uid="alice", tokens=120)
+    events.record(tmp_path, "download", "j1", uid="alice")
+    lines = [json.loads(l) for l in (tmp_path / events.EVENTS_NAME).read_text().splitlines()]
+    assert [l["event"] for l in lines] == ["submit", "download"]
+    assert lines[0]["uid"] == "alice" and lines[0]["tokens"] == 120 and lines[0]["ts"]
+
+
+def test_rollup_reads_only_new_complete_lines(tmp_path):
+    write_events(tmp_path, [{"ts": 1, "event": "submit", "job": "j1", "uid": "alice"}])
+    with open(tmp_path / events.EVENTS_NAME, "a") as fh:
+        fh.write('{"ts": 2, "event": "downl')  # a line still being written
+    jobs = events.rollup(tmp_path)
+    assert jobs["j1"]["uid"] == "alice" and jobs["j1"]["downloads"] == 0
+    stored = json.loads((tmp_path / events.ROLLUP_NAME).read_text())
+
+    with open(tmp_path / events.EVENTS_NAME, "a") as fh:
+        fh.write('oad", "job": "j1"}\n')
+    jobs = events.rollup(tmp_path)
+    assert jobs["j1"]["downloads"] == 1
+    assert json.loads((tmp_path / events.ROLLUP_NAME).read_text())["offset"] > stored["offset"]
+
+    # a replaced log is read again from the start
+    (tmp_path / events.EVENTS_NAME).write_text("")
+    write_events(tmp_path, [{"ts": 3, "event": "submit", "job": "j2", "uid": "bob"}])
+    assert set(events.rollup(tmp_path)) == {"j2"}
+
+
+def test_summary(tmp_path):
+    acct = {"state": "COMPLETED", "submit": 100, "start": 160, "end": 3760, "elapsed_s": 3600, "gpus": 2}
+    write_events(tmp_path, [
+        {"ts": 90, "event": "submit", "job": "j1", "uid": "alice", "tokens": 300, "num_gpus": 2},
+        {"ts": 100, "event": "sbatch", "job": "j1"},
+        {"ts": 160, "event": "start", "job": "j1", "stage": "started", "at": 160},
+        {"ts": 200, "event": "stage", "job": "j1", "stage": "msa", "at": 170},
+        {"ts": 900, "event": "stage", "job": "j1", "stage": "inference", "at": 870},
+        {"ts": 3700, "event": "stage", "job": "j1", "stage": "packaging", "at": 3700},
+        {"ts": 3800, "event": "finish", "job": "j1", "stage": "completed",
+         "started_at": 160, "finished_at": 3760, "sacct": acct},
+        {"ts": 3900, "event": "download", "job": "j1", "uid": "alice"},
+        {"ts": 100, "event": "submit", "job": "j2", "uid": "bob", "tokens": 1500},
+        {"ts": 110, "event": "sbatch", "job": "j2"},
+        {"ts": 400, "event": "start", "job": "j2", "stage": "started", "at": 410},
+        {"ts": 500, "event": "finish", "job": "j2", "stage": "failed",
+         "started_at": 410, "finished_at": 500, "sacct": None},
+        {"ts": 100, "event": "submit", "job": "j3", "uid": "bob", "tokens": 10},
+        {"ts": 101, "event": "submit_failed", "job": "j3", "error": "invalid partition"},
+    ])
+    s = events.summary(tmp_path)
+    assert (s["jobs"], s["finished"], s["failed"], s["submit_failed"], s["downloads"]) == (3, 2, 1, 1, 1)
+    assert s["queue_wait"] == {"n": 2, "median": 180.0, "p90": 300}
+    assert round(s["gpu_hours"], 3) == round(2 + 90 / 3600, 3)
+    assert list(s["users"]) == ["alice", "bob"]
+    assert s["users"]["bob"] == {"jobs": 2, "failed": 2, "gpu_hours": 90 / 3600}
+    assert s["sizes"] == {"0–499": {"jobs": 1, "failed": 0}, "1000–1999": {"jobs": 1, "failed": 1}}
+    assert s["stages"]["msa"]["median"] == 700
+    assert s["stages"]["packaging"]["median"] == 60
+
+
+def test_stage_durations_skip_approximate_times():
+    job = {"stages": {"started": 100, "msa": 110, "templates": 400, "inference": 500, "packaging": 900},
+           "approx": ["templates"], "finished_at": 1000}
+    assert events.stage_durations(job) == {"started": 10, "inference": 400, "packaging": 100}
+
+
+def test_record_finish_waits_for_sacct(tmp_path, monkeypatch):
+    job = make_job(tmp_path, "j1", uid="alice", slurm_job_id="42")
+    acct = {"state": "RUNNING"}
+    monkeypatch.setattr(events, "sacct_record", lambda job_id: dict(acct))
+    state = {"stage": "completed", "error": None, "started_at": 1, "finished_at": 2}
+
+    assert not events.record_finish(job, state)
+    assert not (tmp_path / events.EVENTS_NAME).exists()
+
+    acct["state"] = "COMPLETED"
+    assert events.record_finish(job, state)
+    assert events.record_finish(job, state)  # recorded only once
+    lines = (tmp_path / events.EVENTS_NAME).read_text().splitlines()
+    assert len(lines) == 1
+    ev = json.loads(lines[0])
+    assert ev["event"] == "finish" and ev["uid"] == "alice" and ev["sacct"]["state"] == "COMPLETED"
+    assert helpers.read_job_meta(job)["finish_recorded"]
+
+
+def test_stages_are_recorded_once_across_restarts(tmp_path, monkeypatch):
+    job = make_job(tmp_path, "j1", uid="alice", status="submitted", slurm_job_id="42")
+    (job / "logs").mkdir()
+    (job / "logs" / "j1-42.out").write_text(
+        "AF3_DASHAPP stage=start time=1000\nRunning data pipeline...\n"
+    )
+    monkeypatch.setattr(events, "sacct_record", lambda job_id: pytest.fail("sacct run in a request"))
+    progress.job_progress(job)
+    progress._cache.clear()  # as after a restart, or in another worker
+    progress.job_progress(job)
+    lines = [json.loads(l) for l in (tmp_path / events.EVENTS_NAME).read_text().splitlines()]
+    assert [(l["event"], l["stage"]) for l in lines] == [("start", "started"), ("stage", "msa")]
+    assert helpers.read_job_meta(job)["stages_recorded"] == 2
+
+    # the final state is recorded by the tracker only
+    with open(job / "logs" / "j1-42.out", "a") as fh:
+        fh.write("AF3_DASHAPP stage=end time=2000\n")
+    assert progress.job_progress(job)["stage"] == "completed"
+    assert not helpers.read_job_meta(job).get("finish_recorded")
+    monkeypatch.setattr(events, "sacct_record", lambda job_id: None)
+    progress.track_jobs(tmp_path)
+    assert helpers.read_job_meta(job)["finish_recorded"]
+    kinds = [json.loads(l)["event"] for l in (tmp_path / events.EVENTS_NAME).read_text().splitlines()]
+    assert kinds == ["start", "stage", "stage", "finish"]
+
+
+def test_lifecycle_with_fake_slurm(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setenv("FAKE_SLURM_HOME", str(tmp_path / "slurm"))
+    monkeypatch.setenv("FAKE_AF3_PIPELINE_DELAY", "0")
+    monkeypatch.setenv("FAKE_AF3_SEED_DELAY", "0")
+    monkeypatch.setattr(helpers, "SBATCH", str(REPO / "bin" / "sbatch"))
+    monkeypatch.setattr(admission, "SQUEUE", str(REPO / "bin" / "squeue"))
+    monkeypatch.setattr(events, "SACCT", str(REPO / "bin" / "sacct"))
+    base = tmp_path / "jobs"
+    job = make_job(base, "j1_20250101T000000-00000000", uid="alice", email="a@x.com", num_gpus=1)
+    helpers.write_json_input(job, {
+        "name": "j1", "modelSeeds": [1],
+        "sequences": [{"protein": {"id": "A", "sequence": "MATT"}}],
+        "dialect": "alphafold3", "version": 2,
+    })
+    assert admission.admit(base, job)["status"] == "submitted"
+
+    deadline = time.time() + 30
+    while not helpers.read_job_meta(job).get("finish_recorded") and time.time() < deadline:
+        progress.track_jobs(base)
+        time.sleep(0.1)
+
+    lines = [json.loads(l) for l in (base / events.EVENTS_NAME).read_text().splitlines()]
+    kinds = [l["event"] for l in lines]
+    assert kinds[0] == "sbatch" and kinds[-1] == "finish" and "start" in kinds
+    # AF3's lines are dated by the template, not by when they were parsed
+    stages = [l for l in lines if l["event"] == "stage"]
+    assert "inference" in [l["stage"] for l in stages] and not any(l.get("approx") for l in stages)
+    record = events.rollup(base)[job.name]
+    assert record["outcome"] == "completed"
+    assert record["sacct"]["state"] == "COMPLETED" and record["sacct"]["elapsed_s"] is not None
+    assert events.sacct_record("999999") is None
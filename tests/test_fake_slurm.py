@@ -0,0 +1,248 @@
+import json
+import time
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import fake_slurm
+import helpers
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def fake_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_SLURM_HOME", str(tmp_path / "slurm"))
+    monkeypatch.setenv("FAKE_AF3_PIPELINE_DELAY", "0")
+    monkeypatch.setenv("FAKE_AF3_SEED_DELAY", "0")
+    monkeypatch.setattr(helpers, "SBATCH", str(REPO / "bin" / "sbatch"))
+    return tmp_path
+
+
+def wait_for_state(job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = fake_slurm.load_job(job_id)
+        if job and job["state"] not in fake_slurm.ACTIVE_STATES:
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_parse_time_limit():
+    assert fake_slurm.parse_time_limit("1-00:00:00") == 86400
+    assert fake_slurm.parse_time_limit("30") == 1800
+    assert fake_slurm.parse_time_limit("1:30") == 90
+    assert fake_slurm.parse_time_limit("2:00:00") == 7200
+    assert fake_slurm.parse_time_limit("1-2") == 93600
+    assert fake_slurm.parse_time_limit("UNLIMITED") is None
+
+
+def test_parse_directives_stops_at_first_command():
+    script = (
+        "#!/bin/bash\n"
+        "#SBATCH --job-name=abc_1\n"
+        "#SBATCH -t 10\n"
+        "#SBATCH --output=/tmp/logs/%x-%j.out\n"
+        "hostname\n"
+        "#SBATCH --partition=ignored\n"
+    )
+    d = fake_slurm.parse_directives(script)
+    assert d["job-name"] == "abc_1"
+    assert d["time"] == "10"
+    assert "partition" not in d
+    job = {"name": d["job-name"], "id": "7", "user": "me"}
+    assert fake_slurm.expand_filename(d["output"], job) == "/tmp/logs/abc_1-7.out"
+
+
+def test_sanitised_name():
+    assert fake_slurm.sanitised_name("My Job!") == "my_job"
+
+
+def test_end_to_end_submission(fake_env, monkeypatch):
+    monkeypatch.chdir(REPO)
+    job_dir = helpers.create_job_dir(fake_env / "jobs", "myjob", "20250101T000000")
+    helpers.write_json_input(job_dir, {
+        "name": "myjob",
+        "modelSeeds": [1],
+        "sequences": [{"protein": {"id": "A", "sequence": "MATT"}}],
+        "dialect": "alphafold3",
+        "version": 2,
+    })
+
+    job_id = helpers.write_and_submit_script(job_dir, email="me@x.com")
+    job = wait_for_state(job_id)
+    assert job["state"] == "COMPLETED"
+    assert job["name"] == "myjob_20250101T000000"
+
+    zip_path = job_dir / "myjob_20250101T000000.zip"
+    assert zip_path.is_file()
+    with zipfile.ZipFile(zip_path) as zf:
+        names = zf.namelist()
+    assert "myjob/myjob_ranking_scores.csv" in names
+    assert "myjob/seed-1_sample-0/myjob_seed-1_sample-0_model.cif" in names
+    assert "myjob/myjob_model.cif" in names
+
+    log = job_dir / "logs" / f"myjob_20250101T000000-{job_id}.out"
+    assert "Running model inference with seed 1" in log.read_text()
+    assert helpers.list_job_entries(fake_env / "jobs")[0]["email"] == "me@x.com"
+
+
+def test_end_to_end_multi_seed_fanout(fake_env, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setattr(helpers, "SEEDS_PER_GPU", 1)
+    job_dir = helpers.create_job_dir(fake_env / "jobs", "fan", "20250101T000000")
+    helpers.write_json_input(job_dir, {
+        "name": "fan",
+        "modelSeeds": [1, 2, 3],
+        "sequences": [{"protein": {"id": "A", "sequence": "MATT"}}],
+        "dialect": "alphafold3",
+        "version": 2,
+    })
+
+    job_id = helpers.write_and_submit_script(job_dir, email="me@x.com")
+    assert "--gres=gpu:3" in (job_dir / "submit.sh").read_text()
+    assert wait_for_state(job_id)["state"] == "COMPLETED"
+
+    with zipfile.ZipFile(job_dir / "fan_20250101T000000.zip") as zf:
+        names = set(zf.namelist())
+        ranking = zf.read("fan/fan_ranking_scores.csv").decode().splitlines()
+        seed, sample, _ = max((r.split(",") for r in ranking[1:]), key=lambda r: float(r[2]))
+        best = f"fan/seed-{seed}_sample-{sample}/fan_seed-{seed}_sample-{sample}_summary_confidences.json"
+        # the best-ranked sample is promoted to the top level
+        assert zf.read("fan/fan_summary_confidences.json") == zf.read(best)
+    assert {f"fan/seed-{s}_sample-0/fan_seed-{s}_sample-0_model.cif" for s in (1, 2, 3)} <= names
+    assert {"fan/fan_model.cif", "fan/fan_confidences.json"} <= names
+    assert len(ranking) == 1 + 3 * 5
+    assert not (job_dir / "fanout").exists()
+
+
+def test_fanout_split_failure_skips_tasks_and_merge(fake_env, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setattr(helpers, "SEEDS_PER_GPU", 1)
+    app_dir = fake_env / "app"
+    app_dir.mkdir()
+    calls = fake_env / "fanout-calls"
+    (app_dir / "fanout.py").write_text(
+        f"import sys\nopen({str(calls)!r}, 'a').write(sys.argv[1] + '\\n')\nsys.exit(1)\n"
+    )
+    monkeypatch.setattr(helpers, "APP_DIR", app_dir)
+    job_dir = helpers.create_job_dir(fake_env / "jobs", "fan", "20250101T000000")
+    helpers.write_json_input(job_dir, {
+        "name": "fan",
+        "modelSeeds": [1, 2],
+        "sequences": [{"protein": {"id": "A", "sequence": "MATT"}}],
+        "dialect": "alphafold3",
+        "version": 2,
+    })
+
+    job_id = helpers.write_and_submit_script(job_dir, email="me@x.com")
+    wait_for_state(job_id)
+
+    log = helpers.find_slurm_log(job_dir).read_text()
+    assert "Splitting the seeds over GPU tasks failed" in log
+    assert "stage=inference_done" in log and "status=1" in log
+    assert "Running model inference" not in log
+    assert calls.read_text().split() == ["split"]
+
+
+def _protein_job(base, name):
+    job_dir = helpers.create_job_dir(base, name, "20250101T000000")
+    helpers.write_json_input(job_dir, {
+        "name": name,
+        "modelSeeds": [1],
+        "sequences": [{"protein": {"id": "A", "sequence": "MATT"}}],
+        "dialect": "alphafold3",
+        "version": 2,
+    })
+    return job_dir
+
+
+def test_end_to_end_stage_local(fake_env, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setenv("AF3_SCRATCH_ROOT", str(fake_env / "scratch"))
+    job_dir = _protein_job(fake_env / "jobs", "staged")
+
+    job_id = helpers.write_and_submit_script(job_dir, email="me@x.com", stage_local=True)
+    assert wait_for_state(job_id)["state"] == "COMPLETED"
+
+    with zipfile.ZipFile(job_dir / "staged_20250101T000000.zip") as zf:
+        assert "staged/seed-1_sample-0/staged_seed-1_sample-0_model.cif" in zf.namelist()
+    # AF3 never wrote to the shared job directory and scratch was freed
+    assert sorted(p.name for p in job_dir.iterdir()) == [
+        "input.json", "logs", "staged_20250101T000000.zip", "submit.sh"
+    ]
+    assert list((fake_env / "scratch").iterdir()) == []
+
+
+def test_stage_local_salvages_failed_run(fake_env, monkeypatch):
+    monkeypatch.chdir(REPO)
+    monkeypatch.setenv("AF3_SCRATCH_ROOT", str(fake_env / "scratch"))
+    monkeypatch.setenv("FAKE_AF3_FAIL_RATE", "1")
+    job_dir = _protein_job(fake_env / "jobs", "broken")
+
+    job_id = helpers.write_and_submit_script(job_dir, email="me@x.com", stage_local=True)
+    wait_for_state(job_id)
+
+    assert not (job_dir / "broken_20250101T000000.zip").exists()
+    partial = job_dir / "broken_20250101T000000_partial.zip"
+    with zipfile.ZipFile(partial) as zf:
+        assert "broken/broken_data.json" in zf.namelist()
+    assert not list(job_dir.glob(".*.part"))
+    assert list((fake_env / "scratch").iterdir()) == []
+    assert helpers.list_job_entries(fake_env / "jobs")[0]["zip"] == str(partial)
+
+
+def test_end_to_end_precomputed_msa_skips_data_pipeline(fake_env, monkeypatch):
+    monkeypatch.chdir(REPO)
+    msa = fake_env / "upload.a3m"
+    msa.write_text(">query\nMATT\n")
+    job_dir = helpers.create_job_dir(
+        fake_env / "jobs", "premsa", "20250101T000000",
+        files={"msas/tok/upload.a3m": msa},
+    )
+    helpers.write_json_input(job_dir, {
+        "name": "premsa",
+        "modelSeeds": [1],
+        "sequences": [{"protein": {
+            "id": "A", "sequence": "MATT",
+            "unpairedMsaPath": "msas/tok/upload.a3m", "pairedMsa": "", "templates": [],
+        }}],
+        "dialect": "alphafold3",
+        "version": 2,
+    })
+
+    job_id = helpers.write_and_submit_script(job_dir, email="me@x.com")
+    assert "RUN_DATA_PIPELINE=false" in (job_dir / "submit.sh").read_text()
+    assert wait_for_state(job_id)["state"] == "COMPLETED"
+
+    log = (job_dir / "logs" / f"premsa_20250101T000000-{job_id}.out").read_text()
+    assert "Running data pipeline" not in log
+    with zipfile.ZipFile(job_dir / "premsa_20250101T000000.zip") as zf:
+        data = json.loads(zf.read("premsa/premsa_data.json"))
+    assert data["sequences"][0]["protein"]["unpairedMsa"] == ">query\nMATT\n"
+
+
+def test_sbatch_rejects_over_submit_limit(fake_env, monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_SLURM_MAX_SUBMITTED", "0")
+    script = fake_env / "job.sh"
+    script.write_text("#!/bin/bash\ntrue\n")
+    assert fake_slurm.main(["sbatch", str(script)]) == 1
+    assert "QOSMaxSubmitJobPerUserLimit" in capsys.readouterr().err
+
+
+def test_time_limit_and_sacct(fake_env, monkeypatch, capsys):
+    monkeypatch.chdir(fake_env)
+    script = fake_env / "job.sh"
+    script.write_text("#!/bin/bash\n#SBATCH --job-name=sleepy\n#SBATCH --time=0:1\nsleep 30\n")
+    assert fake_slurm.main(["sbatch", "--parsable", str(script)]) == 0
+    job_id = capsys.readouterr().out.strip()
+
+    job = wait_for_state(job_id)
+    assert job["state"] == "TIMEOUT"
+    assert "DUE TO TIME LIMIT" in (fake_env / f"slurm-{job_id}.out").read_text()
+
+    fake_slurm.main(["sacct", "-j", job_id, "-n", "-P", "--format=JobID,JobName,State"])
+    assert capsys.readouterr().out.strip() == f"{job_id}|sleepy|TIMEOUT"
+    assert json.loads(fake_slurm._job_file(job_id).read_text())["end"] is not None
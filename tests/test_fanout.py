@@ -0,0 +1,59 @@
+import csv
+import json
+
+import fanout
+
+
+def test_split_seeds():
+    assert fanout.split_seeds([1, 2, 3, 4, 5], 2) == [[1, 2, 3], [4, 5]]
+    assert fanout.split_seeds([1, 2], 4) == [[1], [2]]
+    assert fanout.split_seeds([7], 1) == [[7]]
+
+
+def test_top_level_kind():
+    assert fanout._top_level_kind("job1_seed-1_sample-0_summary_confidences.json") == "summary_confidences.json"
+    assert fanout._top_level_kind("job1_seed-1_sample-0_confidences.json") == "confidences.json"
+    assert fanout._top_level_kind("model.cif") == "model.cif"
+    assert fanout._top_level_kind("job1_data.json") is None
+
+
+def make_task_output(workdir, task, seeds, scores):
+    out = workdir / "fanout" / f"task-{task}" / "job1"
+    out.mkdir(parents=True)
+    rows = []
+    for seed, score in zip(seeds, scores):
+        sample = out / f"seed-{seed}_sample-0"
+        sample.mkdir()
+        for fname in fanout.TOP_LEVEL_FILES:
+            # AF3 3.0.1 names
+            (sample / f"job1_{sample.name}_{fname}").write_text(f"{fname} seed {seed}")
+        rows.append(f"{seed},0,{score}")
+    (out / "job1_ranking_scores.csv").write_text("seed,sample,ranking_score\n" + "\n".join(rows) + "\n")
+    (out / "TERMS_OF_USE.md").write_text("terms")
+
+
+def test_split_and_merge(tmp_path):
+    data_dir = tmp_path / "fanout" / "data" / "job1"
+    data_dir.mkdir(parents=True)
+    (data_dir / "job1_data.json").write_text(json.dumps({"name": "job1", "modelSeeds": [11, 22, 33]}))
+
+    inputs = fanout.split(tmp_path, 2)
+    assert [json.loads(p.read_text())["modelSeeds"] for p in inputs] == [[11, 22], [33]]
+
+    make_task_output(tmp_path, 0, [11, 22], [0.5, 0.9])
+    make_task_output(tmp_path, 1, [33], [0.7])
+    merged = fanout.merge(tmp_path, "Job1")
+
+    assert merged == tmp_path / "Job1"
+    assert sorted(p.name for p in merged.glob("seed-*")) == [
+        "seed-11_sample-0", "seed-22_sample-0", "seed-33_sample-0",
+    ]
+    with open(merged / "job1_ranking_scores.csv") as fh:
+        assert [r["seed"] for r in csv.DictReader(fh)] == ["11", "22", "33"]
+    # the best-ranked sample is promoted to the top level
+    assert (merged / "job1_model.cif").read_text() == "model.cif seed 22"
+    assert (merged / "job1_confidences.json").read_text() == "confidences.json seed 22"
+    assert (merged / "job1_summary_confidences.json").read_text() == "summary_confidences.json seed 22"
+    assert (merged / "job1_data.json").is_file()
+    assert (merged / "TERMS_OF_USE.md").is_file()
+    assert not (tmp_path / "fanout").exists()
@@ -1,4 +1,9 @@
 import json
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
 
 import helpers
 
@@ -10,6 +15,83 @@ def test_create_job_dir(tmp_path):
     assert (job_dir / "logs").exists() and (job_dir / "logs").is_dir()
 
 
+def test_create_job_dir_is_atomic_and_unique(tmp_path):
+    job_dir = helpers.create_job_dir(
+        tmp_path, "jobA", "20250101T000000-aaaa0000",
+        files={"input.json": "{}", "meta.json": b'{"email": "me@x.com"}'},
+    )
+    assert (job_dir / "input.json").read_text() == "{}"
+    assert helpers.read_job_meta(job_dir) == {"email": "me@x.com"}
+    with pytest.raises(FileExistsError):
+        helpers.create_job_dir(tmp_path, "jobA", "20250101T000000-aaaa0000")
+    # nothing is left behind in the staging area
+    assert list((tmp_path / ".staging").iterdir()) == []
+
+
+def test_create_job_dir_links_files_into_subdirectories(tmp_path):
+    upload = tmp_path / "upload.a3m"
+    upload.write_text(">q\nMATT\n")
+    job_dir = helpers.create_job_dir(
+        tmp_path / "jobs", "jobA", "20250101T000000-aaaa0000",
+        files={"msas/abc/upload.a3m": upload},
+    )
+    assert (job_dir / "msas" / "abc" / "upload.a3m").read_text() == ">q\nMATT\n"
+
+
+def test_new_run_id():
+    ids = {helpers.new_run_id() for _ in range(100)}
+    assert len(ids) == 100
+    run_id = ids.pop()
+    assert re.fullmatch(r"\d{8}T\d{6}-[0-9a-f]{8}", run_id)
+    assert helpers.parse_run_timestamp(run_id).year >= 2025
+    assert helpers.parse_run_timestamp("20250101T010101").hour == 1
+
+
+def test_claim_idempotency_key(tmp_path):
+    key = "0" * 32
+    assert helpers.claim_idempotency_key(tmp_path, key, "job_1") is None
+    assert helpers.claim_idempotency_key(tmp_path, key, "job_2") == "job_1"
+    assert helpers.claim_idempotency_key(tmp_path, "1" * 32, "job_3") is None
+
+    helpers.release_idempotency_key(tmp_path, key)
+    assert helpers.claim_idempotency_key(tmp_path, key, "job_4") is None
+    helpers.prune_idempotency_keys(tmp_path, max_age=-1)
+    assert not list((tmp_path / ".keys").iterdir())
+
+
+def test_create_job_dir_rejects_path_names(tmp_path):
+    for name in ("x/y", ".hidden", "../up", "my job", "a;b c", "$(id)", "`id`", "a'b", "-x"):
+        assert not helpers.valid_job_name(name)
+        with pytest.raises(ValueError):
+            helpers.create_job_dir(tmp_path, name, "20250101T000000-aaaa0000")
+    assert helpers.valid_job_name("my_job.v2-1")
+    assert not (tmp_path / ".staging").exists()
+
+
+def test_write_job_meta_merges(tmp_path):
+    helpers.write_job_meta(tmp_path, status="created", email="me@x.com")
+    helpers.write_job_meta(tmp_path, status="submitted")
+    assert helpers.read_job_meta(tmp_path) == {"status": "submitted", "email": "me@x.com"}
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def _write_fields(job_dir, writer, count):
+    for i in range(count):
+        helpers.write_job_meta(job_dir, **{f"{writer}-{i}": i})
+
+
+def test_write_job_meta_concurrent_writers_keep_every_field(tmp_path):
+    # the releaser, the tracker and request workers run in threads of
+    # several processes
+    with ThreadPoolExecutor(max_workers=4) as threads, \
+            ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context("fork")) as procs:
+        futures = [threads.submit(_write_fields, tmp_path, f"t{w}", 20) for w in range(4)]
+        futures += [procs.submit(_write_fields, tmp_path, f"p{w}", 20) for w in range(4)]
+        for f in futures:
+            f.result()
+    assert len(helpers.read_job_meta(tmp_path)) == 8 * 20
+
+
 def test_write_json_input(tmp_path):
     job_dir = tmp_path / "jobB"
     job_dir.mkdir()
@@ -38,14 +120,51 @@ def test_render_slurm_script(tmp_path):
     assert "20250101T000000" in script
 
 
+def test_render_slurm_script_gpus(tmp_path):
+    tpl = tmp_path / "tpl.sh"
+    tpl.write_text("#SBATCH --gres=gpu:{{NUM_GPUS}}\npython3 {{APP_DIR}}/fanout.py\n")
+    script = helpers.render_slurm_script("j", "e", "/w", "ts", template_path=tpl, num_gpus=3)
+    assert "--gres=gpu:3" in script
+    assert f"{helpers.APP_DIR}/fanout.py" in script
+
+
+def test_render_slurm_script_stage_local(tmp_path):
+    tpl = tmp_path / "tpl.sh"
+    tpl.write_text("STAGE_LOCAL={{STAGE_LOCAL}}\n")
+    assert helpers.render_slurm_script("j", "e", "/w", "ts", template_path=tpl) == "STAGE_LOCAL=0\n"
+    script = helpers.render_slurm_script("j", "e", "/w", "ts", template_path=tpl, stage_local=True)
+    assert script == "STAGE_LOCAL=1\n"
+
+
+def test_render_slurm_script_data_pipeline(tmp_path):
+    tpl = tmp_path / "tpl.sh"
+    tpl.write_text("RUN_DATA_PIPELINE={{RUN_DATA_PIPELINE}}\n")
+    assert helpers.render_slurm_script("j", "e", "/w", "ts", template_path=tpl) == "RUN_DATA_PIPELINE=true\n"
+    script = helpers.render_slurm_script("j", "e", "/w", "ts", template_path=tpl, run_data_pipeline=False)
+    assert script == "RUN_DATA_PIPELINE=false\n"
+
+
+def test_plan_gpu_tasks(monkeypatch):
+    monkeypatch.setattr(helpers, "SEEDS_PER_GPU", 5)
+    monkeypatch.setattr(helpers, "MAX_GPUS_PER_JOB", 4)
+    assert helpers.plan_gpu_tasks(1) == 1
+    assert helpers.plan_gpu_tasks(5) == 1
+    assert helpers.plan_gpu_tasks(6) == 2
+    assert helpers.plan_gpu_tasks(100) == 4
+
+
 def test_list_job_entries(tmp_path):
     # create two valid job dirs
-    for name, ts in [("run1", "20250101T010101"), ("run2", "20250102T020202")]:
+    for name, ts in [("run1", "20250101T010101"), ("run2", "20250102T020202-abcd1234")]:
         d = tmp_path / f"{name}_{ts}"
         d.mkdir()
         # create a ZIP fixture
         z = d / f"{name}_{ts}.zip"
         z.write_text("dummy")
+    # staging areas and unrelated folders are ignored
+    (tmp_path / ".staging" / "abc").mkdir(parents=True)
+    (tmp_path / "notajob").mkdir()
+    (tmp_path / "bad_timestamp").mkdir()
     entries = helpers.list_job_entries(tmp_path)
     assert len(entries) == 2
     # Check format of timestamp
@@ -53,6 +172,65 @@ def test_list_job_entries(tmp_path):
     assert entries[1]["timestamp"].startswith("2025/01/")
 
 
+def test_list_job_entries_includes_running_jobs(tmp_path):
+    (tmp_path / "running_20250101T010101-abcd1234").mkdir()
+    entries = helpers.list_job_entries(tmp_path)
+    assert entries == [{
+        "name": "running",
+        "dir": "running_20250101T010101-abcd1234",
+        "timestamp": "2025/01/01 - 01:01:01",
+        "email": None,
+        "status": "in progress",
+        "zip": None,
+    }]
+
+
+def test_find_slurm_log(tmp_path):
+    job_dir = tmp_path / "job_20250101T000000-abcd1234"
+    (job_dir / "logs").mkdir(parents=True)
+    (job_dir / "logs" / "sbatch.out").write_text("Submitted batch job 7\n")
+    assert helpers.find_slurm_log(job_dir) is None
+    log = job_dir / "logs" / f"{job_dir.name}-7.out"
+    log.write_text("hello\n")
+    assert helpers.find_slurm_log(job_dir) == log
+    helpers.write_job_meta(job_dir, slurm_job_id="7")
+    assert helpers.find_slurm_log(job_dir) == log
+
+
+def test_read_log_chunk_is_incremental(tmp_path):
+    log = tmp_path / "job.out"
+    log.write_text("line 1\nline 2\npart")
+    text, offset = helpers.read_log_chunk(log, 0)
+    # the unterminated line is held back until it is complete
+    assert text == "line 1\nline 2\n"
+    assert helpers.read_log_chunk(log, offset) == ("", offset)
+
+    with open(log, "a") as fh:
+        fh.write("ial\nline 4\n")
+    text, offset = helpers.read_log_chunk(log, offset)
+    assert text == "partial\nline 4\n"
+    assert offset == log.stat().st_size
+
+
+def test_read_log_chunk_caps_bytes_and_handles_truncation(tmp_path):
+    log = tmp_path / "job.out"
+    log.write_text("".join(f"line {i}\n" for i in range(1000)))
+    text, offset = helpers.read_log_chunk(log, 0, max_bytes=100)
+    assert len(text) <= 100 and text.endswith("\n")
+    log.write_text("new\n")
+    assert helpers.read_log_chunk(log, offset) == ("new\n", 4)
+
+
+def test_initial_log_offset_starts_on_a_line(tmp_path):
+    log = tmp_path / "job.out"
+    log.write_text("".join(f"line {i}\n" for i in range(1000)))
+    offset = helpers.initial_log_offset(log, tail_bytes=50)
+    assert log.stat().st_size - offset <= 50
+    text, _ = helpers.read_log_chunk(log, offset)
+    assert text.startswith("line ") and text.endswith("line 999\n")
+    assert helpers.initial_log_offset(log, tail_bytes=10**6) == 0
+
+
 class DummyResult:
     def __init__(self, out="Submitted batch job 4242\n", err=""):
         self.stdout = out
@@ -68,7 +246,7 @@ def test_write_and_submit_script(tmp_path, monkeypatch):
     monkeypatch.setattr(
         helpers,
         "render_slurm_script",
-        lambda job_name, email, workdir, timestamp, template_path=None: "#!/bin/bash\necho hi\n",
+        lambda job_name, email, workdir, timestamp, template_path=None, **kwargs: "#!/bin/bash\necho hi\n",
     )
 
     # call the function
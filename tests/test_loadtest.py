@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+import callbacks
+import loadtest
+from app import app
+
+
+class FlaskTransport:
+    def __init__(self):
+        self.client = app.server.test_client()
+
+    def post(self, path, body, headers):
+        resp = self.client.post(path, data=body, headers=headers)
+        return resp.status_code, resp.data
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    base = tmp_path / "jobs"
+    loadtest.make_synthetic_jobs(base, 3, zip_bytes=128)
+    monkeypatch.setattr(callbacks, "JOBS_DIR", base)
+    return base
+
+
+def test_percentile():
+    values = sorted(float(v) for v in range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([], 95) == 0.0
+
+
+def test_make_synthetic_jobs(jobs):
+    assert len(list(jobs.iterdir())) == 3
+    assert all(next(d.glob("*.zip"), None) for d in jobs.iterdir())
+
+
+def test_session_replays_every_callback(jobs):
+    stats = loadtest.Stats()
+    session = loadtest.Session(FlaskTransport(), stats, random.Random(1))
+    session.run(submit=False)
+
+    summary = stats.summary()
+    assert set(summary) == {
+        "update_entity_list", "render_fields", "generate_json",
+        "download_json", "update_history", "download_results",
+    }
+    assert all(s["errors"] == 0 for s in summary.values())
+    assert len(session.history) == 3
+    assert summary["download_results"]["avg_response_bytes"] > 0
+
+
+def test_run_load_reports_per_callback(jobs):
+    summary, elapsed = loadtest.run_load(
+        "", users=2, sessions=2, submit=False, transport_factory=FlaskTransport
+    )
+    assert summary["generate_json"]["count"] == 4
+    assert summary["generate_json"]["p99_ms"] >= summary["generate_json"]["p50_ms"]
+    assert "update_history" in loadtest.format_report(summary, elapsed)
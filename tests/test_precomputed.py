@@ -0,0 +1,160 @@
+import base64
+import json
+
+import pytest
+
+import precomputed
+from submission import AF3Submission
+
+SEQ = "MATTKLV"
+
+TEMPLATE_CIF = """\
+data_tmpl
+#
+loop_
+_entity_poly_seq.entity_id
+_entity_poly_seq.num
+_entity_poly_seq.mon_id
+_entity_poly_seq.hetero
+1 1 GLY n
+1 2 THR n
+1 3 THR n
+1 4 LYS n
+1 5 LEU n
+#
+"""
+
+ATOM_SITE_CIF = """\
+data_tmpl
+loop_
+_atom_site.group_PDB
+_atom_site.label_atom_id
+_atom_site.label_comp_id
+_atom_site.label_asym_id
+_atom_site.label_seq_id
+ATOM N MET A 1
+ATOM CA MET A 1
+ATOM CA ALA A 2
+ATOM CA GLY B 1
+#
+"""
+
+
+def encode(text: str) -> str:
+    return "data:application/octet-stream;base64," + base64.b64encode(text.encode()).decode()
+
+
+def test_save_upload_and_references(tmp_path):
+    ref = precomputed.save_upload(tmp_path, "../my msa.a3m", encode(f">q\n{SEQ}\n"))
+    token, name = ref.split("/")
+    assert name == "my_msa.a3m"
+    assert precomputed.upload_path(tmp_path, ref).read_text() == f">q\n{SEQ}\n"
+    assert precomputed.input_path(ref) == f"msas/{token}/my_msa.a3m"
+    for bad in ("../etc/passwd", f"{token}/../x", "x/y"):
+        with pytest.raises(ValueError):
+            precomputed.upload_path(tmp_path, bad)
+    with pytest.raises(ValueError):
+        precomputed.save_upload(tmp_path, "x", "not base64")
+
+
+def test_a3m_query(tmp_path):
+    path = tmp_path / "a.a3m"
+    path.write_text(f"#A3M\n>query\nMAT-\nTKLV\n>hit\nMA-TKLV\n")
+    assert precomputed.a3m_query(path) == SEQ
+    path.write_text("")
+    assert precomputed.a3m_query(path) is None
+
+
+def test_template_sequence_and_mapping():
+    assert precomputed.template_sequence(TEMPLATE_CIF) == "GTTKL"
+    assert precomputed.template_sequence(ATOM_SITE_CIF) == "MA"
+    query_idx, template_idx = precomputed.template_mapping(SEQ, "GTTKL")
+    assert [SEQ[i] for i in query_idx] == ["T", "T", "K", "L"]
+    assert template_idx == [1, 2, 3, 4]
+
+
+def test_attach_uploads_to_submission(tmp_path):
+    unpaired = precomputed.save_upload(tmp_path, "u.a3m", encode(f">q\n{SEQ}\n>h\nMATTKLI\n"))
+    template = precomputed.save_upload(tmp_path, "t.cif", encode(TEMPLATE_CIF))
+    sub = AF3Submission(name="x")
+    ent = sub.add_entity("protein")
+    ent.sequence = SEQ
+    ent.precomputed = {"unpaired": unpaired, "templates": [template]}
+
+    assert precomputed.attach(sub, tmp_path) is None
+    body = sub.to_json()["sequences"][0]["protein"]
+    assert body["unpairedMsaPath"] == precomputed.input_path(unpaired)
+    assert body["pairedMsa"] == ""
+    assert body["templates"] == [{
+        "mmcifPath": precomputed.input_path(template),
+        "queryIndices": [2, 3, 4, 5],
+        "templateIndices": [1, 2, 3, 4],
+    }]
+    assert not precomputed.needs_data_pipeline(sub.to_json())
+    assert set(precomputed.job_files(tmp_path, sub.to_json())) == {
+        precomputed.input_path(unpaired), precomputed.input_path(template)
+    }
+
+    ent.sequence = "MKKK"
+    assert "does not match" in precomputed.attach(sub, tmp_path)
+
+
+def test_unpaired_msa_only_keeps_searches(tmp_path):
+    unpaired = precomputed.save_upload(tmp_path, "u.a3m", encode(f">q\n{SEQ}\n"))
+    sub = AF3Submission(name="x")
+    ent = sub.add_entity("protein")
+    ent.sequence = SEQ
+    ent.precomputed = {"unpaired": unpaired}
+    other = sub.add_entity("protein")
+    other.sequence = "MKKK"
+    assert precomputed.attach(sub, tmp_path) is None
+
+    # the pipeline still runs for the second chain: it also searches the
+    # first chain's paired MSA and templates
+    body = sub.to_json()["sequences"][0]["protein"]
+    assert body["unpairedMsaPath"] == precomputed.input_path(unpaired)
+    assert "pairedMsa" not in body and "templates" not in body
+    assert precomputed.needs_data_pipeline(sub.to_json())
+
+    # without the pipeline they are given explicitly as empty
+    sub.entities.remove(other)
+    body = sub.to_json()["sequences"][0]["protein"]
+    assert body["pairedMsa"] == "" and body["templates"] == []
+    assert not precomputed.needs_data_pipeline(sub.to_json())
+
+
+def test_validate_requires_unpaired_msa():
+    sub = AF3Submission(name="x")
+    ent = sub.add_entity("protein")
+    ent.sequence = SEQ
+    ent.paired_msa_path = "msas/x/p.a3m"
+    assert sub.validate() == "Paired MSAs and templates need an unpaired MSA as well."
+
+
+def test_import_data_json_matches_by_sequence(tmp_path):
+    data = {
+        "name": "old",
+        "sequences": [
+            {"protein": {"id": "A", "sequence": SEQ, "unpairedMsa": f">q\n{SEQ}\n",
+                         "pairedMsa": f">q\n{SEQ}\n",
+                         "templates": [{"mmcif": TEMPLATE_CIF, "queryIndices": [0], "templateIndices": [0]}]}},
+            {"protein": {"id": "B", "sequence": "MKKK"}},
+            {"ligand": {"id": "C", "ccdCodes": ["ATP"]}},
+        ],
+    }
+    token, n_chains = precomputed.import_data_json(tmp_path, encode(json.dumps(data)))
+    assert n_chains == 1
+    assert precomputed.data_json_record(tmp_path, token, "MKKK") is None
+
+    sub = AF3Submission(name="x")
+    for seq in (SEQ, "MKKK"):
+        sub.add_entity("protein").sequence = seq
+    assert precomputed.attach(sub, tmp_path, token) is None
+    first, second = (e["protein"] for e in sub.to_json()["sequences"])
+    assert first["pairedMsaPath"].startswith(f"msas/{token}/")
+    assert first["templates"][0]["queryIndices"] == [0]
+    assert "unpairedMsaPath" not in second
+    assert precomputed.needs_data_pipeline(sub.to_json())
+
+    with pytest.raises(ValueError):
+        precomputed.import_data_json(tmp_path, encode("[]"))
@@ -0,0 +1,132 @@
+import helpers
+import progress
+
+LOG_HEAD = """AF3_DASHAPP stage=start time=1000
+gpu-node-01
+Processing fold input job1
+Running data pipeline...
+Processing chain A
+Getting protein MSAs took 512.10 seconds
+"""
+LOG_TAIL = """Getting protein templates took 20.40 seconds
+Processing chain A took 532.60 seconds
+Running data pipeline took 533.00 seconds
+Predicting 3D structure for job1 with 2 seed(s)...
+Featurising data with 2 seed(s)...
+Running model inference with seed 1...
+Running model inference with seed 1 took 90.00 seconds.
+Running model inference with seed 2...
+"""
+LOG_END = """Running model inference with seed 2 took 90.00 seconds.
+Writing outputs with 2 seed(s)...
+AF3_DASHAPP stage=inference_done time=1800 status=0
+AF3_DASHAPP stage=packaging time=1800
+AF3_DASHAPP stage=end time=1900
+"""
+
+
+def make_job(tmp_path, name="job1_20250101T000000-abcd1234"):
+    job_dir = tmp_path / name
+    (job_dir / "logs").mkdir(parents=True)
+    helpers.write_job_meta(job_dir, slurm_job_id="42", tokens=100, num_seeds=2)
+    return job_dir, job_dir / "logs" / f"{name}-42.out"
+
+
+def test_parse_lines_tracks_stages():
+    state = progress.parse_lines(progress.new_state(), LOG_HEAD, now=1100)
+    assert state["stage"] == "templates"
+    assert state["started_at"] == 1000
+
+    progress.parse_lines(state, LOG_TAIL, now=1200)
+    assert state["stage"] == "inference"
+    assert (state["seeds_done"], state["seeds_total"]) == (1, 2)
+    assert "(1/2 seeds)" in progress.describe(state, 600)
+
+    progress.parse_lines(state, LOG_END, now=1300)
+    assert state["stage"] == "completed"
+    assert state["finished_at"] == 1900
+
+
+def test_parse_lines_uses_line_stamps():
+    state = progress.parse_lines(progress.new_state(), (
+        "AF3_DASHAPP stage=start time=1000\n"
+        "[1010] Running data pipeline...\n"
+        "[1500] Featurising data with 1 seed(s)...\n"
+        "Running model inference with seed 1...\n"
+    ), now=1600)
+    assert state["stage"] == "inference" and state["stage_since"] == 1600
+    assert state["stages"] == [
+        ["started", 1000, True], ["msa", 1010, True], ["featurising", 1500, True], ["inference", 1600, False],
+    ]
+
+
+def test_parse_lines_detects_failures():
+    state = progress.parse_lines(progress.new_state(), LOG_HEAD + (
+        "slurmstepd: error: *** JOB 42 ON node CANCELLED AT 2025-01-01T00:00:00 DUE TO TIME LIMIT ***\n"
+    ))
+    assert state["stage"] == "failed"
+    assert "TIME LIMIT" in state["error"]
+
+    state = progress.parse_lines(progress.new_state(), (
+        "AF3_DASHAPP stage=start time=1\n"
+        "AF3_DASHAPP stage=inference_done time=2 status=1\n"
+        "AF3_DASHAPP stage=end time=3\n"
+    ))
+    assert state["stage"] == "failed"
+
+
+def test_job_progress_is_incremental(tmp_path, monkeypatch):
+    job_dir, log = make_job(tmp_path)
+    log.write_text(LOG_HEAD)
+    assert progress.job_progress(job_dir)["stage"] == "templates"
+
+    parsed = []
+    original = progress.parse_lines
+    monkeypatch.setattr(progress, "parse_lines", lambda s, t, now=None: parsed.append(t) or original(s, t, now))
+    with open(log, "a") as fh:
+        fh.write(LOG_TAIL)
+    assert progress.job_progress(job_dir)["stage"] == "inference"
+    # only the appended text was parsed
+    assert parsed == [LOG_TAIL]
+
+    with open(log, "a") as fh:
+        fh.write(LOG_END)
+    assert progress.job_progress(job_dir)["stage"] == "completed"
+    # the final state is persisted and the log is not read again
+    assert helpers.read_job_meta(job_dir)["progress"]["finished_at"] == 1900
+    # and its parser state is dropped from the per-process caches
+    assert str(log) not in progress._cache and str(log) not in progress._job_locks
+    log.unlink()
+    assert progress.job_progress(job_dir)["stage"] == "completed"
+
+
+def test_count_tokens():
+    fold_input = {"sequences": [
+        {"protein": {"id": ["A", "B"], "sequence": "MATT"}},
+        {"ligand": {"id": "C", "smiles": "CC(=O)Cl"}},
+        {"ligand": {"id": "D", "ccdCodes": ["MG"]}},
+        {"ligand": {"id": "E", "ccdCodes": ["ATP"]}},
+    ]}
+    assert progress.count_tokens(fold_input) == 8 + 4 + 1 + progress.CCD_TOKENS_GUESS
+
+
+def test_eta_model_fit_and_predict():
+    samples = [(t, s, 300 + 2 * t + 0.5 * t * s) for t in (100, 400, 900) for s in (1, 3)]
+    model = progress.EtaModel.fit(samples)
+    assert abs(model.predict(600, 2) - (300 + 1200 + 600)) < 1e-3
+    assert progress.EtaModel().predict(10, 1) is None
+    assert progress.EtaModel.fit([(100, 1, 600.0)]).predict(5000, 5) == 600.0
+
+
+def test_annotate_entries_uses_completed_jobs(tmp_path):
+    done, done_log = make_job(tmp_path, "old_20250101T000000-aaaa0000")
+    done_log.write_text(LOG_HEAD + LOG_TAIL + LOG_END)
+    (done / f"{done.name}.zip").write_text("zip")
+
+    running, running_log = make_job(tmp_path, "new_20250102T000000-bbbb0000")
+    running_log.write_text(LOG_HEAD)
+
+    entries = progress.annotate_entries(tmp_path, helpers.list_job_entries(tmp_path))
+    by_name = {e["name"]: e for e in entries}
+    assert by_name["old"]["progress"] == "Completed"
+    assert by_name["new"]["progress"].startswith("Template search, ~")
@@ -70,3 +70,58 @@ def test_to_json_structure():
     # check ion entry
     ion = data["sequences"][2]["ligand"]
     assert ion["ccdCodes"] == ["NA"]
+
+
+def test_to_json_is_stable_across_calls():
+    sub = AF3Submission(name="job1")
+    p = sub.add_entity("protein", copies=2)
+    p.sequence = "MATT"
+    first = sub.to_json()
+    second = sub.to_json()
+    assert first == second
+    assert first["sequences"][0]["protein"]["id"] == ["A", "B"]
+
+
+def test_labels_continue_past_z():
+    assert AF3Submission._label(25) == "Z"
+    assert AF3Submission._label(26) == "AA"
+    assert AF3Submission._label(27) == "AB"
+
+
+def test_serialize_is_compact_and_hashed():
+    import hashlib
+    import json
+
+    sub = AF3Submission(name="job1")
+    sub.model_seeds = [7]
+    i = sub.add_entity("ion")
+    i.ion_name = "NA"
+    payload, digest = sub.serialize()
+    assert b"\n" not in payload and b", " not in payload
+    assert json.loads(payload) == sub.to_json()
+    assert digest == hashlib.sha256(payload).hexdigest()
+    assert sub.serialize() == (payload, digest)
+
+
+def test_dumps_backends_agree(monkeypatch):
+    import submission
+
+    pytest.importorskip("orjson")
+    data = {"name": "ünïcode", "modelSeeds": [1], "sequences": [{"protein": {"id": ["A", "B"], "sequence": "MA"}}]}
+    fast = submission.dumps(data)
+    monkeypatch.setattr(submission, "orjson", None)
+    assert submission.dumps(data) == fast
+
+
+def test_multiple_seeds_are_distinct_and_validated():
+    sub = AF3Submission(name="job1")
+    i = sub.add_entity("ion")
+    i.ion_name = "NA"
+    sub.num_seeds = 8
+    seeds = sub.to_json()["modelSeeds"]
+    assert len(seeds) == len(set(seeds)) == 8
+    assert sub.to_json()["modelSeeds"] == seeds
+    sub.num_seeds = 0
+    assert sub.validate() == "Number of seeds must be between 1 and 100."
+    sub.num_seeds = 21
+    assert sub.validate(max_seeds=20) == "Number of seeds must be between 1 and 20."